@@ -13,4 +13,5 @@ vllm serve deepseek-ai/DeepSeek-R1-Distill-Qwen-7B\
  --seed 2024\
  --quantization bitsandbytes\
  --load-format bitsandbytes\
- --kv-cache-dtype auto
\ No newline at end of file
+ --kv-cache-dtype auto\
+ --enable-prefix-caching
\ No newline at end of file
@@ -0,0 +1,242 @@
+"""
+Disk-backed cache of model responses.
+
+CachingModel wraps any smolagents Model and stores its responses in SQLite,
+keyed by a hash of everything that determines a completion: the model id, the
+messages, the tools, the stop sequences, the grammar and the sampling
+parameters. Reruns of an issue with the same prompts are then answered from
+disk, and with replay_only set a run fails instead of querying the model, which
+makes benchmark reruns deterministic.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from smolagents.models import ChatMessage, Model, get_dict_from_nested_dataclasses, get_tool_json_schema
+from smolagents.tools import Tool
+
+DEFAULT_CACHE_PATH = "llm_cache.db"
+
+class CacheMissError(RuntimeError):
+    """Raised in replay only mode when a request is not in the cache."""
+
+def request_key(model_id: str, messages: List[Dict], stop_sequences: Optional[List[str]] = None,
+                grammar: Optional[str] = None, tools_to_call_from: Optional[List[Tool]] = None,
+                params: Optional[Dict] = None) -> str:
+    """
+    Hash the inputs determining a completion.
+
+    Args:
+        model_id: Model identifier.
+        messages: Messages of the request.
+        stop_sequences: Stop sequences of the request.
+        grammar: Grammar constraining the response.
+        tools_to_call_from: Tools the model may call.
+        params: Sampling and other parameters passed to the model.
+
+    Returns:
+        The hex SHA-256 of the canonical JSON of the inputs.
+    """
+    request = {
+        "model_id": model_id,
+        "messages": messages,
+        "stop_sequences": stop_sequences,
+        "grammar": grammar,
+        "tools": [get_tool_json_schema(tool) for tool in tools_to_call_from] if tools_to_call_from else None,
+        "params": params or {},
+    }
+    # default=str covers images and other non JSON values, which are rare in these prompts
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class ResponseStore:
+    """
+    SQLite store of serialized responses, evicted least recently used first past a size limit.
+
+    Safe to share between threads; several processes can share the file too, through SQLite's locking.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_size_bytes: Optional[int] = None):
+        """
+        Args:
+            path: Path to the SQLite file, created if missing.
+            max_size_bytes: Total size of the stored responses to evict down to, None for no limit.
+        """
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS response (
+                key TEXT PRIMARY KEY,
+                model_id TEXT NOT NULL,
+                message TEXT NOT NULL,
+                input_tokens INTEGER,
+                output_tokens INTEGER,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS response_last_used ON response (last_used)")
+        self.conn.commit()
+
+    def get(self, key: str) -> Optional[tuple]:
+        """
+        Get a stored response, marking it as used.
+
+        Returns:
+            A tuple (message JSON, input tokens, output tokens), or None if the key is not stored.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT message, input_tokens, output_tokens FROM response WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self.conn.execute("UPDATE response SET last_used = ? WHERE key = ?", (time.time(), key))
+                self.conn.commit()
+        return row
+
+    def put(self, key: str, model_id: str, message: str,
+            input_tokens: Optional[int] = None, output_tokens: Optional[int] = None):
+        """Store a response, then evict the least recently used ones if the store is over its size limit."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO response VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, model_id, message, input_tokens, output_tokens, len(message), now, now)
+            )
+            if self.max_size_bytes is not None:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM response").fetchone()[0]
+        if total <= self.max_size_bytes:
+            return
+        evicted = []
+        for key, size in self.conn.execute("SELECT key, size FROM response ORDER BY last_used"):
+            if total <= self.max_size_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self.conn.executemany("DELETE FROM response WHERE key = ?", evicted)
+
+    def size(self) -> Dict[str, int]:
+        """Get the number of stored responses and their total size in bytes."""
+        with self.lock:
+            count, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response").fetchone()
+        return {"entries": count, "bytes": size}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+_stores: Dict[str, ResponseStore] = {}
+_stores_lock = threading.Lock()
+
+def open_store(path: str = DEFAULT_CACHE_PATH, max_size_bytes: Optional[int] = None) -> ResponseStore:
+    """
+    Get the ResponseStore of a path, opened once per process so concurrent models share its connection.
+
+    Args:
+        path: Path to the SQLite file.
+        max_size_bytes: Size limit of the store; the last value given applies.
+
+    Returns:
+        The ResponseStore.
+    """
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = ResponseStore(path, max_size_bytes)
+        elif max_size_bytes is not None:
+            store.max_size_bytes = max_size_bytes
+        return store
+
+def _innermost_model(model: Model) -> Model:
+    """Get the model a chain of wrappers such as ScheduledModel ends with, by following their `model`."""
+    while isinstance(getattr(model, "model", None), Model):
+        model = model.model
+    return model
+
+class CachingModel(Model):
+    """
+    A model answering repeated requests from a ResponseStore instead of the wrapped model.
+
+    Responses served from the cache report the token counts of the original call,
+    so the step and token accounting of a replayed run matches the recorded one.
+    """
+
+    def __init__(self, model: Model, store: ResponseStore, replay_only: bool = False):
+        """
+        Args:
+            model: The model to cache.
+            store: Store of the responses, which can be shared by several CachingModels.
+            replay_only: Whether to raise CacheMissError on a miss instead of calling the model.
+        """
+        super().__init__()
+        self.model = model
+        self.model_id = getattr(model, "model_id", type(model).__name__)
+        # The sampling parameters are those of the model at the end of any wrappers
+        self.base_model = _innermost_model(model)
+        self.store = store
+        self.replay_only = replay_only
+        self.hits = 0
+        self.misses = 0
+        self.stats_lock = threading.Lock()
+
+    def __call__(
+        self,
+        messages: List[Dict[str, str]],
+        stop_sequences: Optional[List[str]] = None,
+        grammar: Optional[str] = None,
+        tools_to_call_from: Optional[List[Tool]] = None,
+        **kwargs,
+    ) -> ChatMessage:
+        key = request_key(
+            self.model_id, messages, stop_sequences, grammar, tools_to_call_from,
+            params={**self.base_model.kwargs, **kwargs}
+        )
+        stored = self.store.get(key)
+        if stored is not None:
+            message_json, input_tokens, output_tokens = stored
+            with self.stats_lock:
+                self.hits += 1
+            self.last_input_token_count = input_tokens
+            self.last_output_token_count = output_tokens
+            return ChatMessage.from_dict(json.loads(message_json))
+
+        with self.stats_lock:
+            self.misses += 1
+        if self.replay_only:
+            raise CacheMissError(f"No cached response for request {key[:12]} to {self.model_id}")
+
+        message = self.model(
+            messages, stop_sequences=stop_sequences, grammar=grammar,
+            tools_to_call_from=tools_to_call_from, **kwargs
+        )
+        self.last_input_token_count = self.model.last_input_token_count
+        self.last_output_token_count = self.model.last_output_token_count
+        self.store.put(
+            key, self.model_id,
+            json.dumps(get_dict_from_nested_dataclasses(message, ignore_key="raw")),
+            self.last_input_token_count, self.last_output_token_count
+        )
+        return message
+
+    def stats(self) -> Dict:
+        """Get the hits, misses and hit rate of this model, and the size of its store."""
+        with self.stats_lock:
+            hits, misses = self.hits, self.misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            **self.store.size(),
+        }
@@ -3,8 +3,20 @@ import yaml
 from typing import Dict, List, Any, Optional, Union
 from smolagents import CodeAgent, OpenAIServerModel, LiteLLMModel, HfApiModel
 from smolagents.models import Model
+from kowinski.agents.context_budget import ContextBudget
+from kowinski.agents.prompt_layout import stabilize_prompt
+from kowinski.agents.run_budget import BudgetedModel, RunBudget
+from kowinski.agents.caching_model import CachingModel, open_store
+from kowinski.agents.scheduler import AdaptiveScheduler, ScheduledModel
+from kowinski.agents.vllm_model import VLLM_API_BASE, VLLMServerModel
 from kowinski.tools.code_analysis import repository_querier
 from kowinski.tools.patch_tools import patch_tools
+from kowinski.tools.overlay import RepositoryOverlay
+from kowinski.tools.verification import verification_tools
+
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta/openai/"
+VLLM_PREFIXES = ("vllm/", "hosted_vllm/")
+
 def load_template(template_path: Optional[str] = None) -> Dict:
     """
     Load a YAML template for agent prompts.
@@ -25,22 +37,39 @@ def load_template(template_path: Optional[str] = None) -> Dict:
 def create_model(
     model_id: str = "gemini-2.0-flash",
     api_key: Optional[str] = None,
-    api_base: Optional[str] = "https://generativelanguage.googleapis.com/v1beta/openai/",
+    api_base: Optional[str] = None,
+    stream: bool = False,
+    cache_path: Optional[str] = None,
+    cache_max_size_bytes: Optional[int] = None,
+    replay_only: bool = False,
+    scheduler: Optional[AdaptiveScheduler] = None,
 ) -> Model:
     """
     Create a model instance based on the model_id.
     
+    Model ids starting with "vllm/" or "hosted_vllm/" name a model served by a local
+    OpenAI-compatible server, such as the one started by serve_vllm.sh.
+    
     Args:
         model_id: The ID of the model to use.
         api_key: API key for the model provider. If None, will try to get from environment.
-        api_base: Base URL for the API.
+        api_base: Base URL for the API. If None, uses the provider's default: the Gemini OpenAI
+            endpoint for gemini models, VLLM_API_BASE (or $VLLM_API_BASE) for vLLM models.
+        stream: Whether to stream responses, for vLLM models.
+        cache_path: Path to a SQLite file caching the responses. If None, responses are not cached.
+        cache_max_size_bytes: Size the response cache is evicted down to. If None, it is not limited.
+        replay_only: Whether to fail on requests missing from the cache instead of querying the model.
+        scheduler: Scheduler shared by concurrent runs to pace their model calls. Cache hits bypass it.
         
     Returns:
-        A configured model instance.
+        A configured model instance, wrapped in a ScheduledModel if a scheduler is given and in
+        a CachingModel if cache_path is given.
     """
     # If API key not provided, try to get from environment
     if api_key is None:
-        if "GEMINI_API_KEY" in os.environ and model_id.startswith("gemini"):
+        if model_id.startswith(VLLM_PREFIXES):
+            api_key = os.environ.get("VLLM_API_KEY")
+        elif "GEMINI_API_KEY" in os.environ and model_id.startswith("gemini"):
             api_key = os.environ.get("GEMINI_API_KEY")
         elif "OPENAI_API_KEY" in os.environ and model_id.startswith(("gpt", "text-")):
             api_key = os.environ.get("OPENAI_API_KEY")
@@ -48,27 +77,59 @@ def create_model(
             api_key = os.environ.get("HF_API_KEY")
     
     # Create model based on model_id prefix
-    if model_id.startswith("gemini"):
-        return OpenAIServerModel(
+    if model_id.startswith(VLLM_PREFIXES):
+        model = VLLMServerModel(
+            model_id=model_id.split("/", 1)[1],
+            api_key=api_key,
+            api_base=api_base or os.environ.get("VLLM_API_BASE", VLLM_API_BASE),
+            stream=stream,
+        )
+    elif model_id.startswith("gemini"):
+        model = OpenAIServerModel(
             model_id=model_id,
             api_key=api_key,
-            api_base=api_base,
+            api_base=api_base or GEMINI_API_BASE,
         )
     elif model_id.startswith(("gpt", "text-")):
-        return OpenAIServerModel(
+        model = OpenAIServerModel(
             model_id=model_id,
             api_key=api_key,
         )
     else:
         # Assume it's a HuggingFace model
-        return HfApiModel(model_id=model_id, token=api_key)
+        model = HfApiModel(model_id=model_id, token=api_key)
+    
+    if scheduler is not None:
+        model = ScheduledModel(model, scheduler)
+    
+    if cache_path is None:
+        if replay_only:
+            raise ValueError("replay_only needs a cache_path to replay from")
+        return model
+    return CachingModel(model, open_store(cache_path, cache_max_size_bytes), replay_only=replay_only)
+
+def _apply_context_budget(tools, context_budget: Optional[ContextBudget]):
+    """Add the observation tool and compaction callback of a context budget to an agent's tools."""
+    if context_budget is None:
+        return list(tools), []
+    budget_tools, step_callbacks = context_budget.agent_extensions()
+    return [*tools, *budget_tools], step_callbacks
+
+def _apply_run_budget(model: Model, step_callbacks: List, run_budget: Optional[RunBudget]):
+    """Count the model calls and steps of an agent against a run budget."""
+    if run_budget is None:
+        return model, step_callbacks
+    return BudgetedModel(model, run_budget), [*step_callbacks, run_budget.step_callback]
 
 def create_analysis_agent(
     model: Optional[Model] = None,
     template_path: Optional[str] = None,
     tools: Optional[List[Any]] = None,
     name: str = "analysis_agent",
-    description: str = "This agent is responsible for analyzing the codebase and determining what files are causing the issue."
+    description: str = "This agent is responsible for analyzing the codebase and determining what files are causing the issue.",
+    db_path: str = "repository.db",
+    context_budget: Optional[ContextBudget] = None,
+    run_budget: Optional[RunBudget] = None
 ) -> CodeAgent:
     """
     Create an analysis agent for exploring and understanding a codebase.
@@ -79,6 +140,9 @@ def create_analysis_agent(
         tools: List of tools to provide to the agent. If None, uses repository_querier tools.
         name: Name of the agent.
         description: Description of the agent's purpose.
+        db_path: Path to the SQLite database queried by the default tools.
+        context_budget: Limits on the memory replayed to the model. If None, observations are kept whole.
+        run_budget: Step, token and wall time limits shared by the agents of a run. If None, the run is not limited.
         
     Returns:
         A configured CodeAgent instance.
@@ -88,26 +152,32 @@ def create_analysis_agent(
     
     # If tools not provided, use repository_querier
     if tools is None:
-        tools = repository_querier().values()
+        tools = repository_querier(db_path).values()
     
     # Create model if not provided
     if model is None:
         raise ValueError("Model must be provided")
     
+    tools, step_callbacks = _apply_context_budget(tools, context_budget)
+    model, step_callbacks = _apply_run_budget(model, step_callbacks, run_budget)
+    
     # Create and return the agent
-    return CodeAgent(
+    return stabilize_prompt(CodeAgent(
         tools=tools,
         model=model,
         prompt_templates=template,
         name=name,
-        description=description
-    )
+        description=description,
+        step_callbacks=step_callbacks
+    ))
 
 def create_code_agent(
     model: Optional[Model] = None,
     template_path: Optional[str] = None,
     tools: Optional[List[Any]] = None,
     analysis_agent: Optional[CodeAgent] = None,
+    context_budget: Optional[ContextBudget] = None,
+    run_budget: Optional[RunBudget] = None,
 ) -> CodeAgent:
     """
     Create a main code agent that can use an analysis agent.
@@ -120,6 +190,9 @@ def create_code_agent(
         template_path: Path to the YAML template file. If None, uses the default template.
         tools: List of tools to provide to the agent.
         analysis_agent: Optional analysis agent to include as a managed agent.
+        context_budget: Limits on the memory replayed to the model. If None, observations are kept whole.
+        run_budget: Step, token and wall time limits shared by the agents of a run, including the
+            analysis agent's if it was created with the same budget. If None, the run is not limited.
         
     Returns:
         A configured CodeAgent instance.
@@ -136,20 +209,27 @@ def create_code_agent(
     if analysis_agent:
         managed_agents.append(analysis_agent)
     
+    tools, step_callbacks = _apply_context_budget(tools if tools is not None else [], context_budget)
+    model, step_callbacks = _apply_run_budget(model, step_callbacks, run_budget)
+    
     # Create and return the agent
-    return CodeAgent(
-        tools=tools if tools is not None else [],
+    return stabilize_prompt(CodeAgent(
+        tools=tools,
         model=model,
         prompt_templates=template,
         managed_agents=managed_agents,
-    ) 
+        step_callbacks=step_callbacks,
+    )) 
 
 
 
 def create_patch_agent(
     model: Optional[Model] = None,
     template_path: Optional[str] = None,
-    db_path: str = "repository.db"
+    db_path: str = "repository.db",
+    repo_path: Optional[str] = None,
+    context_budget: Optional[ContextBudget] = None,
+    run_budget: Optional[RunBudget] = None
 ) -> CodeAgent:
     """
     Create a patch agent that can generate patches for GitHub issues.
@@ -158,6 +238,10 @@ def create_patch_agent(
         model: A pre-configured model instance. If None, raises ValueError.
         template_path: Path to the YAML template file. If None, uses the default patch template.
         db_path: Path to the SQLite database containing repository information.
+        repo_path: Optional path to the repository on disk. If given, the agent can run
+            the tests that import the files it edited.
+        context_budget: Limits on the memory replayed to the model. If None, observations are kept whole.
+        run_budget: Step, token and wall time limits shared by the agents of a run. If None, the run is not limited.
         
     Returns:
         A configured CodeAgent instance specialized for patch generation.
@@ -175,15 +259,22 @@ def create_patch_agent(
     
     # Combine code analysis tools and patch tools
     tools = repository_querier().values()
+    # Both tool sets share the overlay, so queries see the files as patched
+    overlay = RepositoryOverlay()
     all_tools = {}
-    all_tools.update(repository_querier(db_path))
-    all_tools.update(patch_tools())
+    all_tools.update(repository_querier(db_path, overlay=overlay))
+    all_tools.update(patch_tools(db_path, overlay=overlay))
+    if repo_path is not None:
+        all_tools.update(verification_tools(repo_path, overlay, db_path))
+    tools, step_callbacks = _apply_context_budget(all_tools.values(), context_budget)
+    model, step_callbacks = _apply_run_budget(model, step_callbacks, run_budget)
     
     # Create and return the agent
-    return CodeAgent(
-        tools=all_tools.values(),
+    return stabilize_prompt(CodeAgent(
+        tools=tools,
         model=model,
         prompt_templates=template,
         name="patch_agent",
-        description="This agent is responsible for generating patches to fix issues in code."
-    )
\ No newline at end of file
+        description="This agent is responsible for generating patches to fix issues in code.",
+        step_callbacks=step_callbacks
+    ))
\ No newline at end of file
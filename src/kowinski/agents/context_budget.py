@@ -0,0 +1,169 @@
+"""
+Context budget for agent memories.
+
+Every step of a CodeAgent appends its observation to the memory that is sent
+back to the model, so prompts grow with each file the agent reads. A
+ContextBudget step callback compacts the memory after every step:
+
+- observations longer than max_observation_chars are cut to that length,
+- observations older than keep_recent_steps are cut to a short preview,
+- and while the estimated prompt exceeds max_prompt_tokens, the oldest
+  observations are reduced to a single line.
+
+Each compacted observation is kept whole in an ObservationStore, under a handle
+quoted in its place, and the agent can read it back, page by page, with the
+fetch_observation tool.
+"""
+
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Tuple
+
+from smolagents import tool
+from smolagents.memory import ActionStep
+
+# Compaction levels of an observation
+FULL, TRUNCATED, PREVIEW, ELIDED = range(4)
+
+class ObservationStore:
+    """Full text of the compacted observations of one agent, by handle."""
+
+    def __init__(self):
+        self.observations: Dict[str, str] = {}
+        self.levels: Dict[int, int] = {}  # Compaction level by step number
+        self.lock = threading.Lock()
+
+    def put(self, step_number: int, observation: str) -> str:
+        """Keep the full observation of a step, if not already kept, and return its handle."""
+        handle = f"obs-{step_number}"
+        with self.lock:
+            self.observations.setdefault(handle, observation)
+        return handle
+
+    def get(self, handle: str):
+        return self.observations.get(handle)
+
+def observation_tools(store: ObservationStore) -> Dict[str, Callable]:
+    """
+    Create the tool reading back compacted observations.
+
+    Args:
+        store: The ObservationStore of the agent.
+
+    Returns:
+        Dictionary with the fetch_observation tool.
+    """
+
+    @tool
+    def fetch_observation(handle: str, start: int = 0, length: int = 4000) -> str:
+        """
+        Read part of an earlier observation that was shortened to save context.
+        Shortened observations end with a note giving their handle and length.
+
+        Args:
+            handle: The handle quoted in the shortened observation, e.g. "obs-3".
+            start: Character offset to start reading from.
+            length: Number of characters to read.
+
+        Returns:
+            The requested part of the observation, followed by the offset to continue from if more remains.
+        """
+        observation = store.get(handle)
+        if observation is None:
+            return f"Unknown observation handle {handle!r}; handles are quoted in shortened observations."
+        start = max(start, 0)
+        end = min(start + max(length, 1), len(observation))
+        part = observation[start:end]
+        if end < len(observation):
+            part += f"\n[{len(observation) - end} more characters: fetch_observation({handle!r}, start={end})]"
+        return part
+
+    return {"fetch_observation": fetch_observation}
+
+@dataclass
+class ContextBudget:
+    """
+    Limits on the agent memory replayed to the model at every step.
+
+    The prompt size is estimated from its characters, as tokenizers differ between models.
+    """
+    max_prompt_tokens: int = 24000
+    max_observation_chars: int = 8000  # Longest observation kept as is, even for the latest step
+    keep_recent_steps: int = 2  # Steps whose observations are not shortened to a preview
+    preview_chars: int = 600  # Characters kept of an older observation
+    chars_per_token: float = 4.0
+
+    def _compact(self, store: ObservationStore, step: ActionStep, level: int):
+        """Shorten the observation of a step to a compaction level, unless it is already shorter."""
+        if step.observations is None or store.levels.get(step.step_number, FULL) >= level:
+            return
+        full = store.get(f"obs-{step.step_number}") or step.observations
+        keep = {TRUNCATED: self.max_observation_chars, PREVIEW: self.preview_chars, ELIDED: 0}[level]
+        if len(full) <= keep:
+            return
+        handle = store.put(step.step_number, full)
+        note = (f"[Observation shortened to save context: {len(full)} characters, "
+                f"{len(full) - keep} not shown. Read them with fetch_observation({handle!r}, start={keep}).]")
+        step.observations = f"{full[:keep]}\n{note}" if keep else note
+        store.levels[step.step_number] = level
+
+    def estimate_tokens(self, agent) -> int:
+        """Estimate the tokens of the prompt the agent sends at its next step."""
+        characters = 0
+        for message in agent.write_memory_to_messages():
+            content = message["content"]
+            if isinstance(content, str):
+                characters += len(content)
+            else:
+                characters += sum(len(part.get("text", "")) for part in content if isinstance(part, dict))
+        return int(characters / self.chars_per_token)
+
+    def compact(self, agent, store: ObservationStore) -> Tuple[int, int]:
+        """
+        Compact the memory of an agent to fit the budget.
+
+        Args:
+            agent: The agent.
+            store: The ObservationStore of the agent.
+
+        Returns:
+            The estimated prompt tokens before and after compaction.
+        """
+        steps: List[ActionStep] = [step for step in agent.memory.steps if isinstance(step, ActionStep)]
+        if not steps:
+            return 0, 0
+        before = self.estimate_tokens(agent)
+
+        latest = steps[-1].step_number
+        for step in steps:
+            self._compact(store, step, TRUNCATED)
+            if latest - step.step_number >= self.keep_recent_steps:
+                self._compact(store, step, PREVIEW)
+
+        after = self.estimate_tokens(agent)
+        # Reduce the oldest observations to their note until the prompt fits, sparing the latest one
+        for step in steps[:-1]:
+            if after <= self.max_prompt_tokens:
+                break
+            self._compact(store, step, ELIDED)
+            after = self.estimate_tokens(agent)
+        return before, after
+
+    def step_callback(self, store: ObservationStore) -> Callable:
+        """Get a step callback compacting the memory of the agent after each step."""
+
+        def compact_memory(memory_step, agent=None):
+            if agent is not None and isinstance(memory_step, ActionStep):
+                self.compact(agent, store)
+
+        return compact_memory
+
+    def agent_extensions(self) -> Tuple[List, List[Callable]]:
+        """
+        Create the tools and step callbacks applying this budget to one agent.
+
+        Returns:
+            A tuple (tools, step callbacks) sharing a new ObservationStore.
+        """
+        store = ObservationStore()
+        return list(observation_tools(store).values()), [self.step_callback(store)]
@@ -0,0 +1,334 @@
+"""
+Parallel localization by several analysis agents.
+
+A FanOutLocalizer stands in for the analysis agent managed by the code agent.
+When the manager delegates a task, it starts one analysis agent per strategy
+at the same time, each seeded from the index with a different starting point:
+the frames of the issue's tracebacks, the entities and the files ranked most
+relevant by BM25, or the repository layout. Each agent answers with scored
+candidates, which are merged by file. As soon as enough agents agree on the
+best file, the agents still running are stopped after their current step, so
+localization takes about as long as the fastest agreeing agents rather than
+one agent exploring every lead in turn.
+"""
+
+import ast
+import json
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from smolagents import CodeAgent
+from smolagents.models import Model
+
+from kowinski.agents.code_agent import create_analysis_agent
+from kowinski.agents.context_budget import ContextBudget
+from kowinski.agents.run_budget import RunBudget
+from kowinski.tools.code_analysis import repository_querier
+
+DEFAULT_AGREEMENT = 2  # Agents that must rank the same file first to stop the others
+DEFAULT_SUB_AGENT_STEPS = 10
+SEED_SIZE = 8  # Candidates from the index given to a strategy
+
+ANSWER_FORMAT = """When you are done, call final_answer with a JSON object of this form:
+{"candidates": [{"file_path": "path/to/file.py", "entity_name": "function, Class or Class.method, or null", "confidence": 0.0 to 1.0}, ...],
+ "explanation": "how the top candidate causes the issue"}
+List at most 5 candidates, the most likely first. The confidence is your probability that the candidate must change to fix the issue."""
+
+@dataclass
+class LocalizationStrategy:
+    """A way of starting the search, given to one analysis agent."""
+    name: str
+    instructions: str
+    # Renders the starting points found in the index for a task, empty if there are none
+    seed: Optional[Callable[[Dict[str, Any], str], str]] = None
+    requires_seed: bool = False  # Skip the strategy when its seed is empty
+
+@dataclass
+class Candidate:
+    """A file, and optionally an entity in it, proposed as the location of an issue."""
+    file_path: str
+    entity_name: Optional[str] = None
+    confidence: float = 0.5
+    strategies: List[str] = field(default_factory=list)  # Strategies that proposed it
+
+def _traceback_seed(tools: Dict[str, Any], task: str) -> str:
+    frames = tools["resolve_traceback"](issue_text=task, k=SEED_SIZE)
+    return "\n".join(
+        f"- {frame.file_path}:{frame.line}"
+        + (f" in {frame.parent_name + '.' if frame.parent_name else ''}{frame.entity_name}" if frame.entity_name else "")
+        for frame in frames
+    )
+
+def _entity_seed(tools: Dict[str, Any], task: str) -> str:
+    entities = tools["rank_candidates"](query=task, k=SEED_SIZE)["entities"]
+    return "\n".join(
+        f"- {entity.file_path}: {entity.entity_type} {entity.parent_name + '.' if entity.parent_name else ''}{entity.name}"
+        f" (lines {entity.start_line}-{entity.end_line})"
+        for entity in entities
+    )
+
+def _file_seed(tools: Dict[str, Any], task: str) -> str:
+    files = tools["rank_candidates"](query=task, k=SEED_SIZE)["files"]
+    return "\n".join(f"- {candidate.file_path}" for candidate in files)
+
+DEFAULT_STRATEGIES = [
+    LocalizationStrategy(
+        name="traceback",
+        instructions="Start from the tracebacks of the issue. These frames were matched to repository code; "
+                     "read the innermost ones first and follow the calls that lead to the error.",
+        seed=_traceback_seed,
+        requires_seed=True,
+    ),
+    LocalizationStrategy(
+        name="symbols",
+        instructions="Start from the functions and classes the issue mentions or describes. These entities "
+                     "rank highest against the issue text; read them and the code calling them.",
+        seed=_entity_seed,
+    ),
+    LocalizationStrategy(
+        name="lexical",
+        instructions="Start from the files whose content best matches the issue text. Read their outlines "
+                     "to find the code implementing the behaviour the issue describes.",
+        seed=_file_seed,
+    ),
+    LocalizationStrategy(
+        name="structure",
+        instructions="Start from the layout of the repository: use get_tree and get_file_outline to find "
+                     "the modules responsible for the behaviour the issue describes, without relying on "
+                     "keyword matches.",
+    ),
+]
+
+def parse_candidates(answer: Any) -> List[Candidate]:
+    """
+    Read the candidates of an analysis agent's final answer.
+
+    Args:
+        answer: The final answer: a dictionary or list as requested by ANSWER_FORMAT,
+            their JSON or Python text, or free text quoting file paths.
+
+    Returns:
+        The candidates in the agent's order.
+    """
+    if isinstance(answer, str):
+        parsed = None
+        for text in [answer, *re.findall(r"(\{.*\}|\[.*\])", answer, re.DOTALL)]:
+            for load in (json.loads, ast.literal_eval):
+                try:
+                    parsed = load(text)
+                    break
+                except (ValueError, SyntaxError):
+                    continue
+            if parsed is not None:
+                break
+        if parsed is None:
+            # Free text: keep the quoted paths, in order, with a low confidence
+            paths = dict.fromkeys(re.findall(r"[\w./-]+\.py\b", answer))
+            return [Candidate(file_path=path, confidence=0.3) for path in paths]
+        answer = parsed
+
+    if isinstance(answer, dict):
+        answer = answer.get("candidates", [answer])
+    candidates = []
+    for item in answer if isinstance(answer, list) else []:
+        if not isinstance(item, dict) or not item.get("file_path"):
+            continue
+        try:
+            confidence = min(max(float(item.get("confidence", 0.5)), 0.0), 1.0)
+        except (TypeError, ValueError):
+            confidence = 0.5
+        candidates.append(Candidate(
+            file_path=str(item["file_path"]).removeprefix("./"),
+            entity_name=item.get("entity_name") or None,
+            confidence=confidence,
+        ))
+    return candidates
+
+def merge_candidates(results: Dict[str, List[Candidate]], num_strategies: int) -> List[Candidate]:
+    """
+    Merge the candidates of several agents by file.
+
+    A file scores the sum, over the strategies proposing it, of their highest confidence
+    in it, divided by the number of strategies that finished: a file every agent is sure of scores 1.
+    Its entity is the one with the highest total confidence.
+
+    Args:
+        results: Candidates by strategy name.
+        num_strategies: Number of strategies that finished, including those that failed.
+
+    Returns:
+        The merged candidates by decreasing confidence.
+    """
+    files: Dict[str, Dict] = {}
+    for strategy, candidates in results.items():
+        for candidate in candidates:
+            merged = files.setdefault(candidate.file_path, {"confidence": {}, "entities": {}})
+            merged["confidence"][strategy] = max(merged["confidence"].get(strategy, 0.0), candidate.confidence)
+            if candidate.entity_name:
+                entities = merged["entities"]
+                entities[candidate.entity_name] = entities.get(candidate.entity_name, 0.0) + candidate.confidence
+
+    merged_candidates = [
+        Candidate(
+            file_path=file_path,
+            entity_name=max(merged["entities"], key=merged["entities"].get) if merged["entities"] else None,
+            confidence=round(sum(merged["confidence"].values()) / max(num_strategies, 1), 4),
+            strategies=sorted(merged["confidence"]),
+        )
+        for file_path, merged in files.items()
+    ]
+    merged_candidates.sort(key=lambda candidate: (-candidate.confidence, candidate.file_path))
+    return merged_candidates
+
+class FanOutLocalizer:
+    """
+    A team member that localizes an issue with several analysis agents running concurrently.
+
+    It can be given to create_code_agent in place of the analysis agent: like a managed
+    agent, it has a name and a description and is called with a task.
+    """
+
+    def __init__(
+        self,
+        model_factory: Callable[[], Model],
+        db_path: str = "repository.db",
+        strategies: Optional[List[LocalizationStrategy]] = None,
+        agreement: int = DEFAULT_AGREEMENT,
+        max_steps: int = DEFAULT_SUB_AGENT_STEPS,
+        context_budget: Optional[ContextBudget] = None,
+        run_budget: Optional[RunBudget] = None,
+        name: str = "analysis_agent",
+        description: str = "This agent is responsible for analyzing the codebase and determining what files are causing the issue.",
+    ):
+        """
+        Args:
+            model_factory: Creates the model of each analysis agent. Models keep per-call state,
+                so concurrent agents should not share one.
+            db_path: Path to the SQLite database of the repository.
+            strategies: Strategies to run, one agent each. Defaults to DEFAULT_STRATEGIES.
+            agreement: Number of agents whose best file must agree to stop the others.
+            max_steps: Step limit of each analysis agent.
+            context_budget: Limits on the memory each analysis agent replays to the model.
+            run_budget: Limits of the run the analysis agents count their steps and tokens against.
+            name: Name under which the manager calls it.
+            description: Description shown to the manager.
+        """
+        self.model_factory = model_factory
+        self.strategies = strategies if strategies is not None else DEFAULT_STRATEGIES
+        self.agreement = agreement
+        self.max_steps = max_steps
+        self.context_budget = context_budget
+        self.run_budget = run_budget
+        self.name = name
+        self.description = description
+        # The agents share one set of tools, with a connection per agent
+        self.tools = repository_querier(db_path, pool_size=max(len(self.strategies), 1))
+        # Called with each analysis agent once created, e.g. to instrument it
+        self.agent_hooks: List[Callable[[CodeAgent], Any]] = []
+        self.last_run: Dict[str, Any] = {}
+
+    def _create_agent(self, strategy: LocalizationStrategy) -> CodeAgent:
+        agent = create_analysis_agent(
+            model=self.model_factory(),
+            tools=list(self.tools.values()),
+            name=f"analysis_{strategy.name}",
+            context_budget=self.context_budget,
+            run_budget=self.run_budget,
+        )
+        agent.max_steps = self.max_steps
+        for hook in self.agent_hooks:
+            hook(agent)
+        return agent
+
+    def _build_task(self, task: str, strategy: LocalizationStrategy, seed: str) -> str:
+        parts = [
+            "Find the files and the functions or classes causing the issue described in the task below.",
+            f"Strategy: {strategy.instructions}",
+            ANSWER_FORMAT,
+        ]
+        if seed:
+            parts.append(f"Starting points found in the index:\n{seed}")
+        parts.append(f"---\nTask:\n{task}\n---")
+        return "\n\n".join(parts)
+
+    def localize(self, task: str) -> List[Candidate]:
+        """
+        Run the strategies concurrently and merge their candidates.
+
+        Agents still running when `agreement` of them rank the same file first are stopped
+        after their current step and left out of the merge.
+
+        Args:
+            task: The task or issue description.
+
+        Returns:
+            The merged candidates by decreasing confidence. Details of the run are kept in last_run.
+        """
+        start = time.perf_counter()
+        runs = []
+        for strategy in self.strategies:
+            seed = strategy.seed(self.tools, task) if strategy.seed is not None else ""
+            if strategy.requires_seed and not seed:
+                continue
+            runs.append((strategy, self._build_task(task, strategy, seed)))
+
+        agents = {strategy.name: self._create_agent(strategy) for strategy, _ in runs}
+        results: Dict[str, List[Candidate]] = {}
+        errors: Dict[str, str] = {}
+        stopped: List[str] = []
+        executor = ThreadPoolExecutor(max_workers=max(len(runs), 1), thread_name_prefix="kowinski-localizer")
+        try:
+            futures = {
+                executor.submit(agents[strategy.name].run, strategy_task): strategy.name
+                for strategy, strategy_task in runs
+            }
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    strategy_name = futures[future]
+                    try:
+                        results[strategy_name] = parse_candidates(future.result())
+                    except Exception as e:
+                        errors[strategy_name] = f"{type(e).__name__}: {e}"
+                top_files = [candidates[0].file_path for candidates in results.values() if candidates]
+                if pending and top_files and max(top_files.count(path) for path in top_files) >= self.agreement:
+                    # A step limit of 0 ends an agent's run loop before its next step
+                    for future in pending:
+                        stopped.append(futures[future])
+                        agents[futures[future]].max_steps = 0
+                        future.cancel()
+                    break
+        finally:
+            # Stopped agents finish their current step in the background; their answers are not waited for
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        merged = merge_candidates(results, len(results) + len(errors))
+        self.last_run = {
+            "strategies": [strategy.name for strategy, _ in runs],
+            "completed": sorted(results),
+            "stopped": sorted(stopped),
+            "errors": errors,
+            "duration": round(time.perf_counter() - start, 3),
+        }
+        return merged
+
+    def __call__(self, task: str, **kwargs) -> str:
+        candidates = self.localize(task)
+        run = self.last_run
+        lines = [f"Localization by {len(run['strategies'])} analysis agents in parallel "
+                 f"({', '.join(run['strategies'])}) in {run['duration']}s."]
+        if run["stopped"]:
+            lines.append(f"Stopped early, as the others agreed: {', '.join(run['stopped'])}.")
+        for strategy_name, error in run["errors"].items():
+            lines.append(f"The {strategy_name} agent failed: {error}")
+        if not candidates:
+            lines.append("No candidate was found.")
+        for rank, candidate in enumerate(candidates[:10], 1):
+            location = f"{candidate.file_path}" + (f" ({candidate.entity_name})" if candidate.entity_name else "")
+            lines.append(f"{rank}. {location}: confidence {candidate.confidence}, "
+                         f"proposed by {', '.join(candidate.strategies)}")
+        return "\n".join(lines)
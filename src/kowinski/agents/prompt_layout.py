@@ -0,0 +1,38 @@
+"""
+Byte-stable system prompts.
+
+Self-hosted servers such as vLLM reuse the KV cache of a prompt prefix they
+have already seen, so every agent of a kind should send exactly the same system
+prompt, whatever the issue and whichever process builds it. The prompt lists
+the agent's tools and team members in the order they were given and its
+authorized imports in set order, which changes between processes with string
+hash randomization. stabilize_prompt sorts all three and renders the prompt
+again. The templates and tasks keep the issue-specific text last.
+"""
+
+from smolagents import CodeAgent
+from smolagents.memory import SystemPromptStep
+
+def stabilize_prompt(agent: CodeAgent) -> CodeAgent:
+    """
+    Order the tools, team members and authorized imports of an agent by name, and render its system prompt again.
+
+    The final_answer tool stays last, where smolagents puts it.
+
+    Args:
+        agent: The agent, changed in place.
+
+    Returns:
+        The agent.
+    """
+    final_answer = agent.tools.pop("final_answer", None)
+    agent.tools = dict(sorted(agent.tools.items()))
+    if final_answer is not None:
+        agent.tools["final_answer"] = final_answer
+    agent.managed_agents = dict(sorted(agent.managed_agents.items()))
+    if hasattr(agent, "authorized_imports"):
+        agent.authorized_imports = sorted(agent.authorized_imports)
+
+    agent.system_prompt = agent.initialize_system_prompt()
+    agent.memory.system_prompt = SystemPromptStep(system_prompt=agent.system_prompt)
+    return agent
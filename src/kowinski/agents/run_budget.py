@@ -0,0 +1,134 @@
+"""
+Step, token and wall time budgets of agent runs.
+
+A RunBudget is shared by all the agents of one run, the code agent and the
+analysis agents it delegates to. Every model call of these agents counts its
+prompt and completion tokens against it, through a BudgetedModel, and every
+step is counted by its step callback. When a limit is reached, the callback
+sets the agent's step limit to its current step: smolagents then ends the run
+loop and asks the model for a final answer from the memory so far, so the run
+still returns its best-effort answer. Agents checking the budget after their
+next step stop in turn, so a budget exhausted inside a managed agent also ends
+the manager's run.
+
+Limits are checked after each step, so a run overshoots by at most one step,
+plus the call producing its final answer.
+"""
+
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from smolagents.memory import ActionStep
+from smolagents.models import ChatMessage, Model
+from smolagents.tools import Tool
+
+@dataclass
+class RunBudget:
+    """
+    Limits of one run and what it has used of them.
+
+    Use a new RunBudget per run, shared by all the agents of the run. None means no limit.
+    """
+    max_steps: Optional[int] = None  # Steps of all the agents of the run
+    max_input_tokens: Optional[int] = None
+    max_output_tokens: Optional[int] = None
+    max_seconds: Optional[float] = None
+    steps: int = field(default=0, init=False)
+    input_tokens: int = field(default=0, init=False)
+    output_tokens: int = field(default=0, init=False)
+    started_at: Optional[float] = field(default=None, init=False)
+    exhausted: Optional[str] = field(default=None, init=False)  # The first limit reached
+    lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    def start(self):
+        """Start the wall time of the run, if not started yet."""
+        with self.lock:
+            if self.started_at is None:
+                self.started_at = time.time()
+
+    @property
+    def elapsed(self) -> float:
+        return time.time() - self.started_at if self.started_at is not None else 0.0
+
+    def add_tokens(self, input_tokens: Optional[int], output_tokens: Optional[int]):
+        """Count the tokens of a model call."""
+        with self.lock:
+            self.input_tokens += input_tokens or 0
+            self.output_tokens += output_tokens or 0
+
+    def _check(self) -> Optional[str]:
+        """Get the name of a limit the run has reached, None if it has reached none."""
+        if self.max_steps is not None and self.steps >= self.max_steps:
+            return "steps"
+        if self.max_input_tokens is not None and self.input_tokens >= self.max_input_tokens:
+            return "input_tokens"
+        if self.max_output_tokens is not None and self.output_tokens >= self.max_output_tokens:
+            return "output_tokens"
+        if self.max_seconds is not None and self.elapsed >= self.max_seconds:
+            return "seconds"
+        return None
+
+    def step_callback(self, memory_step, agent=None):
+        """Count a step and, once a limit is reached, end the agent's run with a final answer."""
+        if not isinstance(memory_step, ActionStep):
+            return
+        self.start()
+        with self.lock:
+            self.steps += 1
+            if self.exhausted is None:
+                self.exhausted = self._check()
+            exhausted = self.exhausted is not None
+        if exhausted and agent is not None and agent.step_number <= agent.max_steps:
+            # The run loop stops after this step, and then asks the model for a final answer
+            agent.max_steps = agent.step_number
+
+    def report(self) -> Dict:
+        """Get the limits, the use and the limit reached, if any, as a JSON serializable dictionary."""
+        with self.lock:
+            return {
+                "exhausted": self.exhausted,
+                "steps": self.steps,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "seconds": round(self.elapsed, 3),
+                "limits": {
+                    "steps": self.max_steps,
+                    "input_tokens": self.max_input_tokens,
+                    "output_tokens": self.max_output_tokens,
+                    "seconds": self.max_seconds,
+                },
+            }
+
+class BudgetedModel(Model):
+    """A model counting the tokens of its calls against a RunBudget."""
+
+    def __init__(self, model: Model, budget: RunBudget):
+        """
+        Args:
+            model: The model of an agent.
+            budget: The budget of the agent's run.
+        """
+        super().__init__()
+        self.model = model
+        self.model_id = getattr(model, "model_id", type(model).__name__)
+        self.budget = budget
+
+    def __call__(
+        self,
+        messages: List[Dict[str, str]],
+        stop_sequences: Optional[List[str]] = None,
+        grammar: Optional[str] = None,
+        tools_to_call_from: Optional[List[Tool]] = None,
+        **kwargs,
+    ) -> ChatMessage:
+        self.budget.start()
+        message = self.model(
+            messages, stop_sequences=stop_sequences, grammar=grammar,
+            tools_to_call_from=tools_to_call_from, **kwargs
+        )
+        self.last_input_token_count = self.model.last_input_token_count
+        self.last_output_token_count = self.model.last_output_token_count
+        self.budget.add_tokens(self.last_input_token_count, self.last_output_token_count)
+        return message
@@ -0,0 +1,224 @@
+"""
+Shared scheduling of model calls across concurrent agents.
+
+An AdaptiveScheduler admits a bounded number of requests at a time and, given
+a rate, a bounded number of tokens per second. The bound on in-flight requests
+follows AIMD: it grows by one per window of successful calls and is halved when
+the endpoint is overloaded, which shows as 429 or 5xx errors, timeouts or
+latencies over a target. Waiting requests are admitted by priority, so the runs
+closest to finishing go first and free their slots sooner.
+
+ScheduledModel wraps the Model of one run and passes its calls through the
+shared scheduler.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from smolagents.models import ChatMessage, Model
+from smolagents.tools import Tool
+
+OVERLOAD_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def is_overload_error(error: Exception) -> bool:
+    """Whether a model call failed because the endpoint is overloaded or rate limited."""
+    if getattr(error, "transient", False):
+        return True
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code in OVERLOAD_STATUS_CODES
+    name = type(error).__name__
+    return isinstance(error, TimeoutError) or "RateLimit" in name or "Timeout" in name
+
+def estimate_tokens(messages: List[Dict]) -> int:
+    """Estimate the prompt tokens of messages, at four characters per token."""
+    characters = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            characters += len(content)
+        elif isinstance(content, list):
+            characters += sum(len(part.get("text", "")) for part in content if isinstance(part, dict))
+    return characters // 4 + 1
+
+class AdaptiveScheduler:
+    """
+    Limits the in-flight model calls and tokens per second of all the agents of a process.
+
+    Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        initial_concurrency: int = 16,
+        min_concurrency: int = 1,
+        max_concurrency: int = 128,
+        tokens_per_second: Optional[float] = None,
+        burst_tokens: Optional[float] = None,
+        target_latency: Optional[float] = None,
+        decrease_factor: float = 0.5,
+    ):
+        """
+        Args:
+            initial_concurrency: Starting limit of in-flight calls.
+            min_concurrency: Lowest limit of in-flight calls.
+            max_concurrency: Highest limit of in-flight calls, e.g. vLLM's --max-num-seqs.
+            tokens_per_second: Rate of prompt and completion tokens, None for no rate limit.
+            burst_tokens: Capacity of the token bucket, defaults to ten seconds of the rate.
+            target_latency: Latency in seconds above which a call counts as a sign of overload, None to ignore latency.
+            decrease_factor: Factor applied to the limit on overload.
+        """
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self.tokens_per_second = tokens_per_second
+        self.burst_tokens = burst_tokens or (tokens_per_second * 10 if tokens_per_second else None)
+        self.tokens = self.burst_tokens or 0.0
+        self.refilled_at = time.monotonic()
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+
+        self.condition = threading.Condition()
+        self.waiting: List = []  # Heap of (priority, sequence number)
+        self.sequence = itertools.count()
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.stats = {"calls": 0, "overloads": 0, "slow_calls": 0, "decreases": 0, "wait_time": 0.0}
+
+    @property
+    def concurrency(self) -> int:
+        """The current limit of in-flight calls."""
+        return int(self.limit)
+
+    def _refill(self, now: float):
+        if self.tokens_per_second is not None:
+            self.tokens = min(self.burst_tokens, self.tokens + (now - self.refilled_at) * self.tokens_per_second)
+        self.refilled_at = now
+
+    def _token_wait(self, estimated_tokens: int) -> float:
+        """Seconds until the bucket can cover the tokens of a call, 0 if it can now."""
+        if self.tokens_per_second is None:
+            return 0.0
+        # A call larger than the bucket only waits for a full bucket
+        needed = min(estimated_tokens, self.burst_tokens)
+        return max(0.0, (needed - self.tokens) / self.tokens_per_second)
+
+    @contextmanager
+    def slot(self, priority: float = 0.0, estimated_tokens: int = 0):
+        """
+        Hold a slot for one model call, waiting for capacity.
+
+        Args:
+            priority: Lower values are admitted first.
+            estimated_tokens: Tokens the call is expected to use, taken from the token bucket.
+
+        Yields:
+            A dictionary the caller fills in: 'tokens' with the tokens the call used,
+            and 'overloaded' when it failed on overload.
+        """
+        start = time.monotonic()
+        entry = (priority, next(self.sequence))
+        with self.condition:
+            heapq.heappush(self.waiting, entry)
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                token_wait = self._token_wait(estimated_tokens)
+                if self.waiting[0] == entry and self.in_flight < self.concurrency and token_wait == 0:
+                    break
+                self.condition.wait(timeout=token_wait or None)
+            heapq.heappop(self.waiting)
+            self.in_flight += 1
+            if self.tokens_per_second is not None:
+                self.tokens -= estimated_tokens
+            self.stats["wait_time"] += time.monotonic() - start
+            # The next waiter may fit too
+            self.condition.notify_all()
+
+        outcome = {"tokens": None, "overloaded": False}
+        call_start = time.monotonic()
+        try:
+            yield outcome
+        finally:
+            self._release(time.monotonic() - call_start, outcome, estimated_tokens)
+
+    def _release(self, latency: float, outcome: Dict, estimated_tokens: int):
+        with self.condition:
+            self.in_flight -= 1
+            self.stats["calls"] += 1
+            if self.tokens_per_second is not None and outcome["tokens"] is not None:
+                # Settle the difference between the estimate and the actual use
+                self.tokens -= outcome["tokens"] - estimated_tokens
+
+            slow = self.target_latency is not None and latency > self.target_latency
+            if outcome["overloaded"] or slow:
+                self.stats["overloads" if outcome["overloaded"] else "slow_calls"] += 1
+                # Decrease at most once per latency period, as calls in flight see the same overload
+                now = time.monotonic()
+                if now - self.last_decrease > latency:
+                    self.limit = max(self.min_concurrency, self.limit * self.decrease_factor)
+                    self.last_decrease = now
+                    self.stats["decreases"] += 1
+            else:
+                # Grows by one per window of successful calls
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def snapshot(self) -> Dict:
+        """Get the current limit, load and counters."""
+        with self.condition:
+            return {
+                "concurrency": self.concurrency,
+                "in_flight": self.in_flight,
+                "waiting": len(self.waiting),
+                **self.stats,
+                "wait_time": round(self.stats["wait_time"], 3),
+            }
+
+class ScheduledModel(Model):
+    """
+    A model whose calls go through an AdaptiveScheduler.
+
+    Use one ScheduledModel per run. Its priority is the number of calls it has
+    made, negated: a run with more steps behind it is closer to its step limit
+    or final answer, so it is admitted before runs that just started.
+    """
+
+    def __init__(self, model: Model, scheduler: AdaptiveScheduler):
+        """
+        Args:
+            model: The model to schedule.
+            scheduler: The scheduler shared by all the runs.
+        """
+        super().__init__()
+        self.model = model
+        self.model_id = getattr(model, "model_id", type(model).__name__)
+        self.scheduler = scheduler
+        self.calls = 0
+
+    def __call__(
+        self,
+        messages: List[Dict[str, str]],
+        stop_sequences: Optional[List[str]] = None,
+        grammar: Optional[str] = None,
+        tools_to_call_from: Optional[List[Tool]] = None,
+        **kwargs,
+    ) -> ChatMessage:
+        with self.scheduler.slot(priority=-self.calls, estimated_tokens=estimate_tokens(messages)) as outcome:
+            self.calls += 1
+            try:
+                message = self.model(
+                    messages, stop_sequences=stop_sequences, grammar=grammar,
+                    tools_to_call_from=tools_to_call_from, **kwargs
+                )
+            except Exception as e:
+                outcome["overloaded"] = is_overload_error(e)
+                raise
+            self.last_input_token_count = self.model.last_input_token_count
+            self.last_output_token_count = self.model.last_output_token_count
+            outcome["tokens"] = (self.last_input_token_count or 0) + (self.last_output_token_count or 0)
+        return message
@@ -0,0 +1,284 @@
+"""
+Client for OpenAI-compatible vLLM servers, such as the one started by serve_vllm.sh.
+
+All VLLMServerModels of a process talking to the same server share one HTTP
+session, whose connection pool keeps enough keep-alive connections open for
+every concurrent agent, so a batch of agents does not pay a TCP handshake per
+step. Requests time out, and are retried with exponential backoff and jitter
+on connection errors, timeouts, 429 and 5xx responses, honouring Retry-After.
+Responses can be streamed, which keeps long generations from hitting the read
+timeout since the timeout then applies between chunks.
+
+read_prefix_cache_counters scrapes the server's Prometheus metrics to measure
+how much of the prompts the prefix cache served.
+"""
+
+import json
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from smolagents.models import ChatMessage, Model, parse_tool_args_if_needed
+from smolagents.tools import Tool
+
+VLLM_API_BASE = "http://localhost:8000/v1"
+DEFAULT_TIMEOUT = (10.0, 600.0)  # Connect and read timeouts in seconds
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_POOL_SIZE = 256  # Connections kept open per server, above vLLM's --max-num-seqs
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+MAX_BACKOFF = 30.0
+# Prefix cache counters of vLLM's metrics, in prompt tokens, by engine version
+PREFIX_CACHE_COUNTERS = (
+    ("vllm:prefix_cache_queries_total", "vllm:prefix_cache_hits_total"),
+    ("vllm:gpu_prefix_cache_queries_total", "vllm:gpu_prefix_cache_hits_total"),
+)
+
+class VLLMRequestError(RuntimeError):
+    """Raised when a request fails with a non-retryable status, or after all retries."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, transient: bool = False):
+        super().__init__(message)
+        self.status_code = status_code  # Last HTTP status, None if the server did not answer
+        self.transient = transient  # Whether the failures were retryable ones, i.e. the server is overloaded
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+def get_session(api_base: str, pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    """
+    Get the HTTP session of a server, created once per process and shared by all its models.
+
+    Args:
+        api_base: Base URL of the server.
+        pool_size: Maximum number of keep-alive connections to the server.
+
+    Returns:
+        The requests Session.
+    """
+    with _sessions_lock:
+        session = _sessions.get(api_base)
+        if session is None:
+            session = requests.Session()
+            # Retries are done by VLLMServerModel, as urllib3 does not retry POST requests
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[api_base] = session
+        return session
+
+def read_prefix_cache_counters(api_base: str = VLLM_API_BASE) -> Optional[Dict[str, float]]:
+    """
+    Read the prefix cache counters of a vLLM server from its /metrics endpoint.
+
+    Args:
+        api_base: Base URL of the server, up to and including /v1.
+
+    Returns:
+        A dictionary with the prompt tokens looked up in the prefix cache ('queries') and
+        found there ('hits'), summed over the server's models, or None if the server is
+        unreachable or does not export them.
+    """
+    base = api_base.rstrip("/")
+    if base.endswith("/v1"):
+        base = base[:-len("/v1")]
+    try:
+        response = get_session(api_base.rstrip("/")).get(f"{base}/metrics", timeout=DEFAULT_TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException:
+        return None
+
+    values: Dict[str, float] = {}
+    for line in response.text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        name_and_labels, _, value = line.rpartition(" ")
+        name = name_and_labels.split("{", 1)[0]
+        try:
+            values[name] = values.get(name, 0.0) + float(value)
+        except ValueError:
+            continue
+    for queries, hits in PREFIX_CACHE_COUNTERS:
+        if queries in values and hits in values:
+            return {"queries": values[queries], "hits": values[hits]}
+    return None
+
+def prefix_cache_hit_rate(before: Optional[Dict[str, float]], after: Optional[Dict[str, float]]) -> Optional[Dict]:
+    """
+    Get the prefix cache hit rate between two readings of read_prefix_cache_counters.
+
+    Returns:
+        A dictionary with the 'hit_rate' and the prompt tokens 'queried' and 'hit', or None
+        if either reading is missing or no prompt was sent in between.
+    """
+    if before is None or after is None:
+        return None
+    queried = after["queries"] - before["queries"]
+    if queried <= 0:
+        return None
+    hit = after["hits"] - before["hits"]
+    return {"hit_rate": round(hit / queried, 4), "queried": int(queried), "hit": int(hit)}
+
+def _backoff(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Get the delay before a retry: the server's Retry-After, or exponential with full jitter."""
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), MAX_BACKOFF)
+        except ValueError:
+            pass  # An HTTP date, rare enough to fall back to the exponential delay
+    return random.uniform(0, min(MAX_BACKOFF, 0.5 * 2 ** attempt))
+
+def _grammar_params(grammar) -> Dict:
+    """Map a smolagents grammar, {"type": "regex" | "json" | ..., "value": ...}, to vLLM guided decoding."""
+    if isinstance(grammar, dict) and grammar.get("type") in ("regex", "json", "grammar", "choice"):
+        return {f"guided_{grammar['type']}": grammar["value"]}
+    return {"guided_grammar": grammar}
+
+def _read_stream(response: requests.Response) -> Tuple[Dict, Optional[Dict]]:
+    """
+    Assemble the message of a streamed chat completion.
+
+    Returns:
+        A tuple (message dict, usage dict or None).
+    """
+    content = []
+    tool_calls: Dict[int, Dict] = {}
+    usage = None
+    role = "assistant"
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        chunk = json.loads(data)
+        usage = chunk.get("usage") or usage
+        for choice in chunk.get("choices", []):
+            delta = choice.get("delta") or {}
+            role = delta.get("role") or role
+            if delta.get("content"):
+                content.append(delta["content"])
+            for call in delta.get("tool_calls") or []:
+                merged = tool_calls.setdefault(
+                    call.get("index", 0), {"id": None, "type": "function", "function": {"name": "", "arguments": ""}}
+                )
+                merged["id"] = call.get("id") or merged["id"]
+                function = call.get("function") or {}
+                merged["function"]["name"] += function.get("name") or ""
+                merged["function"]["arguments"] += function.get("arguments") or ""
+
+    message = {
+        "role": role,
+        "content": "".join(content) if content else None,
+        "tool_calls": [tool_calls[index] for index in sorted(tool_calls)] or None,
+    }
+    return message, usage
+
+class VLLMServerModel(Model):
+    """
+    A model served by vLLM, or any OpenAI-compatible chat completions server.
+
+    Args:
+        model_id: Name of the model on the server, as given to `vllm serve`.
+        api_base: Base URL of the server, up to and including /v1.
+        api_key: Key sent as a bearer token, for servers started with --api-key.
+        timeout: Connect and read timeouts in seconds. When streaming, the read timeout applies between chunks.
+        max_retries: Number of retries of a failed request.
+        stream: Whether to stream responses.
+        pool_size: Maximum number of keep-alive connections to the server, shared by all its models.
+        custom_role_conversions: Conversions of message roles the model's chat template does not support.
+        **kwargs: Additional parameters of the requests, such as temperature or max_tokens.
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        api_base: str = VLLM_API_BASE,
+        api_key: Optional[str] = None,
+        timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        stream: bool = False,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        custom_role_conversions: Optional[Dict[str, str]] = None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.model_id = model_id
+        self.api_base = api_base.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.stream = stream
+        self.custom_role_conversions = custom_role_conversions
+        self.session = get_session(self.api_base, pool_size)
+
+    def _post(self, payload: Dict) -> Tuple[Dict, Optional[Dict]]:
+        """Send a chat completion request, retrying transient failures, and return its message and usage."""
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        url = f"{self.api_base}/chat/completions"
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                with self.session.post(url, json=payload, headers=headers,
+                                       timeout=self.timeout, stream=self.stream) as response:
+                    if response.status_code == 200:
+                        if self.stream:
+                            return _read_stream(response)
+                        body = response.json()
+                        return body["choices"][0]["message"], body.get("usage")
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        raise VLLMRequestError(
+                            f"{url} returned {response.status_code}: {response.text[:1000]}",
+                            status_code=response.status_code
+                        )
+                    retry_after = response.headers.get("Retry-After")
+                    status_code = response.status_code
+                    error = f"{url} returned {response.status_code}: {response.text[:200]}"
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                status_code = None
+                error = f"{type(e).__name__}: {e}"
+            if attempt < self.max_retries:
+                time.sleep(_backoff(attempt, retry_after))
+        raise VLLMRequestError(
+            f"Request failed after {self.max_retries + 1} attempts, last error: {error}",
+            status_code=status_code, transient=True
+        )
+
+    def __call__(
+        self,
+        messages: List[Dict[str, str]],
+        stop_sequences: Optional[List[str]] = None,
+        grammar: Optional[str] = None,
+        tools_to_call_from: Optional[List[Tool]] = None,
+        **kwargs,
+    ) -> ChatMessage:
+        completion_kwargs = self._prepare_completion_kwargs(
+            messages=messages,
+            stop_sequences=stop_sequences,
+            tools_to_call_from=tools_to_call_from,
+            model=self.model_id,
+            custom_role_conversions=self.custom_role_conversions,
+            convert_images_to_image_urls=True,
+            **kwargs,
+        )
+        if grammar is not None:
+            completion_kwargs.update(_grammar_params(grammar))
+        if self.stream:
+            completion_kwargs.update(stream=True, stream_options={"include_usage": True})
+
+        message_data, usage = self._post(completion_kwargs)
+        usage = usage or {}
+        self.last_input_token_count = usage.get("prompt_tokens", 0)
+        self.last_output_token_count = usage.get("completion_tokens", 0)
+
+        message = ChatMessage.from_dict({
+            "role": message_data.get("role", "assistant"),
+            "content": message_data.get("content"),
+            "tool_calls": message_data.get("tool_calls") or None,
+        })
+        message.raw = message_data
+        if tools_to_call_from is not None:
+            return parse_tool_args_if_needed(message)
+        return message
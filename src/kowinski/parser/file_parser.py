@@ -1,8 +1,11 @@
 import ast
 import os
+import time
 from typing import Optional, List, Dict, Any, Tuple
 from sqlmodel import Field, SQLModel, create_engine, Session
 import pandas as pd
+from kowinski.parser.profiling import NULL_PROFILER
+from kowinski.parser.repo_parser import build_folder_aggregates
 
 # Define models for database tables
 class PythonFunction(SQLModel, table=True):
@@ -11,6 +14,7 @@ class PythonFunction(SQLModel, table=True):
     name: str
     start_line: int
     end_line: int
+    decorated_start_line: Optional[int] = None  # First line of the definition, including decorators
     args: str  # Comma-separated list of arguments
     is_method: bool = False
     class_name: Optional[str] = None  # If it's a method, which class it belongs to
@@ -24,6 +28,7 @@ class PythonClass(SQLModel, table=True):
     name: str
     start_line: int
     end_line: int
+    decorated_start_line: Optional[int] = None  # First line of the definition, including decorators
     base_classes: str = ""  # Comma-separated list of base classes
     decorators: str = ""  # Comma-separated list of decorators
     docstring: Optional[str] = None
@@ -37,6 +42,11 @@ class PythonVariable(SQLModel, table=True):
     is_module_level: bool = True
     class_name: Optional[str] = None  # If within a class but outside methods
 
+class PythonFileOutline(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    file_id: int = Field(foreign_key="repofile.id", index=True, unique=True)
+    outline: str  # Compact indented listing of the file's classes, functions and variables
+
 # AST Visitor to extract Python code elements
 class PythonCodeVisitor(ast.NodeVisitor):
     def __init__(self):
@@ -61,6 +71,7 @@ class PythonCodeVisitor(ast.NodeVisitor):
             'name': node.name,
             'start_line': node.lineno,
             'end_line': self._get_last_line(node),
+            'decorated_start_line': self._get_first_line(node),
             'args': ", ".join(args),
             'is_method': is_method,
             'class_name': class_name,
@@ -86,6 +97,7 @@ class PythonCodeVisitor(ast.NodeVisitor):
             'name': node.name,
             'start_line': node.lineno,
             'end_line': self._get_last_line(node),
+            'decorated_start_line': self._get_first_line(node),
             'args': ", ".join(args),
             'is_method': is_method,
             'class_name': class_name,
@@ -113,6 +125,7 @@ class PythonCodeVisitor(ast.NodeVisitor):
             'name': node.name,
             'start_line': node.lineno,
             'end_line': self._get_last_line(node),
+            'decorated_start_line': self._get_first_line(node),
             'base_classes': ", ".join(base_classes),
             'decorators': ", ".join(decorators),
             'docstring': docstring
@@ -163,6 +176,10 @@ class PythonCodeVisitor(ast.NodeVisitor):
         
         self.generic_visit(node)
     
+    def _get_first_line(self, node):
+        """Get the first line of a definition, including its decorators"""
+        return min([node.lineno] + [d.lineno for d in node.decorator_list])
+    
     def _get_last_line(self, node):
         """Get the last line number of a node"""
         # For simple nodes with end_lineno attribute
@@ -220,27 +237,99 @@ class PythonCodeVisitor(ast.NodeVisitor):
                 return f"{self._get_attribute_name(node.func)}(...)"
         return "..."
 
-def analyze_python_files(db_path="repository.db"):
+def _first_docstring_line(docstring, max_length=80):
+    """Get the first line of a docstring, shortened to max_length characters"""
+    if not docstring:
+        return ""
+    first_line = docstring.strip().splitlines()[0].strip()
+    if len(first_line) > max_length:
+        first_line = first_line[:max_length - 3] + "..."
+    return first_line
+
+def render_outline(functions, classes, variables):
+    """
+    Render a compact outline of a Python file from the entities found by PythonCodeVisitor.
+    
+    Each entity takes one line with its signature, line range and the first line of
+    its docstring, indented under the class or function that contains it. Variables
+    assigned inside functions are left out.
+    
+    Args:
+        functions (list): Function dicts as collected by PythonCodeVisitor
+        classes (list): Class dicts as collected by PythonCodeVisitor
+        variables (list): Variable dicts as collected by PythonCodeVisitor
+    
+    Returns:
+        str: The outline, one entity per line
+    """
+    entries = []
+    for cls in classes:
+        decorators = "".join(f"@{d} " for d in cls['decorators'].split(", ") if d)
+        bases = f"({cls['base_classes']})" if cls['base_classes'] else ""
+        entries.append((cls['start_line'], cls['end_line'], 'class',
+                        f"{decorators}class {cls['name']}{bases}", cls['docstring']))
+    for func in functions:
+        decorators = "".join(f"@{d} " for d in func['decorators'].split(", ") if d)
+        prefix = "async def" if func['is_async'] else "def"
+        entries.append((func['start_line'], func['end_line'], 'function',
+                        f"{decorators}{prefix} {func['name']}({func['args']})", func['docstring']))
+    for var in variables:
+        assignment = f"{var['name']} = {var['value_repr']}" if var['value_repr'] else var['name']
+        entries.append((var['line'], var['line'], 'variable', assignment, None))
+    # Outer entities first when they start on the same line
+    entries.sort(key=lambda entry: (entry[0], -entry[1]))
+    
+    lines = []
+    open_entities = []  # (end_line, kind) of the entities enclosing the current line
+    for start_line, end_line, kind, signature, docstring in entries:
+        while open_entities and open_entities[-1][0] < start_line:
+            open_entities.pop()
+        if kind == 'variable':
+            if open_entities and open_entities[-1][1] == 'function':
+                continue
+            line_range = f"L{start_line}"
+        else:
+            line_range = f"L{start_line}-{end_line}"
+        
+        line = f"{'    ' * len(open_entities)}{signature}  [{line_range}]"
+        summary = _first_docstring_line(docstring)
+        if summary:
+            line += f"  # {summary}"
+        lines.append(line)
+        
+        if kind != 'variable':
+            open_entities.append((end_line, kind))
+    
+    return "\n".join(lines)
+
+def analyze_python_files(db_path="repository.db", profiler=None):
     """
     Analyze Python files in the repository database and extract code structure information.
     
     Args:
         db_path (str): Path to the SQLite database
+        profiler (IndexProfiler, optional): Profiler timing the load, parse, visit, outline,
+            insert and folder_aggregates stages and each file, with the size of its syntax tree
     
     Returns:
-        dict: Summary of the parsed Python structures
+        dict: Summary of the parsed Python structures, with the profiler's report
+            under 'profile' when a profiler is given
     """
+    report_profile = profiler is not None
+    profiler = profiler or NULL_PROFILER
+    
     # Create database engine
     engine = create_engine(f"sqlite:///{db_path}")
     SQLModel.metadata.create_all(engine)
     
     # Read all Python files from the database
-    with Session(engine) as session:
+    with profiler.cprofile("analyze_python_files"), Session(engine) as session:
         # Get all files with .py extension
-        query = "SELECT id, relative_folder, file_name, content FROM repofile WHERE file_extension = 'py'"
-        conn = engine.connect()
-        python_files = pd.read_sql(query, conn).to_dict('records')
-        conn.close()
+        with profiler.stage("load"):
+            query = "SELECT id, relative_folder, file_name, content FROM repofile WHERE file_extension = 'py'"
+            conn = engine.connect()
+            python_files = pd.read_sql(query, conn).to_dict('records')
+            conn.close()
         
         # Counter for parsed elements
         stats = {
@@ -256,39 +345,55 @@ def analyze_python_files(db_path="repository.db"):
             file_id = py_file['id']
             file_path = os.path.join(py_file['relative_folder'], py_file['file_name'])
             content = py_file['content']
+            file_start = time.perf_counter()
+            ast_nodes = None
             
             try:
                 # Parse the Python code
-                tree = ast.parse(content)
-                visitor = PythonCodeVisitor()
-                visitor.visit(tree)
+                with profiler.stage("parse"):
+                    tree = ast.parse(content)
+                if report_profile:
+                    ast_nodes = sum(1 for _ in ast.walk(tree))
+                with profiler.stage("visit"):
+                    visitor = PythonCodeVisitor()
+                    visitor.visit(tree)
                 
-                # Store functions
-                for func_data in visitor.functions:
-                    function = PythonFunction(
-                        file_id=file_id,
-                        **func_data
-                    )
-                    session.add(function)
-                stats['total_functions'] += len(visitor.functions)
+                with profiler.stage("insert"):
+                    # Store functions
+                    for func_data in visitor.functions:
+                        function = PythonFunction(
+                            file_id=file_id,
+                            **func_data
+                        )
+                        session.add(function)
+                    stats['total_functions'] += len(visitor.functions)
+                    
+                    # Store classes
+                    for class_data in visitor.classes:
+                        python_class = PythonClass(
+                            file_id=file_id,
+                            **class_data
+                        )
+                        session.add(python_class)
+                    stats['total_classes'] += len(visitor.classes)
+                    
+                    # Store variables
+                    for var_data in visitor.variables:
+                        variable = PythonVariable(
+                            file_id=file_id,
+                            **var_data
+                        )
+                        session.add(variable)
+                    stats['total_variables'] += len(visitor.variables)
                 
-                # Store classes
-                for class_data in visitor.classes:
-                    python_class = PythonClass(
+                # Store the rendered outline, served as is by get_file_outline
+                with profiler.stage("outline"):
+                    outline = render_outline(visitor.functions, visitor.classes, visitor.variables)
+                with profiler.stage("insert"):
+                    session.add(PythonFileOutline(
                         file_id=file_id,
-                        **class_data
-                    )
-                    session.add(python_class)
-                stats['total_classes'] += len(visitor.classes)
-                
-                # Store variables
-                for var_data in visitor.variables:
-                    variable = PythonVariable(
-                        file_id=file_id,
-                        **var_data
-                    )
-                    session.add(variable)
-                stats['total_variables'] += len(visitor.variables)
+                        outline=outline
+                    ))
                 
             except SyntaxError as e:
                 print(f"Syntax error in file {file_path}: {e}")
@@ -296,12 +401,21 @@ def analyze_python_files(db_path="repository.db"):
             except Exception as e:
                 print(f"Error parsing file {file_path}: {e}")
                 stats['files_with_parse_errors'] += 1
+            profiler.record_file("analyze_python_files", file_path, time.perf_counter() - file_start,
+                                 len(content), ast_nodes)
         
         # Commit all the data
-        session.commit()
+        with profiler.stage("insert"):
+            session.commit()
+    
+    # Refresh the folder aggregates with the entity counts
+    with profiler.stage("folder_aggregates"):
+        build_folder_aggregates(db_path)
     
     print(f"Python file analysis complete. Results:")
     for key, value in stats.items():
         print(f"  {key}: {value}")
     
+    if report_profile:
+        stats['profile'] = profiler.report()
     return stats
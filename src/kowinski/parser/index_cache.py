@@ -0,0 +1,316 @@
+"""
+Cache of repository databases, one per repository state.
+
+A database is keyed by the repository and a commit, so issues on the same
+commit share one index, or by an instance id when the checkout is not a git
+repository. The commit is the one an issue was filed against when it is known,
+and the database is then built from a temporary worktree of that commit if the
+checkout is on another one; otherwise it is the commit checked out. Builds write to a temporary file which is renamed into
+place once complete, under a per-key file lock, so concurrent processes never
+build the same index twice nor read a partial one. Reusing a database refreshes
+its modification time, and the least recently used databases are evicted when
+the cache grows over its size limit.
+"""
+
+import fcntl
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+
+from kowinski.parser.file_parser import analyze_python_files
+from kowinski.parser.profiling import IndexProfiler
+from kowinski.parser.repo_parser import parse_repository
+
+DEFAULT_CACHE_DIR = "index_cache"
+
+@dataclass
+class CacheEntry:
+    """A database in the cache."""
+    key: str
+    path: str
+    size: int  # Bytes
+    last_used: float  # Modification time, refreshed on every reuse
+
+def build_index(repo_path: str, db_path: str = "repository.db", rebuild: bool = True,
+                profiler: Optional[IndexProfiler] = None) -> str:
+    """
+    Parse a repository and its Python files into a SQLite database.
+
+    The database is written to a temporary file and moved into place once complete,
+    so an interrupted build never leaves a partial database to be reused.
+
+    Args:
+        repo_path: Path to the repository.
+        db_path: Path to the SQLite database.
+        rebuild: Whether to rebuild an existing database instead of reusing it.
+        profiler: Profiler of the parsing and analysis stages.
+
+    Returns:
+        The path to the database.
+    """
+    if os.path.exists(db_path) and not rebuild:
+        return db_path
+
+    temporary_path = f"{db_path}.{os.getpid()}.tmp"
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+
+    try:
+        print(f"Parsing repository: {repo_path}")
+        parse_repository(repo_path, db_path=temporary_path, profiler=profiler)
+        print("Analyzing Python files...")
+        analyze_python_files(db_path=temporary_path, profiler=profiler)
+        os.replace(temporary_path, db_path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+    return db_path
+
+def repo_commit(repo_path: str) -> Optional[str]:
+    """
+    Get the commit checked out in a repository.
+
+    Uncommitted changes are not reflected, so the checkouts indexed should be clean.
+
+    Args:
+        repo_path: Path to the repository.
+
+    Returns:
+        The full hash of HEAD, or None if the path is not a git repository.
+    """
+    try:
+        result = subprocess.run(
+            ["git", "-C", repo_path, "rev-parse", "HEAD"],
+            capture_output=True, text=True, timeout=30
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+@contextmanager
+def checkout_at(repo_path: str, commit: Optional[str]):
+    """
+    Get a tree of a repository at a commit, adding a temporary worktree if the checkout is on another one.
+
+    Args:
+        repo_path: Path to the checkout.
+        commit: Commit to check out, None for the checkout as it is.
+
+    Yields:
+        The path to the checkout or to the worktree, which is removed on exit.
+
+    Raises:
+        ValueError: If the commit is not in the repository.
+    """
+    head = repo_commit(repo_path)
+    if commit is None or head is None or head == commit:
+        yield repo_path
+        return
+
+    worktree_parent = tempfile.mkdtemp(prefix="kowinski-worktree-")
+    worktree = os.path.join(worktree_parent, os.path.basename(os.path.abspath(repo_path)))
+    result = subprocess.run(
+        ["git", "-C", repo_path, "worktree", "add", "--detach", worktree, commit],
+        capture_output=True, text=True
+    )
+    try:
+        if result.returncode != 0:
+            raise ValueError(f"Cannot check out {commit} in {repo_path}: {result.stderr.strip()}")
+        yield worktree
+    finally:
+        subprocess.run(["git", "-C", repo_path, "worktree", "remove", "--force", worktree], capture_output=True)
+        subprocess.run(["git", "-C", repo_path, "worktree", "prune"], capture_output=True)
+        if os.path.isdir(worktree_parent):
+            shutil.rmtree(worktree_parent, ignore_errors=True)
+
+def cache_key(repo: Optional[str] = None, commit: Optional[str] = None, instance_id: Optional[str] = None) -> str:
+    """
+    Get the cache key of a repository state.
+
+    Args:
+        repo: Repository name, such as 'owner/name'.
+        commit: Commit of the checkout.
+        instance_id: Identifier of the issue, used when the commit is unknown.
+
+    Returns:
+        'owner__name@commit' when the repository and commit are known, else the instance id.
+
+    Raises:
+        ValueError: If neither a repository and commit nor an instance id are given.
+    """
+    if repo and commit:
+        key = f"{repo.replace('/', '__')}@{commit}"
+    elif instance_id:
+        key = str(instance_id)
+    else:
+        raise ValueError("A cache key needs a repository and commit, or an instance id")
+    # Keys are file names
+    return re.sub(r"[^A-Za-z0-9._@-]", "_", key)
+
+class IndexCache:
+    """
+    A directory of repository databases, built on demand and evicted least recently used first.
+
+    Instances only hold the directory and limit, so they can be passed to worker processes.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_size_bytes: Optional[int] = None):
+        """
+        Args:
+            cache_dir: Directory of the databases, created if missing.
+            max_size_bytes: Total size the databases are evicted down to, None for no limit.
+        """
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        """Get the path of the database of a key, whether or not it is built."""
+        return os.path.join(self.cache_dir, f"{key}.db")
+
+    def key_for(self, repo_path: str, repo: Optional[str] = None, instance_id: Optional[str] = None,
+                commit: Optional[str] = None) -> str:
+        """
+        Get the cache key of a repository state.
+
+        Args:
+            repo_path: Path to the checkout.
+            repo: Repository name, defaults to the checkout's directory name.
+            instance_id: Identifier of the issue, used when the checkout is not a git repository.
+            commit: Commit to index, such as an issue's base_commit. Defaults to the one checked out.
+
+        Returns:
+            The cache key.
+        """
+        repo = repo or os.path.basename(os.path.abspath(repo_path))
+        head = repo_commit(repo_path)
+        # A checkout that is not a git repository can only be indexed as it is
+        return cache_key(repo, (commit or head) if head is not None else None, instance_id)
+
+    @contextmanager
+    def _lock(self, key: str, blocking: bool = True):
+        """Hold the file lock of a key, yielding False if it is taken and blocking is False."""
+        with open(os.path.join(self.cache_dir, f"{key}.lock"), "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Get the database of a key if it is built, marking it as used.
+
+        Args:
+            key: Cache key.
+
+        Returns:
+            The path to the database, or None if it is not built.
+        """
+        db_path = self.path(key)
+        try:
+            os.utime(db_path)
+        except FileNotFoundError:
+            return None
+        return db_path
+
+    def get_or_build(self, repo_path: str, key: str, rebuild: bool = False, keep: Iterable[str] = (),
+                     profiler: Optional[IndexProfiler] = None, commit: Optional[str] = None) -> str:
+        """
+        Get the database of a key, building it from the repository if needed.
+
+        Concurrent calls for the same key wait for the first one to build it. After
+        a build, databases are evicted to fit the size limit.
+
+        Args:
+            repo_path: Path to the repository.
+            key: Cache key of the repository state.
+            rebuild: Whether to rebuild the database even if it is already built.
+            keep: Keys of other databases in use, which eviction must not remove.
+            profiler: Profiler of the build, unused when the database is reused.
+            commit: Commit to index, built from a temporary worktree if the checkout is on another one.
+                None to index the checkout as it is.
+
+        Returns:
+            The path to the database.
+
+        Raises:
+            ValueError: If the commit is not in the repository.
+        """
+        if not rebuild:
+            db_path = self.get(key)
+            if db_path is not None:
+                return db_path
+
+        with self._lock(key):
+            # Another process may have built it while this one waited for the lock
+            db_path = None if rebuild else self.get(key)
+            if db_path is None:
+                with checkout_at(repo_path, commit) as tree_path:
+                    db_path = build_index(tree_path, self.path(key), rebuild=True, profiler=profiler)
+
+        self.evict(keep=[key, *keep])
+        return db_path
+
+    def entries(self) -> List[CacheEntry]:
+        """Get the databases in the cache, least recently used first."""
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(".db"):
+                continue
+            path = os.path.join(self.cache_dir, file_name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # Evicted concurrently
+            entries.append(CacheEntry(key=file_name[:-3], path=path, size=stat.st_size, last_used=stat.st_mtime))
+        entries.sort(key=lambda entry: entry.last_used)
+        return entries
+
+    def size(self) -> int:
+        """Get the total size of the databases in bytes."""
+        return sum(entry.size for entry in self.entries())
+
+    def evict(self, keep: Iterable[str] = ()) -> List[str]:
+        """
+        Remove the least recently used databases until the cache fits its size limit.
+
+        Databases being built, or listed in keep, are never removed.
+
+        Args:
+            keep: Keys of databases in use.
+
+        Returns:
+            The keys of the removed databases.
+        """
+        if self.max_size_bytes is None:
+            return []
+
+        keep = set(keep)
+        entries = self.entries()
+        total = sum(entry.size for entry in entries)
+        evicted = []
+        for entry in entries:
+            if total <= self.max_size_bytes:
+                break
+            if entry.key in keep:
+                continue
+            with self._lock(entry.key, blocking=False) as acquired:
+                if not acquired:
+                    continue
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+            total -= entry.size
+            evicted.append(entry.key)
+        return evicted
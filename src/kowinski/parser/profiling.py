@@ -0,0 +1,126 @@
+"""
+Opt-in profiling of the indexing pipeline.
+
+An IndexProfiler passed to parse_repository and analyze_python_files times
+each stage of the pipeline (walking the tree, reading and decoding files,
+ast.parse, the visitor, rendering outlines, SQLite inserts and the folder
+aggregates) and keeps per-file timings to report the slowest files and the
+largest syntax trees. With a profile directory, each function also runs under
+cProfile and dumps its profile there, for pstats or snakeviz.
+"""
+
+import cProfile
+import heapq
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+DEFAULT_TOP_FILES = 10
+
+@dataclass
+class FileTiming:
+    """Time spent on one file in one function of the pipeline."""
+    file_path: str
+    seconds: float
+    size: int  # Characters
+    ast_nodes: Optional[int] = None
+
+class IndexProfiler:
+    """
+    Stage timings and per-file outliers of one or more indexing runs.
+
+    Stages with the same name add up, so one profiler can follow parse_repository
+    then analyze_python_files and report the whole build.
+    """
+
+    def __init__(self, profile_dir: Optional[str] = None, top_files: int = DEFAULT_TOP_FILES):
+        """
+        Args:
+            profile_dir: Directory the cProfile dumps are written to, None to skip cProfile.
+            top_files: Number of outlier files reported per ranking.
+        """
+        self.profile_dir = profile_dir
+        self.top_files = top_files
+        self.stages: Dict[str, List[float]] = {}  # Stage name: [seconds, count]
+        self.files: Dict[str, List[FileTiming]] = {}  # Function name: timings
+        self.profile_paths: List[str] = []
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a block as part of a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            totals = self.stages.setdefault(name, [0.0, 0])
+            totals[0] += time.perf_counter() - start
+            totals[1] += 1
+
+    def record_file(self, function: str, file_path: str, seconds: float, size: int, ast_nodes: Optional[int] = None):
+        """Record the time a function of the pipeline spent on a file."""
+        self.files.setdefault(function, []).append(FileTiming(file_path, seconds, size, ast_nodes))
+
+    @contextmanager
+    def cprofile(self, name: str):
+        """Run a block under cProfile and dump it to <profile_dir>/<name>.prof, if a profile directory is set."""
+        if self.profile_dir is None:
+            yield
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            path = os.path.join(self.profile_dir, f"{name}.prof")
+            profile.dump_stats(path)
+            self.profile_paths.append(path)
+
+    def report(self) -> Dict:
+        """
+        Get the stage timings and file outliers.
+
+        Returns:
+            A dictionary with 'stages' (seconds and count per stage, slowest first), per
+            pipeline function the 'slowest_files' and, when syntax trees were measured,
+            the 'largest_asts', and the paths of the cProfile dumps.
+        """
+        stages = {
+            name: {"seconds": round(seconds, 4), "count": count}
+            for name, (seconds, count) in sorted(self.stages.items(), key=lambda item: -item[1][0])
+        }
+        files = {}
+        for function, timings in self.files.items():
+            rankings = {
+                "slowest_files": [
+                    {"file_path": timing.file_path, "seconds": round(timing.seconds, 4), "size": timing.size}
+                    for timing in heapq.nlargest(self.top_files, timings, key=lambda timing: timing.seconds)
+                ]
+            }
+            measured = [timing for timing in timings if timing.ast_nodes is not None]
+            if measured:
+                rankings["largest_asts"] = [
+                    {"file_path": timing.file_path, "ast_nodes": timing.ast_nodes, "seconds": round(timing.seconds, 4)}
+                    for timing in heapq.nlargest(self.top_files, measured, key=lambda timing: timing.ast_nodes)
+                ]
+            files[function] = rankings
+        return {"stages": stages, "files": files, "profile_paths": list(self.profile_paths)}
+
+class _NullProfiler:
+    """Stands in for an IndexProfiler when profiling is off, at the cost of a no-op context per stage."""
+
+    @contextmanager
+    def stage(self, name: str):
+        yield
+
+    def record_file(self, *args, **kwargs):
+        pass
+
+    @contextmanager
+    def cprofile(self, name: str):
+        yield
+
+NULL_PROFILER = _NullProfiler()
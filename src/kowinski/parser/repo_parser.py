@@ -1,7 +1,12 @@
 import os
-from typing import Optional
+import re
+import time
+from array import array
+from typing import Optional, List
 from sqlmodel import Field, SQLModel, create_engine, Session
+from sqlalchemy import inspect, text
 import pathlib
+from kowinski.parser.profiling import NULL_PROFILER
 
 # Define the File model
 class RepoFile(SQLModel, table=True):
@@ -11,6 +16,47 @@ class RepoFile(SQLModel, table=True):
     file_extension: str = Field(index=True)
     content: str
     line_count: int
+    line_offsets: bytes = b""  # Packed character offsets of each line start, see compute_line_offsets
+
+def compute_line_offsets(content: str) -> bytes:
+    """
+    Compute the character offset at which each line of a text starts.
+    
+    Args:
+        content (str): The text
+    
+    Returns:
+        bytes: The offsets packed as unsigned 32-bit integers, one per line
+    """
+    offsets = array('I', [0])
+    offsets.extend(match.end() for match in re.finditer('\n', content))
+    return offsets.tobytes()
+
+def load_line_offsets(packed: bytes) -> List[int]:
+    """
+    Unpack line offsets computed by compute_line_offsets.
+    
+    Args:
+        packed (bytes): The packed offsets
+    
+    Returns:
+        list: The character offset of the start of each line, indexed from line 1 at position 0
+    """
+    offsets = array('I')
+    offsets.frombytes(packed)
+    return offsets.tolist()
+
+# Aggregates over each folder subtree, materialized at ingestion
+class RepoFolder(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    path: str = Field(index=True, unique=True)  # Relative folder path, '' for the repository root
+    parent_path: Optional[str] = Field(default=None, index=True)  # None for the repository root
+    depth: int = Field(index=True)  # 0 for the repository root
+    file_count: int = 0  # Files directly in the folder
+    total_files: int = 0  # Files in the whole subtree
+    total_lines: int = 0
+    total_functions: int = 0
+    total_classes: int = 0
 
 # Function to create the database engine
 def get_engine(db_path="repository.db"):
@@ -20,17 +66,21 @@ def get_engine(db_path="repository.db"):
     return engine
 
 # Main function to parse repository and store files
-def parse_repository(repo_path, db_path="repository.db"):
+def parse_repository(repo_path, db_path="repository.db", profiler=None):
     """
     Parse a repository and store file information in a SQLite database.
     
     Args:
         repo_path (str): Path to the repository
         db_path (str): Path where the SQLite database will be stored
+        profiler (IndexProfiler, optional): Profiler timing the walk, read_decode,
+            line_offsets, insert and folder_aggregates stages and each file
     
     Returns:
         int: Number of files processed
     """
+    profiler = profiler or NULL_PROFILER
+    
     # Create database engine
     engine = get_engine(db_path)
     
@@ -41,8 +91,15 @@ def parse_repository(repo_path, db_path="repository.db"):
     processed_files = 0
     
     # Walk through the repository
-    with Session(engine) as session:
-        for root, dirs, files in os.walk(repo_path):
+    with profiler.cprofile("parse_repository"), Session(engine) as session:
+        walker = os.walk(repo_path)
+        while True:
+            with profiler.stage("walk"):
+                entry = next(walker, None)
+            if entry is None:
+                break
+            root, dirs, files = entry
+            
             # Skip .git directory
             if '.git' in dirs:
                 dirs.remove('.git')
@@ -52,8 +109,9 @@ def parse_repository(repo_path, db_path="repository.db"):
                 file_path = os.path.join(root, file_name)
                 
                 # Skip if it's a directory somehow
-                if os.path.isdir(file_path):
-                    continue
+                with profiler.stage("walk"):
+                    if os.path.isdir(file_path):
+                        continue
                 
                 # Get relative path from repo root
                 relative_path = os.path.relpath(root, repo_path)
@@ -63,15 +121,19 @@ def parse_repository(repo_path, db_path="repository.db"):
                 # Get file extension
                 file_extension = pathlib.Path(file_name).suffix.lstrip('.')
                 
+                file_start = time.perf_counter()
                 try:
                     # Try to read the file as text
-                    with open(file_path, 'r', encoding='utf-8') as f:
+                    with profiler.stage("read_decode"), open(file_path, 'r', encoding='utf-8') as f:
                         content = f.read()
+                    with profiler.stage("line_offsets"):
                         line_count = content.count('\n') + 1
+                        line_offsets = compute_line_offsets(content)
                 except UnicodeDecodeError:
                     # If we can't read it as text, mark it as binary
                     content = "[BINARY FILE]"
                     line_count = 0
+                    line_offsets = b""
                 except Exception as e:
                     print(f"Error reading file {file_path}: {e}")
                     continue
@@ -82,20 +144,101 @@ def parse_repository(repo_path, db_path="repository.db"):
                     file_name=file_name,
                     file_extension=file_extension,
                     content=content,
-                    line_count=line_count
+                    line_count=line_count,
+                    line_offsets=line_offsets
                 )
                 
-                session.add(repo_file)
-                processed_files += 1
-                
-                # Commit every 100 files to avoid memory issues
-                if processed_files % 100 == 0:
-                    session.commit()
+                with profiler.stage("insert"):
+                    session.add(repo_file)
+                    processed_files += 1
+                    
+                    # Commit every 100 files to avoid memory issues
+                    if processed_files % 100 == 0:
+                        session.commit()
+                profiler.record_file(
+                    "parse_repository",
+                    os.path.join(relative_path, file_name),
+                    time.perf_counter() - file_start,
+                    len(content)
+                )
         
         # Final commit
-        session.commit()
+        with profiler.stage("insert"):
+            session.commit()
+    
+    with profiler.stage("folder_aggregates"):
+        build_folder_aggregates(db_path)
     
     print(f"Repository parsing complete. Processed {processed_files} files.")
     return processed_files
 
+def build_folder_aggregates(db_path="repository.db"):
+    """
+    Materialize file, line and Python entity counts for every folder subtree.
+    
+    Intermediate folders without files of their own are included so the
+    table describes the whole hierarchy. Existing aggregates are replaced,
+    so this can be re-run once Python entities have been analyzed.
+    
+    Args:
+        db_path (str): Path to the SQLite database
+    
+    Returns:
+        int: Number of folders stored
+    """
+    engine = get_engine(db_path)
+    tables = inspect(engine).get_table_names()
+    
+    # Direct counts per folder, with entity counts when the Python analysis has run
+    entity_counts = {}
+    with engine.connect() as conn:
+        file_counts = conn.execute(text("""
+            SELECT relative_folder, COUNT(*), SUM(line_count)
+            FROM repofile
+            GROUP BY relative_folder
+        """)).all()
+        for table, column in (("pythonfunction", 0), ("pythonclass", 1)):
+            if table not in tables:
+                continue
+            rows = conn.execute(text(f"""
+                SELECT r.relative_folder, COUNT(*)
+                FROM {table} e JOIN repofile r ON e.file_id = r.id
+                GROUP BY r.relative_folder
+            """)).all()
+            for folder, count in rows:
+                entity_counts.setdefault(folder, [0, 0])[column] = count
+    
+    # Roll the direct counts up to every ancestor folder
+    folders = {}
+    def get_folder(path):
+        if path not in folders:
+            parent_path = None if path == '' else os.path.dirname(path)
+            folders[path] = RepoFolder(
+                path=path,
+                parent_path=parent_path,
+                depth=0 if path == '' else path.count('/') + 1
+            )
+            if parent_path is not None:
+                get_folder(parent_path)
+        return folders[path]
+    
+    for folder_path, file_count, line_count in file_counts:
+        get_folder(folder_path).file_count = file_count
+        functions, classes = entity_counts.get(folder_path, (0, 0))
+        path = folder_path
+        while path is not None:
+            folder = get_folder(path)
+            folder.total_files += file_count
+            folder.total_lines += line_count or 0
+            folder.total_functions += functions
+            folder.total_classes += classes
+            path = folder.parent_path
+    
+    with Session(engine) as session:
+        session.execute(text("DELETE FROM repofolder"))
+        session.add_all(folders.values())
+        session.commit()
+    
+    return len(folders)
+
 # Example usage
@@ -6,15 +6,196 @@ This script takes a repository path and issue data, parses the repository,
 and uses AI agents to analyze the issue and identify problematic files.
 """
 
-import os
 import argparse
+import json
+import sys
+import time
+from functools import partial
+from typing import Callable, Optional
 import pandas as pd
-from IPython.display import Markdown
 from dotenv import load_dotenv
+from smolagents.models import Model
 
-from kowinski.parser.repo_parser import parse_repository
-from kowinski.parser.file_parser import analyze_python_files
+from kowinski.parser.index_cache import DEFAULT_CACHE_DIR, IndexCache, build_index, checkout_at
+from kowinski.parser.profiling import IndexProfiler
+from kowinski.agents.caching_model import CachingModel
 from kowinski.agents.code_agent import create_analysis_agent, create_code_agent, create_model
+from kowinski.agents.context_budget import ContextBudget
+from kowinski.agents.fanout import FanOutLocalizer
+from kowinski.agents.run_budget import RunBudget
+from kowinski.tools.code_analysis import create_read_only_engine
+from kowinski.tools.fast_localizer import DEFAULT_THRESHOLD, FastLocalization, FastLocalizer
+from kowinski.tools.instrumentation import Instrumentation, setup_opentelemetry
+from kowinski.scripts.prebuild_indexes import issue_commit
+
+def build_task(row, head_start: str = "") -> str:
+    """
+    Build the task given to the agent for an issue.
+    
+    The instructions come first and the issue last, so the prompts of all issues share
+    the longest possible prefix, which self-hosted servers cache.
+    
+    Args:
+        row: Issue record with 'repo' and 'problem_statement' fields.
+        head_start: Candidates found without a model, appended after the issue.
+    
+    Returns:
+        The task description.
+    """
+    task = f"""You are tasked with understanding an issue in a github repository.
+    You will be given a description of the issue and tools to search the codebase.
+    Your job is to determine, what file or files are causing the issue.
+    The tools provided will allow you to search the codebase and find the files that are causing the issue.
+    Determine what is the function or class where this issue is happening
+    ### Repository
+    {row['repo']}
+    ### Issue Description
+    {row['problem_statement']}"""
+    if head_start:
+        task += f"\n    ### Candidates\n    {head_start}"
+    return task
+
+def localize_without_model(row, db_path: str, threshold: float = DEFAULT_THRESHOLD) -> FastLocalization:
+    """
+    Rank the candidate locations of an issue from its tracebacks, symbols and text, without a model.
+    
+    Args:
+        row: Issue record with a 'problem_statement' field.
+        db_path: Path to the SQLite database of the repository.
+        threshold: Score the best candidate needs for the localization to be confident.
+    
+    Returns:
+        The FastLocalization of the issue.
+    """
+    engine = create_read_only_engine(db_path, pool_size=1)
+    try:
+        return FastLocalizer(engine, threshold=threshold).localize(row['problem_statement'])
+    finally:
+        engine.dispose()
+
+def create_agents(
+    model: Model,
+    db_path: str = "repository.db",
+    context_budget: Optional[ContextBudget] = None,
+    fan_out: bool = False,
+    model_factory: Optional[Callable[[], Model]] = None,
+    run_budget: Optional[RunBudget] = None
+):
+    """
+    Create the main agent with its managed analysis agent, querying the given database.
+    
+    Args:
+        model: The model used by both agents.
+        db_path: Path to the SQLite database of the repository.
+        context_budget: Limits on the memory each agent replays to the model.
+        fan_out: Whether to localize with several analysis agents running in parallel (a FanOutLocalizer).
+        model_factory: Creates the models of the parallel analysis agents. If None, they share `model`.
+        run_budget: Step, token and wall time limits shared by all the agents.
+    
+    Returns:
+        The main CodeAgent.
+    """
+    if fan_out:
+        analysis_agent = FanOutLocalizer(
+            model_factory=model_factory or (lambda: model),
+            db_path=db_path,
+            context_budget=context_budget,
+            run_budget=run_budget
+        )
+    else:
+        analysis_agent = create_analysis_agent(
+            model=model,
+            name="analysis_agent",
+            description="This agent is responsible for analyzing the codebase and determining what files are causing the issue.",
+            db_path=db_path,
+            context_budget=context_budget,
+            run_budget=run_budget
+        )
+    return create_code_agent(
+        model=model,
+        analysis_agent=analysis_agent,
+        context_budget=context_budget,
+        run_budget=run_budget,
+    )
+
+def analyze_issue(
+    row,
+    db_path: str,
+    model: Model,
+    instrumentation: Optional[Instrumentation] = None,
+    context_budget: Optional[ContextBudget] = None,
+    fan_out: bool = False,
+    model_factory: Optional[Callable[[], Model]] = None,
+    fast_path_threshold: Optional[float] = None,
+    run_budget: Optional[RunBudget] = None
+) -> dict:
+    """
+    Run the agents on one issue against an indexed repository.
+    
+    Args:
+        row: Issue record with 'repo' and 'problem_statement' fields.
+        db_path: Path to the SQLite database of the repository.
+        model: The model used by the agents.
+        instrumentation: Instrumentation measuring the run's tools, model calls and steps.
+        context_budget: Limits on the memory each agent replays to the model.
+        fan_out: Whether to localize with several analysis agents running in parallel.
+        model_factory: Creates the models of the parallel analysis agents. If None, they share `model`.
+        fast_path_threshold: If set, localize the issue without a model first, and answer without
+            running the agents when the best candidate scores at least this much.
+        run_budget: Step, token and wall time limits of the run. When one is reached, the
+            agents stop and answer from what they found so far.
+    
+    Returns:
+        A dictionary with the status ('completed', 'budget_exhausted' or 'error'), the
+        result or error, the duration in seconds, the number of steps and the token counts,
+        the response cache statistics when the model is a CachingModel, the confidence of
+        the fast path and whether it answered when it ran, and the budget report when the
+        run has a budget.
+    """
+    start = time.perf_counter()
+    head_start = ""
+    fast_path = None
+    if fast_path_threshold is not None:
+        try:
+            localization = localize_without_model(row, db_path, fast_path_threshold)
+            fast_path = {"answered": localization.confident, "confidence": localization.confidence,
+                         "margin": localization.margin, "duration": localization.duration}
+            if localization.confident:
+                return {"status": "completed", "result": localization.answer(), "error": None,
+                        "duration": round(time.perf_counter() - start, 3), "steps": 0,
+                        "input_tokens": 0, "output_tokens": 0, "fast_path": fast_path}
+            head_start = localization.head_start()
+        except Exception as e:
+            # The agents do not depend on the fast path
+            fast_path = {"answered": False, "error": f"{type(e).__name__}: {e}"}
+    
+    agent = create_agents(model, db_path, context_budget, fan_out, model_factory, run_budget)
+    if instrumentation is not None:
+        instrumentation.instrument_agent(agent)
+    record = {"status": "completed", "result": None, "error": None}
+    if run_budget is not None:
+        run_budget.start()
+    try:
+        record["result"] = str(agent.run(build_task(row, head_start)))
+        if run_budget is not None and run_budget.exhausted is not None:
+            record["status"] = "budget_exhausted"
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+    
+    record.update({
+        "duration": round(time.perf_counter() - start, 3),
+        "steps": len(agent.memory.steps),
+        "input_tokens": agent.monitor.total_input_token_count,
+        "output_tokens": agent.monitor.total_output_token_count,
+    })
+    if isinstance(model, CachingModel):
+        record["llm_cache"] = model.stats()
+    if fast_path is not None:
+        record["fast_path"] = fast_path
+    if run_budget is not None:
+        record["budget"] = run_budget.report()
+    return record
 
 def main():
     # Load environment variables
@@ -26,59 +207,131 @@ def main():
     parser.add_argument("--issue-data", required=True, help="Path to the issue data parquet file")
     parser.add_argument("--issue-index", type=int, default=0, help="Index of the issue to analyze")
     parser.add_argument("--model", default="gemini-2.0-flash", help="Model to use for analysis")
-    parser.add_argument("--db-path", default="repository.db", help="Path to the SQLite database")
+    parser.add_argument("--api-base", default=None, help="Base URL of the model endpoint")
+    parser.add_argument("--stream", action="store_true", help="Stream the model responses (vLLM models)")
+    parser.add_argument("--db-path", default=None,
+                        help="Path to the SQLite database, instead of the index cache")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Directory of the cached repository databases")
+    parser.add_argument("--rebuild-index", action="store_true", help="Rebuild the database even if it exists")
+    parser.add_argument("--profile-index", action="store_true",
+                        help="Time the stages of the index build and report the slowest files")
+    parser.add_argument("--profile-dir", default=None, help="Directory to dump cProfile profiles of the index build to")
+    parser.add_argument("--llm-cache", default=None, help="Path to a SQLite file caching the model responses")
+    parser.add_argument("--llm-cache-gb", type=float, default=None, help="Size the response cache is evicted down to")
+    parser.add_argument("--replay-only", action="store_true", help="Fail on requests missing from the response cache")
+    parser.add_argument("--max-prompt-tokens", type=int, default=None,
+                        help="Shorten old observations to keep prompts under this many tokens (estimated)")
+    parser.add_argument("--fan-out", action="store_true",
+                        help="Localize with several analysis agents in parallel, stopping once they agree")
+    parser.add_argument("--fast-path", action="store_true",
+                        help="Localize from tracebacks, symbols and text first, answering without a model when confident")
+    parser.add_argument("--fast-path-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Score the best fast path candidate needs to answer without a model")
+    parser.add_argument("--max-steps", type=int, default=None, help="Steps the agents of the run may take in total")
+    parser.add_argument("--max-input-tokens", type=int, default=None, help="Prompt tokens the run may use")
+    parser.add_argument("--max-output-tokens", type=int, default=None, help="Completion tokens the run may use")
+    parser.add_argument("--max-seconds", type=float, default=None, help="Wall time of the run, checked after each step")
+    parser.add_argument("--instrument", action="store_true",
+                        help="Measure tools, model calls and steps, and write a JSON summary of the run")
+    parser.add_argument("--metrics-output", default="run_metrics.json", help="Path of the JSON summary of the run")
+    parser.add_argument("--otlp-endpoint", default=None,
+                        help="OTLP/HTTP collector to export spans and metrics to, e.g. http://localhost:4318")
+    parser.add_argument("--trace-file", default=None, help="File the spans are appended to as JSON lines")
+    parser.add_argument("--otel-metrics-file", default=None, help="File the metrics are appended to as JSON lines")
     args = parser.parse_args()
     
-    # Check if database exists and remove it if it does
-    if os.path.exists(args.db_path):
-        os.remove(args.db_path)
-    
     # Load issue data
     issue_data = pd.read_parquet(args.issue_data)
     row = issue_data.iloc[args.issue_index]
     
-    # Parse repository
-    print(f"Parsing repository: {args.repo_path}")
-    parse_repository(args.repo_path, db_path=args.db_path)
+    # Parse and analyze the repository at the issue's base commit, unless it is already indexed
+    profiler = IndexProfiler(args.profile_dir) if args.profile_index or args.profile_dir else None
+    commit = issue_commit(row)
+    if args.db_path is not None:
+        with checkout_at(args.repo_path, commit) as tree_path:
+            db_path = build_index(tree_path, db_path=args.db_path, rebuild=args.rebuild_index, profiler=profiler)
+    else:
+        cache = IndexCache(args.cache_dir)
+        key = cache.key_for(args.repo_path, repo=row.get("repo"), instance_id=row.get("instance_id"), commit=commit)
+        db_path = cache.get_or_build(args.repo_path, key, rebuild=args.rebuild_index, profiler=profiler, commit=commit)
+    if profiler is not None:
+        if profiler.stages:
+            print(f"Index build profile:\n{json.dumps(profiler.report(), indent=2)}")
+        else:
+            print("Index build profile: the database was reused, pass --rebuild-index to profile a build")
     
-    # Analyze Python files
-    print("Analyzing Python files...")
-    analyze_python_files(db_path=args.db_path)
-
-    model = create_model(model_id=args.model)
-    
-    # Create analysis agent
-    analysis_agent = create_analysis_agent(
-        model=model,
-        name="analysis_agent",
-        description="This agent is responsible for analyzing the codebase and determining what files are causing the issue."
+    model_factory = partial(
+        create_model,
+        model_id=args.model,
+        api_base=args.api_base,
+        stream=args.stream,
+        cache_path=args.llm_cache,
+        cache_max_size_bytes=int(args.llm_cache_gb * 1024 ** 3) if args.llm_cache_gb is not None else None,
+        replay_only=args.replay_only
     )
-    
-    # Create main agent
-    agent = create_code_agent(
-        model=model,
-        analysis_agent=analysis_agent,
+    model = model_factory()
+    context_budget = ContextBudget(max_prompt_tokens=args.max_prompt_tokens) if args.max_prompt_tokens else None
+    run_budget = RunBudget(
+        max_steps=args.max_steps,
+        max_input_tokens=args.max_input_tokens,
+        max_output_tokens=args.max_output_tokens,
+        max_seconds=args.max_seconds
     )
     
-    # Display system prompt (for debugging)
-    print(Markdown(agent.system_prompt))
+    # Instrument the run, exporting to OpenTelemetry if a collector or file is given
+    instrumentation = telemetry = None
+    if args.instrument:
+        if args.otlp_endpoint or args.trace_file or args.otel_metrics_file:
+            telemetry = setup_opentelemetry(
+                otlp_endpoint=args.otlp_endpoint,
+                trace_file=args.trace_file,
+                metrics_file=args.otel_metrics_file
+            )
+        instrumentation = Instrumentation(telemetry)
     
-    # Create task description
-    task = f"""You are tasked with understanding an issue in the following github repository {row['repo']}.
-    You will be given a description of the issue and tools to search the codebase.
-    Your job is to determine, what file or files are causing the issue.
-    The tools provided will allow you to search the codebase and find the files that are causing the issue.
-    Determine what is the function or class where this issue is happening
-    ### Issue Description
-    {row['problem_statement']}"""
-    
-    # Run the agent
+    # Run the analysis, answering without a model when the issue's tracebacks and symbols are conclusive
     print("Running analysis...")
-    result = agent.run(task)
+    record = analyze_issue(
+        row,
+        db_path,
+        model,
+        instrumentation=instrumentation,
+        context_budget=context_budget,
+        fan_out=args.fan_out,
+        model_factory=model_factory,
+        fast_path_threshold=args.fast_path_threshold if args.fast_path else None,
+        run_budget=run_budget
+    )
     
     # Print result
-    print("\nAnalysis Result:")
-    print(result)
+    fast_path = record.get("fast_path")
+    if fast_path is not None:
+        if "error" in fast_path:
+            print(f"Fast path failed, running the agents: {fast_path['error']}")
+        else:
+            print(f"Fast path: confidence {fast_path['confidence']}, margin {fast_path['margin']}, "
+                  f"in {fast_path['duration']}s")
+    if record["status"] == "error":
+        print(f"\nAnalysis failed: {record['error']}")
+    else:
+        print("\nAnalysis Result:")
+        print(record["result"])
+    budget = record.get("budget")
+    if budget is not None:
+        print(f"\nBudget: {budget['steps']} steps, {budget['input_tokens']} prompt and "
+              f"{budget['output_tokens']} completion tokens in {budget['seconds']}s"
+              + (f", stopped on the {budget['exhausted']} limit" if budget['exhausted'] else ""))
+    if "llm_cache" in record:
+        print(f"\nResponse cache: {record['llm_cache']}")
+    if instrumentation is not None:
+        summary = instrumentation.write_summary(args.metrics_output)
+        print(f"\nRun metrics written to {args.metrics_output}: {summary['duration_s']}s total, "
+              f"{summary['llm_time_s']}s in model calls, {summary['tool_time_s']}s in tools "
+              f"({summary['db_time_s']}s in SQL)")
+    if telemetry is not None:
+        telemetry.shutdown()
+    if record["status"] == "error":
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Analyze every issue of a dataset, running many agents concurrently.
+
+Repository indexes are built in worker processes, once per repository state,
+into the index cache where later runs reuse them. Agents run in threads, since
+they mostly wait on the model endpoint, so a single process can keep many
+requests in flight against a server such as vLLM. Each result is appended to a JSON lines file as soon as
+its run completes, and issues already in that file are skipped, so an
+interrupted batch resumes where it stopped.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from kowinski.agents.code_agent import VLLM_PREFIXES, create_model
+from kowinski.agents.context_budget import ContextBudget
+from kowinski.agents.run_budget import RunBudget
+from kowinski.agents.scheduler import AdaptiveScheduler
+from kowinski.agents.vllm_model import VLLM_API_BASE, prefix_cache_hit_rate, read_prefix_cache_counters
+from kowinski.parser.index_cache import DEFAULT_CACHE_DIR, IndexCache
+from kowinski.tools.fast_localizer import DEFAULT_THRESHOLD
+from kowinski.scripts.analyze_issue import analyze_issue
+from kowinski.scripts.prebuild_indexes import issue_id, plan_builds
+
+def load_completed(output_path: str) -> set:
+    """Get the ids of the issues already in the output file."""
+    if not os.path.exists(output_path):
+        return set()
+    completed = set()
+    with open(output_path) as f:
+        for line in f:
+            try:
+                completed.add(json.loads(line)["instance_id"])
+            except (json.JSONDecodeError, KeyError):
+                continue  # A line cut short by an interrupted run
+    return completed
+
+class ResultWriter:
+    """Appends result records to a JSON lines file from many threads, one flushed line per record."""
+
+    def __init__(self, output_path: str):
+        self.file = open(output_path, "a")
+        self.lock = threading.Lock()
+
+    def write(self, record: dict):
+        line = json.dumps(record, default=str)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def run_batch(args):
+    issues = pd.read_parquet(args.issue_data)
+    if args.limit is not None:
+        issues = issues.iloc[:args.limit]
+    max_size = int(args.max_cache_gb * 1024 ** 3) if args.max_cache_gb is not None else None
+    cache = IndexCache(args.cache_dir, max_size_bytes=max_size)
+
+    completed = load_completed(args.output)
+    pending = []
+    for index, row in enumerate(issues.to_dict("records")):
+        instance = issue_id(row, index)
+        if instance not in completed:
+            pending.append((instance, row))
+    print(f"{len(pending)} issues to run, {len(issues) - len(pending)} already in {args.output}")
+
+    writer = ResultWriter(args.output)
+    index_pool = ProcessPoolExecutor(max_workers=args.index_workers)
+    agent_pool = ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="kowinski-agent")
+    start = time.perf_counter()
+    counts = {"completed": 0, "error": 0}
+
+    model_kwargs = {
+        "model_id": args.model,
+        "api_key": args.api_key,
+        "api_base": args.api_base,
+        "stream": args.stream,
+        "cache_path": args.llm_cache,
+        "cache_max_size_bytes": int(args.llm_cache_gb * 1024 ** 3) if args.llm_cache_gb is not None else None,
+        "replay_only": args.replay_only,
+        "scheduler": AdaptiveScheduler(
+            initial_concurrency=min(args.concurrency, 16),
+            max_concurrency=args.concurrency,
+            tokens_per_second=args.tokens_per_second,
+            target_latency=args.target_latency
+        ),
+    }
+
+    # Measure the prefix cache of a self-hosted server over the batch
+    vllm_api_base = None
+    if args.model.startswith(VLLM_PREFIXES):
+        vllm_api_base = args.api_base or os.environ.get("VLLM_API_BASE", VLLM_API_BASE)
+    prefix_cache_start = read_prefix_cache_counters(vllm_api_base) if vllm_api_base else None
+    context_budget = ContextBudget(max_prompt_tokens=args.max_prompt_tokens) if args.max_prompt_tokens else None
+
+    def run_agent(instance, row, db_path):
+        start = time.perf_counter()
+        try:
+            model = create_model(**model_kwargs)
+            record = analyze_issue(
+                row, db_path, model, context_budget=context_budget,
+                fan_out=args.fan_out, model_factory=lambda: create_model(**model_kwargs),
+                fast_path_threshold=args.fast_path_threshold if args.fast_path else None,
+                run_budget=RunBudget(
+                    max_steps=args.max_steps,
+                    max_input_tokens=args.max_input_tokens,
+                    max_output_tokens=args.max_output_tokens,
+                    max_seconds=args.max_seconds
+                )
+            )
+        except Exception as e:
+            record = {"status": "error", "error": f"{type(e).__name__}: {e}",
+                      "duration": round(time.perf_counter() - start, 3)}
+        return {"instance_id": instance, "repo": row.get("repo"), **record}
+
+    try:
+        # Build the indexes in processes; start the agents of each as soon as it is ready
+        builds, keys, errors = plan_builds(pending, args.repos_dir, cache)
+        rows = dict(pending)
+        for instance, error in errors.items():
+            writer.write({"instance_id": instance, "repo": rows[instance].get("repo"), "status": "error", "error": error})
+            counts["error"] += 1
+        instances_by_key = {}
+        for instance, key in keys.items():
+            instances_by_key.setdefault(key, []).append(instance)
+
+        index_futures = {
+            index_pool.submit(cache.get_or_build, repo_path, key, args.rebuild_index, list(builds), commit=commit): key
+            for key, (repo_path, commit) in builds.items()
+        }
+        agent_futures = {}
+        for future in as_completed(index_futures):
+            key = index_futures[future]
+            try:
+                db_path = future.result()
+            except Exception as e:
+                for instance in instances_by_key[key]:
+                    writer.write({"instance_id": instance, "repo": rows[instance].get("repo"), "status": "error",
+                                  "error": f"Index build failed: {type(e).__name__}: {e}"})
+                    counts["error"] += 1
+                continue
+            for instance in instances_by_key[key]:
+                agent_futures[agent_pool.submit(run_agent, instance, rows[instance], db_path)] = instance
+
+        for future in as_completed(agent_futures):
+            record = future.result()
+            writer.write(record)
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+            done = sum(counts.values())
+            elapsed = time.perf_counter() - start
+            print(f"[{done}/{len(pending)}] {record['instance_id']}: {record['status']} "
+                  f"in {record['duration']:.1f}s ({done / elapsed * 60:.1f} issues/min, "
+                  f"{model_kwargs['scheduler'].concurrency} concurrent model calls)")
+    finally:
+        index_pool.shutdown(cancel_futures=True)
+        agent_pool.shutdown(cancel_futures=True)
+        writer.close()
+
+    print(f"Done in {time.perf_counter() - start:.1f}s: {counts}")
+    print(f"Scheduler: {model_kwargs['scheduler'].snapshot()}")
+    if vllm_api_base:
+        prefix_cache = prefix_cache_hit_rate(prefix_cache_start, read_prefix_cache_counters(vllm_api_base))
+        print(f"Prefix cache: {prefix_cache or 'no metrics from ' + vllm_api_base}")
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Analyze all the issues of a dataset concurrently")
+    parser.add_argument("--issue-data", required=True, help="Path to the issue data parquet file")
+    parser.add_argument("--repos-dir", required=True,
+                        help="Directory with one checkout per issue (<instance_id>) or per repository (<owner>__<name>)")
+    parser.add_argument("--output", default="results.jsonl", help="JSON lines file the results are appended to")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Directory of the cached repository databases")
+    parser.add_argument("--max-cache-gb", type=float, default=None, help="Size the cache is evicted down to")
+    parser.add_argument("--rebuild-index", action="store_true", help="Rebuild databases that already exist")
+    parser.add_argument("--concurrency", type=int, default=32,
+                        help="Number of agents running at the same time, and limit of concurrent model calls")
+    parser.add_argument("--index-workers", type=int, default=os.cpu_count(), help="Processes building indexes")
+    parser.add_argument("--model", default="gemini-2.0-flash", help="Model to use for analysis")
+    parser.add_argument("--api-base", default=None, help="Base URL of the model endpoint")
+    parser.add_argument("--api-key", default=None, help="API key of the model endpoint")
+    parser.add_argument("--stream", action="store_true", help="Stream the model responses (vLLM models)")
+    parser.add_argument("--tokens-per-second", type=float, default=None,
+                        help="Rate limit of prompt and completion tokens across all agents")
+    parser.add_argument("--target-latency", type=float, default=None,
+                        help="Model call latency in seconds above which concurrency is reduced")
+    parser.add_argument("--max-prompt-tokens", type=int, default=None,
+                        help="Shorten old observations to keep prompts under this many tokens (estimated)")
+    parser.add_argument("--fan-out", action="store_true",
+                        help="Localize with several analysis agents in parallel, stopping once they agree")
+    parser.add_argument("--fast-path", action="store_true",
+                        help="Localize from tracebacks, symbols and text first, answering without a model when confident")
+    parser.add_argument("--fast-path-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Score the best fast path candidate needs to answer without a model")
+    parser.add_argument("--max-steps", type=int, default=None, help="Steps the agents of a run may take in total")
+    parser.add_argument("--max-input-tokens", type=int, default=None, help="Prompt tokens a run may use")
+    parser.add_argument("--max-output-tokens", type=int, default=None, help="Completion tokens a run may use")
+    parser.add_argument("--max-seconds", type=float, default=None, help="Wall time of a run, checked after each step")
+    parser.add_argument("--llm-cache", default=None, help="Path to a SQLite file caching the model responses")
+    parser.add_argument("--llm-cache-gb", type=float, default=None, help="Size the response cache is evicted down to")
+    parser.add_argument("--replay-only", action="store_true", help="Fail on requests missing from the response cache")
+    parser.add_argument("--limit", type=int, default=None, help="Only run the first issues of the dataset")
+    args = parser.parse_args()
+    run_batch(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Benchmark for identify_issue_patterns.
+
+Compares the single-pass scanner of `find_issue_patterns` with the previous
+implementation, which ran fresh regexes for every mentioned name over every
+line, on a synthetic issue and file (or on files given on the command line).
+"""
+
+import argparse
+import random
+import re
+import time
+
+from kowinski.tools.patch_tools import find_issue_patterns
+
+def legacy_identify_issue_patterns(file_content, issue_description):
+    """The per-name, per-line regex scan that find_issue_patterns replaced."""
+    lines = file_content.splitlines()
+    results = []
+
+    # Extract error messages from the issue description
+    error_patterns = []
+    traceback_pattern = r"Traceback[^\n]*\n((?:[ ]*File \"[^\"]*\", line \d+[^\n]*\n)+)"
+    tracebacks = re.findall(traceback_pattern, issue_description, re.MULTILINE)
+
+    for traceback in tracebacks:
+        # Extract file paths and line numbers
+        file_line_pattern = r"File \"([^\"]*)\", line (\d+)"
+        locations = re.findall(file_line_pattern, traceback)
+
+        for filepath, line_num in locations:
+            filename = filepath.split("/")[-1]
+            error_patterns.append({
+                "type": "traceback",
+                "file": filename,
+                "line": int(line_num),
+                "context": traceback
+            })
+
+    # Look for specific error types mentioned in the issue
+    error_types = [
+        "TypeError", "ValueError", "AttributeError", "ImportError",
+        "KeyError", "IndexError", "SyntaxError", "NameError"
+    ]
+
+    for error_type in error_types:
+        if error_type in issue_description:
+            error_msg_pattern = fr"{error_type}:\s*([^\n]+)"
+            error_msgs = re.findall(error_msg_pattern, issue_description)
+
+            for error_msg in error_msgs:
+                error_patterns.append({
+                    "type": error_type,
+                    "message": error_msg
+                })
+
+    # Look for mentioned variables or functions
+    mentioned_items = {}
+
+    # Match potential function or method names in issue description
+    func_pattern = r'\b([a-zA-Z_][a-zA-Z0-9_]*)\s*\('
+    for match in re.finditer(func_pattern, issue_description):
+        func_name = match.group(1)
+        if func_name not in mentioned_items and len(func_name) > 2:  # Avoid common words
+            mentioned_items[func_name] = "function"
+
+    # Match potential variable names
+    var_pattern = r'\b([a-zA-Z_][a-zA-Z0-9_]*)\b'
+    for match in re.finditer(var_pattern, issue_description):
+        var_name = match.group(1)
+        if var_name not in mentioned_items and len(var_name) > 2:
+            mentioned_items[var_name] = "variable"
+
+    # Now search for the identified patterns in the file
+    for item_name, item_type in mentioned_items.items():
+        if item_type == "function":
+            # Look for function definitions or calls
+            def_pattern = fr"def\s+{re.escape(item_name)}\s*\("
+            call_pattern = fr"[^a-zA-Z0-9_]{re.escape(item_name)}\s*\("
+
+            for i, line in enumerate(lines):
+                if re.search(def_pattern, line):
+                    results.append({
+                        "type": "function_definition",
+                        "name": item_name,
+                        "line": i + 1,
+                        "content": line
+                    })
+                elif re.search(call_pattern, line):
+                    results.append({
+                        "type": "function_call",
+                        "name": item_name,
+                        "line": i + 1,
+                        "content": line
+                    })
+        else:
+            # Look for variable assignments or usages
+            for i, line in enumerate(lines):
+                if re.search(fr"[^a-zA-Z0-9_]{re.escape(item_name)}\s*=", line):
+                    results.append({
+                        "type": "variable_assignment",
+                        "name": item_name,
+                        "line": i + 1,
+                        "content": line
+                    })
+                elif re.search(fr"[^a-zA-Z0-9_]{re.escape(item_name)}[^a-zA-Z0-9_]", line):
+                    results.append({
+                        "type": "variable_usage",
+                        "name": item_name,
+                        "line": i + 1,
+                        "content": line
+                    })
+
+    # Match line numbers from tracebacks to the file
+    for pattern in error_patterns:
+        if pattern["type"] == "traceback" and "line" in pattern:
+            line_num = pattern["line"] - 1  # Convert to 0-indexed
+            if 0 <= line_num < len(lines):
+                results.append({
+                    "type": "traceback_line",
+                    "line": pattern["line"],
+                    "content": lines[line_num],
+                    "context": pattern["context"]
+                })
+
+    return results
+def make_issue(rng, identifiers, num_words=600):
+    """Build an issue mixing prose, identifiers, calls and a traceback."""
+    prose = "the value is wrong when calling this with an empty list and then it fails again".split()
+    words = []
+    for _ in range(num_words):
+        roll = rng.random()
+        if roll < 0.2:
+            words.append(rng.choice(identifiers) + "()")
+        elif roll < 0.5:
+            words.append(rng.choice(identifiers))
+        else:
+            words.append(rng.choice(prose))
+    traceback = "Traceback (most recent call last):\n" + "".join(
+        f'  File "/usr/lib/python3/site-packages/pkg/module.py", line {rng.randint(1, 4000)}, in {rng.choice(identifiers)}\n'
+        for _ in range(12)
+    )
+    return " ".join(words) + "\n" + traceback + "ValueError: invalid value\n"
+
+def make_file(rng, identifiers, num_lines=5000):
+    """Build a Python-looking file defining, calling and assigning the identifiers."""
+    lines = []
+    while len(lines) < num_lines:
+        lines.append(f"def {rng.choice(identifiers)}(self, {rng.choice(identifiers)}, value=None):")
+        for _ in range(rng.randint(3, 12)):
+            lines.append(f"    {rng.choice(identifiers)} = {rng.choice(identifiers)}(value, {rng.choice(identifiers)})")
+        lines.append(f"    return {rng.choice(identifiers)}")
+        lines.append("")
+    return "\n".join(lines[:num_lines])
+
+def time_call(function, *args, repeat=3):
+    """Best wall time of `repeat` calls, with the result of the last one."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark identify_issue_patterns")
+    parser.add_argument("--file", help="Python file to scan instead of a synthetic one")
+    parser.add_argument("--issue", help="Text file with the issue instead of a synthetic one")
+    parser.add_argument("--lines", type=int, default=5000, help="Lines of the synthetic file")
+    parser.add_argument("--words", type=int, default=600, help="Words of the synthetic issue")
+    parser.add_argument("--skip-legacy", action="store_true", help="Only time the single-pass scanner")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    verbs = ["get", "set", "parse", "load", "build"]
+    nouns = ["value", "node", "field", "row", "item"]
+    identifiers = [f"{rng.choice(verbs)}_{rng.choice(nouns)}_{i}" for i in range(300)]
+    file_content = open(args.file).read() if args.file else make_file(rng, identifiers, args.lines)
+    issue = open(args.issue).read() if args.issue else make_issue(rng, identifiers, args.words)
+    print(f"File: {len(file_content.splitlines())} lines, issue: {len(issue)} characters")
+
+    elapsed, results = time_call(find_issue_patterns, file_content, issue)
+    print(f"single pass: {elapsed * 1000:9.1f} ms, {len(results)} results")
+    if not args.skip_legacy:
+        elapsed_legacy, legacy_results = time_call(legacy_identify_issue_patterns, file_content, issue, repeat=1)
+        print(f"legacy:      {elapsed_legacy * 1000:9.1f} ms, {len(legacy_results)} results")
+        print(f"speedup:     {elapsed_legacy / elapsed:9.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Check of the vLLM client against a local stub server.
+
+Starts an OpenAI-compatible stub on localhost whose behaviour depends on the
+requested model name, and checks that VLLMServerModel retries 429 and 503
+responses after their Retry-After delay, gives up with a transient
+VLLMRequestError, fails fast on other errors, and assembles streamed content
+and tool calls. Exits with status 1 if a check fails.
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from smolagents import tool
+
+from kowinski.agents.vllm_model import VLLMRequestError, VLLMServerModel
+
+USAGE = {"prompt_tokens": 11, "completion_tokens": 5}
+STREAMED_TEXT = "Thought: the answer is ready\nCode:\n```py\nfinal_answer(42)\n```"
+# A tool call split across chunks, as vLLM streams it: id and name first, then pieces of the arguments
+STREAMED_TOOL_CALL_DELTAS = [
+    {"index": 0, "id": "call_0", "type": "function", "function": {"name": "get_file_outline", "arguments": ""}},
+    {"index": 0, "function": {"arguments": "{\"file_path\": "}},
+    {"index": 1, "id": "call_1", "type": "function", "function": {"name": "final_answer", "arguments": "{\"answer\""}},
+    {"index": 0, "function": {"arguments": "\"pkg/mod.py\"}"}},
+    {"index": 1, "function": {"arguments": ": \"done\"}"}},
+]
+
+@tool
+def get_file_outline(file_path: str) -> str:
+    """
+    Get the outline of a file.
+
+    Args:
+        file_path: The relative path to the file.
+    """
+    return file_path
+
+@tool
+def final_answer(answer: str) -> str:
+    """
+    Give the final answer.
+
+    Args:
+        answer: The answer.
+    """
+    return answer
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """
+    Chat completions answered by scenario, the model name of the request:
+
+    - retry-429, retry-503: fail twice with that status and a Retry-After of 0.2 s, then answer.
+    - overloaded: always fail with 503.
+    - bad-request: fail with 400.
+    - stream-text, stream-tools: stream a message, or tool calls, in small chunks.
+    - anything else: answer at once.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, deltas):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        events = [{"choices": [{"index": 0, "delta": delta}]} for delta in deltas]
+        events.append({"choices": [], "usage": USAGE})
+        for data in [*(json.dumps(event) for event in events), "[DONE]"]:
+            chunk = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        scenario = request["model"]
+        with self.server.lock:
+            self.server.requests[scenario] += 1
+            attempt = self.server.requests[scenario]
+
+        if scenario in ("retry-429", "retry-503") and attempt <= 2:
+            status = int(scenario.split("-")[1])
+            self._send(status, {"error": "busy"}, {"Retry-After": "0.2"})
+        elif scenario == "overloaded":
+            self._send(503, {"error": "overloaded"}, {"Retry-After": "0"})
+        elif scenario == "bad-request":
+            self._send(400, {"error": "bad request"})
+        elif scenario == "stream-text":
+            self._stream([{"role": "assistant"}, *({"content": STREAMED_TEXT[i:i + 7]} for i in range(0, len(STREAMED_TEXT), 7))])
+        elif scenario == "stream-tools":
+            self._stream([{"role": "assistant"}, *({"tool_calls": [delta]} for delta in STREAMED_TOOL_CALL_DELTAS)])
+        else:
+            self._send(200, {"choices": [{"message": {"role": "assistant", "content": "ok"}}], "usage": USAGE})
+
+def start_stub_server() -> ThreadingHTTPServer:
+    """Start the stub server on a free port, from a background thread."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = Counter()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+MESSAGES = [{"role": "user", "content": [{"type": "text", "text": "Find the bug"}]}]
+
+def _model(api_base: str, scenario: str, **kwargs) -> VLLMServerModel:
+    return VLLMServerModel(model_id=scenario, api_base=api_base, timeout=(2.0, 5.0), **kwargs)
+
+def check_retry_after(api_base, server, scenario):
+    start = time.perf_counter()
+    message = _model(api_base, scenario)(MESSAGES)
+    elapsed = time.perf_counter() - start
+    attempts = server.requests[scenario]
+    return message.content == "ok" and attempts == 3 and elapsed >= 0.4, f"{attempts} attempts in {elapsed:.2f}s"
+
+def check_error(api_base, server, scenario, transient, status_code, attempts, **kwargs):
+    try:
+        _model(api_base, scenario, **kwargs)(MESSAGES)
+        return False, "no error raised"
+    except VLLMRequestError as e:
+        made = server.requests[scenario]
+        return (e.transient == transient and e.status_code == status_code and made == attempts,
+                f"transient={e.transient} status={e.status_code} after {made} attempts")
+
+def check_streamed_text(api_base, server):
+    model = _model(api_base, "stream-text", stream=True)
+    message = model(MESSAGES)
+    tokens = (model.last_input_token_count, model.last_output_token_count)
+    return (message.content == STREAMED_TEXT and tokens == (USAGE["prompt_tokens"], USAGE["completion_tokens"]),
+            f"{len(message.content or '')} characters, {tokens[0]}+{tokens[1]} tokens")
+
+def check_streamed_tool_calls(api_base, server):
+    message = _model(api_base, "stream-tools", stream=True)(MESSAGES, tools_to_call_from=[get_file_outline, final_answer])
+    calls = [(call.id, call.function.name, call.function.arguments) for call in message.tool_calls or []]
+    expected = [
+        ("call_0", "get_file_outline", {"file_path": "pkg/mod.py"}),
+        ("call_1", "final_answer", {"answer": "done"}),
+    ]
+    return calls == expected, str(calls)
+
+CHECKS = [
+    ("429 is retried after Retry-After", check_retry_after, {"scenario": "retry-429"}),
+    ("503 is retried after Retry-After", check_retry_after, {"scenario": "retry-503"}),
+    ("persistent 503 fails with a transient error", check_error,
+     {"scenario": "overloaded", "transient": True, "status_code": 503, "attempts": 3, "max_retries": 2}),
+    ("400 fails without retries", check_error,
+     {"scenario": "bad-request", "transient": False, "status_code": 400, "attempts": 1}),
+    ("streamed content is assembled", check_streamed_text, {}),
+    ("streamed tool calls are assembled", check_streamed_tool_calls, {}),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the vLLM client against a local stub server")
+    parser.parse_args()
+
+    server = start_stub_server()
+    host, port = server.server_address[:2]
+    failures = 0
+    try:
+        for name, check, kwargs in CHECKS:
+            try:
+                passed, details = check(f"http://{host}:{port}/v1", server, **kwargs)
+            except Exception as e:
+                passed, details = False, f"{type(e).__name__}: {e}"
+            failures += not passed
+            print(f"{'PASS' if passed else 'FAIL'} {name}: {details}")
+    finally:
+        server.shutdown()
+        server.server_close()
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Script to run a shared index server for repository databases.
+
+Agents in other processes connect to it with
+`kowinski.tools.index_server.remote_repository_querier`.
+"""
+
+import argparse
+
+from kowinski.tools.index_server import IndexServer, DEFAULT_HOST, DEFAULT_PORT
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description="Serve repository querier tools from warm in-memory indexes")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument("--max-repos", type=int, default=8, help="Number of repository databases kept in memory")
+    parser.add_argument("--on-disk", action="store_true", help="Query database files directly instead of in-memory copies")
+    args = parser.parse_args()
+
+    server = IndexServer(
+        host=args.host,
+        port=args.port,
+        max_repos=args.max_repos,
+        in_memory=not args.on_disk
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Load test for the async repository querier.
+
+Runs the same mix of tool calls at increasing concurrency levels and reports
+the throughput of each level, to check that it scales with the connection pool.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from kowinski.tools.async_querier import async_repository_querier
+from kowinski.tools.code_analysis import repository_querier
+
+def build_workload(db_path, num_requests, seed=0):
+    """Build a list of (tool name, kwargs) calls over the functions of the indexed repository."""
+    tools = repository_querier(db_path)
+    python_files = tools["get_files_by_extension"]("py", limit=None, max_chars=None)
+    if len(python_files) == 0:
+        raise SystemExit(f"No Python files indexed in {db_path}")
+
+    rng = random.Random(seed)
+    workload = []
+    for _ in range(num_requests):
+        file_info = rng.choice(python_files.items)
+        line = rng.randint(1, max(file_info.line_count, 1))
+        workload.append(rng.choice([
+            ("get_file_outline", {"file_path": file_info.full_path}),
+            ("get_entity_at_line", {"file_path": file_info.full_path, "line_number": line}),
+            ("get_code_segment", {"file_path": file_info.full_path, "start_line": line, "end_line": line + 40}),
+            ("get_file_structure", {"file_path": file_info.full_path, "limit": 20}),
+        ]))
+    return workload
+
+async def run_level(tools, workload, concurrency):
+    """Run the workload with `concurrency` tasks pulling calls from a shared queue."""
+    queue = asyncio.Queue()
+    for call in workload:
+        queue.put_nowait(call)
+
+    async def worker():
+        while not queue.empty():
+            tool_name, kwargs = queue.get_nowait()
+            await tools[tool_name](**kwargs)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start
+
+async def run(args):
+    workload = build_workload(args.db_path, args.requests)
+    levels = [int(level) for level in args.concurrency.split(",")]
+    async with async_repository_querier(args.db_path, pool_size=max(levels), processes=args.processes) as tools:
+        # Warm up the connections and the page cache
+        await run_level(tools, workload[:max(levels)], max(levels))
+
+        print(f"{'concurrency':>12} {'seconds':>10} {'calls/s':>10} {'speedup':>8}")
+        baseline = None
+        for concurrency in levels:
+            elapsed = await run_level(tools, workload, concurrency)
+            throughput = len(workload) / elapsed
+            baseline = baseline or throughput
+            print(f"{concurrency:>12} {elapsed:>10.3f} {throughput:>10.1f} {throughput / baseline:>7.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure querier throughput at increasing concurrency")
+    parser.add_argument("--db-path", default="repository.db", help="Path to the SQLite database")
+    parser.add_argument("--requests", type=int, default=2000, help="Number of tool calls per concurrency level")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="Comma-separated concurrency levels")
+    parser.add_argument("--processes", action="store_true", help="Run the tools in worker processes instead of threads")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
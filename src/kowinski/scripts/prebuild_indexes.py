@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Index every repository of a dataset into the index cache before running agents.
+
+Checkouts are resolved per issue and keyed by the issue's base_commit, or by the
+commit they have checked out when the dataset has none, so issues sharing a
+repository state are indexed once. A checkout on another commit is indexed from
+a temporary worktree of the base commit. The builds run in
+parallel processes, as parsing is CPU bound.
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from kowinski.parser.index_cache import DEFAULT_CACHE_DIR, IndexCache
+
+def issue_id(row, index: int) -> str:
+    """Get the identifier of an issue: its instance_id, or its position in the dataset."""
+    instance_id = row.get("instance_id")
+    return str(instance_id) if instance_id is not None and not pd.isna(instance_id) else str(index)
+
+def issue_commit(row) -> Optional[str]:
+    """Get the commit an issue was filed against, its base_commit, or None if the dataset has none."""
+    commit = row.get("base_commit")
+    return str(commit) if commit is not None and not pd.isna(commit) and str(commit) else None
+
+def resolve_repo_path(row, repos_dir: str, instance: str) -> str:
+    """
+    Find the checkout of an issue's repository.
+
+    Looks for <repos_dir>/<instance_id>, then <repos_dir>/<owner>__<name>.
+    """
+    candidates = [os.path.join(repos_dir, instance)]
+    if row.get("repo"):
+        candidates.append(os.path.join(repos_dir, str(row["repo"]).replace("/", "__")))
+    for candidate in candidates:
+        if os.path.isdir(candidate):
+            return candidate
+    raise FileNotFoundError(f"No checkout for {instance} in {repos_dir} (tried {', '.join(candidates)})")
+
+def plan_builds(issues: List[Tuple[str, dict]], repos_dir: str, cache: IndexCache):
+    """
+    Resolve the checkout and cache key of each issue.
+
+    Args:
+        issues: (instance id, issue record) pairs.
+        repos_dir: Directory of the checkouts.
+        cache: The index cache.
+
+    Returns:
+        A tuple (builds, keys, errors): the checkout and commit to index for each key,
+        the key of each issue, and the error of each issue without a checkout.
+    """
+    builds: Dict[str, Tuple[str, Optional[str]]] = {}
+    keys: Dict[str, str] = {}
+    errors: Dict[str, str] = {}
+    for instance, row in issues:
+        try:
+            repo_path = resolve_repo_path(row, repos_dir, instance)
+        except FileNotFoundError as e:
+            errors[instance] = str(e)
+            continue
+        commit = issue_commit(row)
+        key = cache.key_for(repo_path, repo=row.get("repo"), instance_id=instance, commit=commit)
+        keys[instance] = key
+        builds.setdefault(key, (repo_path, commit))
+    return builds, keys, errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the repositories of a dataset in parallel")
+    parser.add_argument("--issue-data", required=True, help="Path to the issue data parquet file")
+    parser.add_argument("--repos-dir", required=True,
+                        help="Directory with one checkout per issue (<instance_id>) or per repository (<owner>__<name>)")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Directory of the cached repository databases")
+    parser.add_argument("--max-cache-gb", type=float, default=None, help="Size the cache is evicted down to")
+    parser.add_argument("--rebuild-index", action="store_true", help="Rebuild databases that already exist")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes building indexes")
+    args = parser.parse_args()
+
+    max_size = int(args.max_cache_gb * 1024 ** 3) if args.max_cache_gb is not None else None
+    cache = IndexCache(args.cache_dir, max_size_bytes=max_size)
+    issues = pd.read_parquet(args.issue_data).to_dict("records")
+    builds, keys, errors = plan_builds(
+        [(issue_id(row, index), row) for index, row in enumerate(issues)], args.repos_dir, cache
+    )
+    for instance, error in errors.items():
+        print(f"Skipping {instance}: {error}")
+
+    todo = {key: build for key, build in builds.items()
+            if args.rebuild_index or cache.get(key) is None}
+    print(f"{len(issues)} issues, {len(builds)} repository states, {len(todo)} to index")
+
+    start = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(cache.get_or_build, repo_path, key, args.rebuild_index, list(builds), commit=commit): key
+            for key, (repo_path, commit) in todo.items()
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            key = futures[future]
+            try:
+                future.result()
+                print(f"[{done}/{len(todo)}] Indexed {key}")
+            except Exception as e:
+                failed += 1
+                print(f"[{done}/{len(todo)}] Failed to index {key}: {type(e).__name__}: {e}")
+
+    print(f"Indexed {len(todo) - failed} repository states in {time.perf_counter() - start:.1f}s, "
+          f"{failed} failed; cache size {cache.size() / 1024 ** 2:.1f} MB")
+
+if __name__ == "__main__":
+    main()
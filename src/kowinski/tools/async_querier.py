@@ -0,0 +1,113 @@
+"""
+Async variants of the repository querier tools for agents running as asyncio tasks.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Dict
+
+from kowinski.tools.code_analysis import repository_querier, create_read_only_engine, DEFAULT_POOL_SIZE
+
+# Querier tools of a worker process, set by _init_worker_process
+_worker_tools = None
+
+def _init_worker_process(db_path: str):
+    global _worker_tools
+    _worker_tools = repository_querier(db_path, pool_size=1)
+
+def _call_worker_tool(tool_name: str, args, kwargs):
+    return _worker_tools[tool_name](*args, **kwargs)
+
+class AsyncRepositoryQuerier(Dict[str, Callable[..., Awaitable[Any]]]):
+    """
+    Coroutine functions of the querier tools by name, owning the workers that run them.
+
+    Close it, or use it as an async context manager, to shut the workers down.
+    """
+
+    def __init__(self, tools: Dict[str, Callable[..., Awaitable[Any]]], executor: Executor, engine=None):
+        """
+        Args:
+            tools: Coroutine functions by tool name.
+            executor: Executor the tools run on.
+            engine: Engine created for the tools, disposed on close. None if the caller owns it.
+        """
+        super().__init__(tools)
+        self.executor = executor
+        self.engine = engine
+
+    def close(self):
+        """Wait for the running calls, then shut the workers down and close the connections."""
+        self.executor.shutdown(wait=True)
+        if self.engine is not None:
+            self.engine.dispose()
+            self.engine = None
+
+    async def aclose(self):
+        """Close without blocking the event loop."""
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    async def __aenter__(self) -> "AsyncRepositoryQuerier":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+def async_repository_querier(db_path: str = "repository.db", pool_size: int = DEFAULT_POOL_SIZE,
+                             engine=None, processes: bool = False) -> AsyncRepositoryQuerier:
+    """
+    Get coroutine functions for every repository querier tool.
+
+    Each call runs the synchronous tool on one of `pool_size` workers holding a
+    read-only SQLite connection, so up to `pool_size` calls from concurrent tasks
+    are executed at the same time without blocking the event loop.
+
+    With thread workers, SQLite releases the GIL while it reads but converting rows
+    to results does not, so throughput stops scaling once that conversion dominates.
+    Process workers each open their own connection and scale with the number of cores,
+    at the cost of pickling arguments and results.
+
+    Args:
+        db_path: Path to the SQLite database.
+        pool_size: Number of workers, each with its own pooled read-only connection.
+        engine: Optional SQLAlchemy engine to query instead of opening db_path.
+            Only used with thread workers.
+        processes: Whether to run the tools in worker processes instead of threads.
+
+    Returns:
+        AsyncRepositoryQuerier mapping tool names to coroutine functions taking the tool's
+        arguments. Close it when done to shut the workers down.
+    """
+    owned_engine = None
+    if processes:
+        executor = ProcessPoolExecutor(
+            max_workers=pool_size,
+            initializer=_init_worker_process,
+            initargs=(db_path,)
+        )
+        # Only used for the tool names and descriptions, never connected
+        tools = repository_querier(db_path)
+    else:
+        if engine is None:
+            engine = owned_engine = create_read_only_engine(db_path, pool_size)
+        tools = repository_querier(db_path, engine=engine)
+        # One worker per pooled connection, so workers never wait on the pool
+        executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="kowinski-querier")
+
+    def make_async(tool):
+        if processes:
+            def run(*args, **kwargs):
+                return executor.submit(_call_worker_tool, tool.name, args, kwargs)
+        else:
+            def run(*args, **kwargs):
+                return executor.submit(functools.partial(tool, *args, **kwargs))
+
+        async def call(*args, **kwargs):
+            return await asyncio.wrap_future(run(*args, **kwargs))
+
+        call.__name__ = tool.name
+        call.__doc__ = tool.description
+        return call
+
+    return AsyncRepositoryQuerier({name: make_async(tool) for name, tool in tools.items()}, executor, owned_engine)
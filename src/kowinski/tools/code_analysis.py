@@ -1,9 +1,18 @@
-from typing import List, Dict, Any, Optional, Tuple, Union
+from typing import List, Dict, Any, Optional, Tuple, Union, Callable, TYPE_CHECKING
 import pandas as pd
 from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
 import os
+import sqlite3
+import threading
+import urllib.parse
 from dataclasses import dataclass
 from smolagents import tool
+from kowinski.tools.retrieval import RepositoryRetriever, RankedCandidate
+from kowinski.tools.traceback_resolver import TracebackResolver, ResolvedFrame
+
+if TYPE_CHECKING:
+    from kowinski.tools.overlay import RepositoryOverlay
 
 @dataclass
 class FileInfo:
@@ -75,41 +84,407 @@ class CodeEntity:
     parent_name: Optional[str] = None  # Class name for methods, None for module-level entities
     details: Dict[str, Any] = None  # Additional type-specific details
 
-def repository_querier(db_path: str = "repository.db"):
+# Default page size and character budget for tools returning lists. A character
+# is roughly a quarter of a token, so the budget keeps a single observation
+# around 2k tokens.
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_MAX_CHARS = 8000
+# Number of read-only connections a querier may hold, i.e. of concurrent queries
+DEFAULT_POOL_SIZE = 8
+
+@dataclass
+class Page:
+    """
+    A window over a larger list of tool results.
+    
+    The page behaves like a list of its items (iteration, indexing, len), and
+    reports how many results were left out so the agent can ask for more by
+    passing `next_cursor` as the `cursor` argument of the same tool.
+    """
+    items: List[Any]
+    total: int  # Total number of results matching the query
+    cursor: int  # Offset of the first item in this page
+    next_cursor: Optional[int] = None  # Cursor of the next page, None on the last page
+    remaining: int = 0  # Number of results after this page
+    truncated: bool = False  # Whether results were left out by the limit or budget
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+def _take_within_budget(items: List[Any], max_chars: Optional[int],
+                        size: Callable[[Any], int] = lambda item: len(repr(item))) -> List[Any]:
+    """
+    Take items from the front of a list until a character budget is spent.
+    
+    Args:
+        items: The items to take from.
+        max_chars: The character budget, or None for no limit. At least one item
+            is always taken so that a single large item still makes progress.
+        size: Function giving the size of an item in characters.
+    
+    Returns:
+        The leading items that fit in the budget.
+    """
+    if max_chars is None:
+        return list(items)
+    
+    kept = []
+    used_chars = 0
+    for item in items:
+        item_chars = size(item)
+        if kept and used_chars + item_chars > max_chars:
+            break
+        kept.append(item)
+        used_chars += item_chars
+    return kept
+
+def _paginate(items: List[Any], total: int, cursor: int, max_chars: Optional[int]) -> Page:
+    """
+    Wrap a fetched window of results in a Page, trimming it to a character budget.
+    
+    Args:
+        items: The results fetched for this window (already limited).
+        total: The total number of results matching the query.
+        cursor: The offset of the first item.
+        max_chars: Maximum size of the page, measured on the repr of each item.
+            At least one item is always returned.
+    
+    Returns:
+        A Page with the kept items and the count of remaining results.
+    """
+    kept = _take_within_budget(items, max_chars)
+    next_cursor = cursor + len(kept)
+    remaining = max(total - next_cursor, 0)
+    return Page(
+        items=kept,
+        total=total,
+        cursor=cursor,
+        next_cursor=next_cursor if remaining > 0 else None,
+        remaining=remaining,
+        truncated=remaining > 0
+    )
+
+def _window_text(content: str, cursor: int = 0, limit: Optional[int] = None,
+                 max_chars: Optional[int] = None) -> str:
+    """
+    Select a window of lines from a text, trimmed to a character budget.
+    
+    Args:
+        content: The full text.
+        cursor: Number of lines to skip from the start of the text.
+        limit: Maximum number of lines to return, or None for no limit.
+        max_chars: Maximum number of characters to return, or None for no limit.
+            At least one line is always returned.
+    
+    Returns:
+        The selected lines, followed by a note with the number of lines left
+        and the cursor to continue from if the text was cut.
+    """
+    if cursor == 0 and limit is None and max_chars is None:
+        return content
+    
+    lines = content.splitlines(keepends=True)
+    window = lines[cursor:cursor + limit] if limit is not None else lines[cursor:]
+    kept = _take_within_budget(window, max_chars, size=len)
+    
+    next_cursor = cursor + len(kept)
+    remaining = len(lines) - next_cursor
+    text = "".join(kept)
+    if remaining > 0:
+        text += ("" if text.endswith("\n") else "\n") + f"... [truncated: {remaining} more lines, call again with cursor={next_cursor}]"
+    return text
+
+def create_read_only_engine(db_path: str = "repository.db", pool_size: int = DEFAULT_POOL_SIZE):
+    """
+    Create an engine over a bounded pool of read-only SQLite connections.
+    
+    Connections are opened with `mode=ro`, may be handed to any thread, and are
+    reused instead of reopened. With at most `pool_size` connections, that many
+    threads can query concurrently; further callers wait for a free connection.
+    
+    Args:
+        db_path: Path to the SQLite database.
+        pool_size: Maximum number of open connections.
+    
+    Returns:
+        A SQLAlchemy engine.
+    """
+    uri = f"file:{urllib.parse.quote(os.path.abspath(db_path))}?mode=ro"
+    return create_engine(
+        "sqlite://",
+        creator=lambda: sqlite3.connect(uri, uri=True, check_same_thread=False),
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=0
+    )
+
+def repository_querier(db_path: str = "repository.db", engine=None,
+                       pool_size: int = DEFAULT_POOL_SIZE,
+                       overlay: Optional["RepositoryOverlay"] = None):
     """
     A class to query the repository database and retrieve information for an AI agent.
     
     This class provides methods to explore and understand a code repository's structure,
     helping an AI agent to navigate, analyze, and reason about the codebase.
+    
+    Tools returning lists are paginated: they take a `limit` and a `cursor`
+    and a `max_chars` budget, and return a Page reporting how many results remain.
+    
+    Args:
+        db_path: Path to the SQLite database.
+        engine: Optional SQLAlchemy engine to query instead of opening db_path,
+            e.g. one over an in-memory copy of the database.
+        pool_size: Number of read-only connections to pool when opening db_path,
+            i.e. how many agents sharing these tools can query at the same time.
+        overlay: Optional RepositoryOverlay of patched files. Content, structure, outline
+            and entity lookups of a patched file answer from its patched state; ranking and
+            traceback resolution answer from the indexed tree.
     """
     
 
-    engine = create_engine(f"sqlite:///{db_path}")
+    if engine is None:
+        engine = create_read_only_engine(db_path, pool_size)
+    # The lexical and path suffix indexes are built on first use and kept for the querier's lifetime
+    retriever: Dict[str, RepositoryRetriever] = {}
+    resolver: Dict[str, TracebackResolver] = {}
+    # Agents sharing the tools may call them at the same time, and each index is built only once
+    index_lock = threading.Lock()
+    
+    def _split_path(file_path: str) -> Tuple[str, str]:
+        """Split a relative file path into its folder and file name."""
+        folder, filename = os.path.split(file_path)
+        return folder, filename
+    
+    def _count(query: str, params: Dict[str, Any]) -> int:
+        """Count the rows returned by a query."""
+        with engine.connect() as conn:
+            return conn.execute(text(f"SELECT COUNT(*) FROM ({query})"), params).scalar()
+    
+    def _fetch_page(query: str, params: Dict[str, Any], cursor: int,
+                    limit: Optional[int]) -> Tuple[pd.DataFrame, int]:
+        """Fetch one window of a query together with the total number of rows."""
+        total = _count(query, params)
+        page_query = f"{query} LIMIT :_limit OFFSET :_cursor"
+        page_params = {**params, "_limit": -1 if limit is None else limit, "_cursor": cursor}
+        with engine.connect() as conn:
+            result = pd.read_sql(text(page_query), conn, params=page_params)
+        return result, total
+    
+    def _file_info_from_row(row, content: Optional[str] = None) -> FileInfo:
+        """Build a FileInfo from a repofile row."""
+        return FileInfo(
+            id=int(row['id']),
+            relative_folder=row['relative_folder'],
+            file_name=row['file_name'],
+            file_extension=row['file_extension'],
+            line_count=int(row['line_count']),
+            full_path=os.path.join(row['relative_folder'], row['file_name']),
+            content=content
+        )
+    
+    def _function_info_from_row(row, file_id: int, file_path: str) -> FunctionInfo:
+        """Build a FunctionInfo from a pythonfunction row."""
+        return FunctionInfo(
+            id=int(row['id']),
+            name=row['name'],
+            start_line=int(row['start_line']),
+            end_line=int(row['end_line']),
+            args=row['args'],
+            is_method=bool(row['is_method']),
+            class_name=row['class_name'],
+            is_async=bool(row['is_async']),
+            decorators=row['decorators'],
+            docstring=row['docstring'],
+            file_id=file_id,
+            file_path=file_path
+        )
+    
+    def _class_info_from_row(row, file_id: int, file_path: str) -> ClassInfo:
+        """Build a ClassInfo from a pythonclass row."""
+        return ClassInfo(
+            id=int(row['id']),
+            name=row['name'],
+            start_line=int(row['start_line']),
+            end_line=int(row['end_line']),
+            base_classes=row['base_classes'],
+            decorators=row['decorators'],
+            docstring=row['docstring'],
+            file_id=file_id,
+            file_path=file_path
+        )
+    
+    def _variable_info_from_row(row, file_id: int, file_path: str) -> VariableInfo:
+        """Build a VariableInfo from a pythonvariable row."""
+        return VariableInfo(
+            id=int(row['id']),
+            name=row['name'],
+            line=int(row['line']),
+            value_repr=row['value_repr'],
+            is_module_level=bool(row['is_module_level']),
+            class_name=row['class_name'],
+            file_id=file_id,
+            file_path=file_path
+        )
+    
+    def _find_file(file_path: str) -> Optional[FileInfo]:
+        """Look up a file, including its content, by relative path."""
+        folder, filename = _split_path(file_path)
+        query = """
+        SELECT id, relative_folder, file_name, file_extension, line_count, content
+        FROM repofile
+        WHERE relative_folder = :folder AND file_name = :filename
+        """
+        with engine.connect() as conn:
+            result = pd.read_sql(text(query), conn, params={
+                "folder": folder,
+                "filename": filename
+            })
+        
+        if len(result) == 0:
+            return None
         
+        row = result.iloc[0]
+        file_info = _file_info_from_row(row, content=row['content'])
+        overlay_file = overlay.get(file_info.full_path) if overlay is not None else None
+        if overlay_file is not None:
+            file_info.content = overlay_file.content
+            file_info.line_count = overlay_file.line_count
+        return file_info
+    
+    def _fetch_entities(query: str, params: Dict[str, Any], cursor: int, limit: Optional[int],
+                        from_row: Callable[[Any], Any],
+                        overlay_matches: Callable[[str], List[Any]]) -> Tuple[List[Any], int]:
+        """
+        Fetch one window of entities ordered by file and line, with those of patched files
+        taken from the overlay. `overlay_matches` gives the matching entities of a patched file.
+        """
+        if overlay is None or len(overlay) == 0:
+            result, total = _fetch_page(query, params, cursor, limit)
+            return [from_row(row) for _, row in result.iterrows()], total
+        
+        # Lookups by name match few rows, so merge them all and window in memory
+        result, _ = _fetch_page(query, params, 0, None)
+        entities = [entity for entity in (from_row(row) for _, row in result.iterrows())
+                    if entity.file_path not in overlay]
+        for path in overlay.paths():
+            entities.extend(overlay_matches(path))
+        entities.sort(key=lambda entity: (_split_path(entity.file_path), entity.start_line))
+        end = None if limit is None else cursor + limit
+        return entities[cursor:end], len(entities)
         
     @tool
-    def get_folders() -> List[str]:
+    def get_folders(limit: int = DEFAULT_PAGE_SIZE, cursor: int = 0,
+                    max_chars: int = DEFAULT_MAX_CHARS) -> Page:
         """
         Get all unique folder paths in the repository.
         
+        Args:
+            limit: Maximum number of folders to return.
+            cursor: Number of folders to skip, pass the `next_cursor` of a previous page to continue.
+            max_chars: Character budget for the returned page.
+        
         Returns:
-            A list of all relative folder paths in the repository, sorted alphabetically.
+            A Page of relative folder paths in the repository, sorted alphabetically.
         """
         query = "SELECT DISTINCT relative_folder FROM repofile ORDER BY relative_folder"
+        result, total = _fetch_page(query, {}, cursor, limit)
+        return _paginate(result['relative_folder'].tolist(), total, cursor, max_chars)
+    
+    @tool
+    def get_tree(folder_path: str = "", max_depth: int = 2, include_files: bool = False,
+                 max_chars: int = DEFAULT_MAX_CHARS) -> str:
+        """
+        Get a compact tree of the folder hierarchy with file, line, function and class counts per subtree.
+        Prefer it over listing folders one by one to understand the repository layout.
+        
+        Args:
+            folder_path: The relative folder path to start from, '' for the repository root.
+            max_depth: Number of folder levels to show below the starting folder.
+            include_files: Whether to also list the files of each shown folder.
+            max_chars: Character budget for the rendered tree.
+            
+        Returns:
+            The folder tree as indented text, one folder per line followed by its aggregates.
+        """
+        folder_path = folder_path.strip("/")
+        query = """
+        SELECT path, parent_path, depth, total_files, total_lines, total_functions, total_classes
+        FROM repofolder
+        WHERE (path = :folder OR path LIKE :prefix) AND depth <= :max_depth
+        ORDER BY path
+        """
+        root_depth = 0 if folder_path == "" else folder_path.count("/") + 1
         with engine.connect() as conn:
-            result = pd.read_sql(query, conn)
-        return result['relative_folder'].tolist()
+            folders = pd.read_sql(text(query), conn, params={
+                "folder": folder_path,
+                "prefix": f"{folder_path}/%" if folder_path else "%",
+                "max_depth": root_depth + max_depth
+            })
+        
+        if len(folders) == 0:
+            return f"Folder '{folder_path}' not found"
+        
+        children = {}
+        for row in folders.itertuples(index=False):
+            children.setdefault(row.parent_path, []).append(row)
+        
+        files = {}
+        if include_files:
+            with engine.connect() as conn:
+                file_rows = pd.read_sql(text("""
+                    SELECT relative_folder, file_name, line_count
+                    FROM repofile
+                    WHERE relative_folder = :folder OR relative_folder LIKE :prefix
+                    ORDER BY file_name
+                """), conn, params={
+                    "folder": folder_path,
+                    "prefix": f"{folder_path}/%" if folder_path else "%"
+                })
+            for row in file_rows.itertuples(index=False):
+                files.setdefault(row.relative_folder, []).append(row)
+        
+        def describe(row):
+            return (f"{row.total_files} files, {row.total_lines} lines, "
+                    f"{row.total_functions} functions, {row.total_classes} classes")
+        
+        def render(row, prefix):
+            entries = [("folder", child) for child in children.get(row.path, [])]
+            entries += [("file", file_row) for file_row in files.get(row.path, [])]
+            lines = []
+            for i, (kind, entry) in enumerate(entries):
+                is_last = i == len(entries) - 1
+                connector = "└── " if is_last else "├── "
+                if kind == "folder":
+                    lines.append(f"{prefix}{connector}{os.path.basename(entry.path)}/ ({describe(entry)})")
+                    lines.extend(render(entry, prefix + ("    " if is_last else "│   ")))
+                else:
+                    lines.append(f"{prefix}{connector}{entry.file_name} ({entry.line_count} lines)")
+            return lines
+        
+        root = folders[folders['path'] == folder_path].iloc[0]
+        lines = [f"{folder_path or '.'}/ ({describe(root)})"] + render(root, "")
+        return _window_text("\n".join(lines), max_chars=max_chars)
     
     @tool
-    def get_files_in_folder( folder_path: str) -> List[FileInfo]:
+    def get_files_in_folder(folder_path: str, limit: int = DEFAULT_PAGE_SIZE, cursor: int = 0,
+                            max_chars: int = DEFAULT_MAX_CHARS) -> Page:
         """
         Get all files in a specific folder.
         
         Args:
             folder_path: The relative folder path to query.
+            limit: Maximum number of files to return.
+            cursor: Number of files to skip, pass the `next_cursor` of a previous page to continue.
+            max_chars: Character budget for the returned page.
             
         Returns:
-            A list of FileInfo objects representing the files in the specified folder.
+            A Page of FileInfo objects representing the files in the specified folder.
         """
         query = """
         SELECT id, relative_folder, file_name, file_extension, line_count
@@ -117,32 +492,24 @@ def repository_querier(db_path: str = "repository.db"):
         WHERE relative_folder = :folder
         ORDER BY file_name
         """
-        with engine.connect() as conn:
-            result = pd.read_sql(text(query), conn, params={"folder": folder_path})
-        
-        files = []
-        for _, row in result.iterrows():
-            full_path = os.path.join(row['relative_folder'], row['file_name'])
-            files.append(FileInfo(
-                id=row['id'],
-                relative_folder=row['relative_folder'],
-                file_name=row['file_name'],
-                file_extension=row['file_extension'],
-                line_count=row['line_count'],
-                full_path=full_path
-            ))
-        return files
+        result, total = _fetch_page(query, {"folder": folder_path}, cursor, limit)
+        files = [_file_info_from_row(row) for _, row in result.iterrows()]
+        return _paginate(files, total, cursor, max_chars)
     
     @tool
-    def get_files_by_extension( extension: str) -> List[FileInfo]:
+    def get_files_by_extension(extension: str, limit: int = DEFAULT_PAGE_SIZE, cursor: int = 0,
+                               max_chars: int = DEFAULT_MAX_CHARS) -> Page:
         """
         Get all files with a specific extension.
         
         Args:
             extension: The file extension to filter by (without the dot, e.g., 'py' not '.py').
+            limit: Maximum number of files to return.
+            cursor: Number of files to skip, pass the `next_cursor` of a previous page to continue.
+            max_chars: Character budget for the returned page.
             
         Returns:
-            A list of FileInfo objects for all files with the specified extension.
+            A Page of FileInfo objects for the files with the specified extension.
         """
         query = """
         SELECT id, relative_folder, file_name, file_extension, line_count
@@ -150,82 +517,88 @@ def repository_querier(db_path: str = "repository.db"):
         WHERE file_extension = :ext
         ORDER BY relative_folder, file_name
         """
-        with engine.connect() as conn:
-            result = pd.read_sql(text(query), conn, params={"ext": extension})
-        
-        files = []
-        for _, row in result.iterrows():
-            full_path = os.path.join(row['relative_folder'], row['file_name'])
-            files.append(FileInfo(
-                id=row['id'],
-                relative_folder=row['relative_folder'],
-                file_name=row['file_name'],
-                file_extension=row['file_extension'],
-                line_count=row['line_count'],
-                full_path=full_path
-            ))
-        return files
+        result, total = _fetch_page(query, {"ext": extension}, cursor, limit)
+        files = [_file_info_from_row(row) for _, row in result.iterrows()]
+        return _paginate(files, total, cursor, max_chars)
     
     @tool
-    def get_file_by_path( file_path: str) -> Optional[FileInfo]:
+    def get_file_by_path(file_path: str, max_chars: Optional[int] = None) -> Optional[FileInfo]:
         """
         Get file information for a specific file path.
         
         Args:
             file_path: The relative path to the file, including folder and filename.
+            max_chars: Optional character budget for the included file content.
             
         Returns:
             A FileInfo object for the specified file, or None if not found.
         """
-        # Split the path into folder and filename
-        parts = os.path.split(file_path)
-        if len(parts) == 2:
-            folder, filename = parts
-        else:
-            folder, filename = "", file_path
-        
-        query = """
-        SELECT id, relative_folder, file_name, file_extension, line_count, content
-        FROM repofile
-        WHERE relative_folder = :folder AND file_name = :filename
-        """
-        with engine.connect() as conn:
-            result = pd.read_sql(text(query), conn, params={
-                "folder": folder,
-                "filename": filename
-            })
-        
-        if len(result) == 0:
-            return None
-        
-        row = result.iloc[0]
-        full_path = os.path.join(row['relative_folder'], row['file_name'])
-        return FileInfo(
-            id=row['id'],
-            relative_folder=row['relative_folder'],
-            file_name=row['file_name'],
-            file_extension=row['file_extension'],
-            line_count=row['line_count'],
-            full_path=full_path,
-            content=row['content']
-        )
+        file_info = _find_file(file_path)
+        if file_info is not None and max_chars is not None:
+            file_info.content = _window_text(file_info.content, max_chars=max_chars)
+        return file_info
     
     @tool
-    def get_file_content(file_path: str) -> Optional[str]:
+    def get_file_content(file_path: str, cursor: int = 0, limit: Optional[int] = None,
+                         max_chars: Optional[int] = None) -> Optional[str]:
         """
         Get the content of a file by path.
         
         Args:
             file_path: The relative path to the file, including folder and filename.
+            cursor: Number of lines to skip from the start of the file.
+            limit: Optional maximum number of lines to return.
+            max_chars: Optional character budget for the returned content.
             
         Returns:
             The content of the file as a string, or None if the file is not found.
+            If the content is cut by `limit` or `max_chars`, it ends with a note
+            giving the number of lines left and the cursor to continue from.
         """
-        file_info = get_file_by_path(file_path)
+        file_info = _find_file(file_path)
         if file_info is None:
             return None
         
-        return file_info.content
+        return _window_text(file_info.content, cursor, limit, max_chars)
+    
+    def _overlay_entity_at_line(analysis, file_info: FileInfo, line_number: int) -> Optional[CodeEntity]:
+        """Find the entity at a line of a patched file, with the same precedence as the index queries."""
+        def smallest(entities):
+            containing = [e for e in entities if e.start_line <= line_number <= e.end_line]
+            return min(containing, key=lambda e: e.end_line - e.start_line, default=None)
+        
+        func = smallest(analysis.functions)
+        if func is not None:
+            return CodeEntity(
+                entity_type="function", id=func.id, name=func.name, file_id=file_info.id,
+                file_path=file_info.full_path, start_line=func.start_line, end_line=func.end_line,
+                docstring=func.docstring, parent_name=func.class_name,
+                details={
+                    "args": func.args,
+                    "is_method": func.is_method,
+                    "is_async": func.is_async,
+                    "decorators": func.decorators
+                }
+            )
+        
+        cls = smallest(analysis.classes)
+        if cls is not None:
+            return CodeEntity(
+                entity_type="class", id=cls.id, name=cls.name, file_id=file_info.id,
+                file_path=file_info.full_path, start_line=cls.start_line, end_line=cls.end_line,
+                docstring=cls.docstring, parent_name=None,
+                details={"base_classes": cls.base_classes, "decorators": cls.decorators}
+            )
+        
+        for var in analysis.variables:
+            if var.line == line_number:
+                return CodeEntity(
+                    entity_type="variable", id=var.id, name=var.name, file_id=file_info.id,
+                    file_path=file_info.full_path, start_line=var.line, end_line=None,
+                    docstring=None, parent_name=var.class_name,
+                    details={"value_repr": var.value_repr, "is_module_level": var.is_module_level}
+                )
+        return None
     
     @tool
     def get_entity_at_line( file_path: str, line_number: int) -> Optional[CodeEntity]:
@@ -239,10 +612,14 @@ def repository_querier(db_path: str = "repository.db"):
         Returns:
             A CodeEntity object representing the entity at the specified line, or None if not found.
         """
-        file_info = get_file_by_path(file_path)
+        file_info = _find_file(file_path)
         if file_info is None:
             return None
         
+        analysis = overlay.analysis(file_info.full_path) if overlay is not None else None
+        if analysis is not None:
+            return _overlay_entity_at_line(analysis, file_info, line_number)
+        
         # Check if the line is in a function
         query = """
         SELECT id, name, start_line, end_line, args, is_method, class_name, is_async, decorators, docstring
@@ -261,12 +638,12 @@ def repository_querier(db_path: str = "repository.db"):
             row = func_result.iloc[0]
             return CodeEntity(
                 entity_type="function",
-                id=row['id'],
+                id=int(row['id']),
                 name=row['name'],
                 file_id=file_info.id,
                 file_path=file_info.full_path,
-                start_line=row['start_line'],
-                end_line=row['end_line'],
+                start_line=int(row['start_line']),
+                end_line=int(row['end_line']),
                 docstring=row['docstring'],
                 parent_name=row['class_name'],
                 details={
@@ -295,12 +672,12 @@ def repository_querier(db_path: str = "repository.db"):
             row = class_result.iloc[0]
             return CodeEntity(
                 entity_type="class",
-                id=row['id'],
+                id=int(row['id']),
                 name=row['name'],
                 file_id=file_info.id,
                 file_path=file_info.full_path,
-                start_line=row['start_line'],
-                end_line=row['end_line'],
+                start_line=int(row['start_line']),
+                end_line=int(row['end_line']),
                 docstring=row['docstring'],
                 parent_name=None,
                 details={
@@ -326,11 +703,11 @@ def repository_querier(db_path: str = "repository.db"):
             row = var_result.iloc[0]
             return CodeEntity(
                 entity_type="variable",
-                id=row['id'],
+                id=int(row['id']),
                 name=row['name'],
                 file_id=file_info.id,
                 file_path=file_info.full_path,
-                start_line=row['line'],
+                start_line=int(row['line']),
                 end_line=None,
                 docstring=None,
                 parent_name=row['class_name'],
@@ -343,8 +720,9 @@ def repository_querier(db_path: str = "repository.db"):
         return None
     
     @tool
-    def get_function_by_name( function_name: str, class_name: Optional[str] = None, 
-                             file_path: Optional[str] = None) -> List[FunctionInfo]:
+    def get_function_by_name(function_name: str, class_name: Optional[str] = None,
+                             file_path: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                             cursor: int = 0, max_chars: int = DEFAULT_MAX_CHARS) -> Page:
         """
         Find functions or methods by name, optionally filtering by class and file.
         
@@ -352,9 +730,12 @@ def repository_querier(db_path: str = "repository.db"):
             function_name: The name of the function or method to find.
             class_name: Optional class name to filter by (for methods).
             file_path: Optional file path to limit the search to a specific file.
+            limit: Maximum number of functions to return.
+            cursor: Number of functions to skip, pass the `next_cursor` of a previous page to continue.
+            max_chars: Character budget for the returned page.
             
         Returns:
-            A list of FunctionInfo objects matching the criteria.
+            A Page of FunctionInfo objects matching the criteria.
         """
         query_parts = ["SELECT f.*, r.relative_folder, r.file_name FROM pythonfunction f JOIN repofile r ON f.file_id = r.id WHERE f.name = :func_name"]
         params = {"func_name": function_name}
@@ -364,86 +745,83 @@ def repository_querier(db_path: str = "repository.db"):
             params["class_name"] = class_name
         
         if file_path is not None:
-            folder, filename = os.path.split(file_path) if os.path.split(file_path)[0] else ("", file_path)
+            folder, filename = _split_path(file_path)
             query_parts.append("AND r.relative_folder = :folder AND r.file_name = :filename")
             params["folder"] = folder
             params["filename"] = filename
         
+        query_parts.append("ORDER BY r.relative_folder, r.file_name, f.start_line")
         query = " ".join(query_parts)
-        with engine.connect() as conn:
-            result = pd.read_sql(text(query), conn, params=params)
-        
-        functions = []
-        for _, row in result.iterrows():
-            file_path = os.path.join(row['relative_folder'], row['file_name'])
-            functions.append(FunctionInfo(
-                id=row['id'],
-                name=row['name'],
-                start_line=row['start_line'],
-                end_line=row['end_line'],
-                args=row['args'],
-                is_method=bool(row['is_method']),
-                class_name=row['class_name'],
-                is_async=bool(row['is_async']),
-                decorators=row['decorators'],
-                docstring=row['docstring'],
-                file_id=row['file_id'],
-                file_path=file_path
-            ))
-        return functions
+        functions, total = _fetch_entities(
+            query, params, cursor, limit,
+            lambda row: _function_info_from_row(
+                row, int(row['file_id']), os.path.join(row['relative_folder'], row['file_name'])
+            ),
+            lambda path: [
+                func for func in overlay.analysis(path).functions
+                if func.name == function_name
+                and (class_name is None or func.class_name == class_name)
+                and (file_path is None or path == file_path)
+            ]
+        )
+        return _paginate(functions, total, cursor, max_chars)
     
     @tool
-    def get_class_by_name( class_name: str, file_path: Optional[str] = None) -> List[ClassInfo]:
+    def get_class_by_name(class_name: str, file_path: Optional[str] = None,
+                          limit: int = DEFAULT_PAGE_SIZE, cursor: int = 0,
+                          max_chars: int = DEFAULT_MAX_CHARS) -> Page:
         """
         Find classes by name, optionally filtering by file.
         
         Args:
             class_name: The name of the class to find.
             file_path: Optional file path to limit the search to a specific file.
+            limit: Maximum number of classes to return.
+            cursor: Number of classes to skip, pass the `next_cursor` of a previous page to continue.
+            max_chars: Character budget for the returned page.
             
         Returns:
-            A list of ClassInfo objects matching the criteria.
+            A Page of ClassInfo objects matching the criteria.
         """
         query_parts = ["SELECT c.*, r.relative_folder, r.file_name FROM pythonclass c JOIN repofile r ON c.file_id = r.id WHERE c.name = :class_name"]
         params = {"class_name": class_name}
         
         if file_path is not None:
-            folder, filename = os.path.split(file_path) if os.path.split(file_path)[0] else ("", file_path)
+            folder, filename = _split_path(file_path)
             query_parts.append("AND r.relative_folder = :folder AND r.file_name = :filename")
             params["folder"] = folder
             params["filename"] = filename
         
+        query_parts.append("ORDER BY r.relative_folder, r.file_name, c.start_line")
         query = " ".join(query_parts)
-        with engine.connect() as conn:
-            result = pd.read_sql(text(query), conn, params=params)
-        
-        classes = []
-        for _, row in result.iterrows():
-            file_path = os.path.join(row['relative_folder'], row['file_name'])
-            classes.append(ClassInfo(
-                id=row['id'],
-                name=row['name'],
-                start_line=row['start_line'],
-                end_line=row['end_line'],
-                base_classes=row['base_classes'],
-                decorators=row['decorators'],
-                docstring=row['docstring'],
-                file_id=row['file_id'],
-                file_path=file_path
-            ))
-        return classes
+        classes, total = _fetch_entities(
+            query, params, cursor, limit,
+            lambda row: _class_info_from_row(
+                row, int(row['file_id']), os.path.join(row['relative_folder'], row['file_name'])
+            ),
+            lambda path: [
+                cls for cls in overlay.analysis(path).classes
+                if cls.name == class_name and (file_path is None or path == file_path)
+            ]
+        )
+        return _paginate(classes, total, cursor, max_chars)
     
     @tool
-    def get_class_methods( class_name: str, file_path: Optional[str] = None) -> List[FunctionInfo]:
+    def get_class_methods(class_name: str, file_path: Optional[str] = None,
+                          limit: int = DEFAULT_PAGE_SIZE, cursor: int = 0,
+                          max_chars: int = DEFAULT_MAX_CHARS) -> Page:
         """
         Get all methods defined in a specific class.
         
         Args:
             class_name: The name of the class to find methods for.
             file_path: Optional file path to limit the search to a specific file.
+            limit: Maximum number of methods to return.
+            cursor: Number of methods to skip, pass the `next_cursor` of a previous page to continue.
+            max_chars: Character budget for the returned page.
             
         Returns:
-            A list of FunctionInfo objects representing the methods of the class.
+            A Page of FunctionInfo objects representing the methods of the class.
         """
         query_parts = ["""
             SELECT f.*, r.relative_folder, r.file_name
@@ -454,49 +832,63 @@ def repository_querier(db_path: str = "repository.db"):
         params = {"class_name": class_name}
         
         if file_path is not None:
-            folder, filename = os.path.split(file_path) if os.path.split(file_path)[0] else ("", file_path)
+            folder, filename = _split_path(file_path)
             query_parts.append("AND r.relative_folder = :folder AND r.file_name = :filename")
             params["folder"] = folder
             params["filename"] = filename
         
+        query_parts.append("ORDER BY r.relative_folder, r.file_name, f.start_line")
         query = " ".join(query_parts)
-        with engine.connect() as conn:
-            result = pd.read_sql(text(query), conn, params=params)
-        
-        methods = []
-        for _, row in result.iterrows():
-            file_path = os.path.join(row['relative_folder'], row['file_name'])
-            methods.append(FunctionInfo(
-                id=row['id'],
-                name=row['name'],
-                start_line=row['start_line'],
-                end_line=row['end_line'],
-                args=row['args'],
-                is_method=bool(row['is_method']),
-                class_name=row['class_name'],
-                is_async=bool(row['is_async']),
-                decorators=row['decorators'],
-                docstring=row['docstring'],
-                file_id=row['file_id'],
-                file_path=file_path
-            ))
-        return methods
+        methods, total = _fetch_entities(
+            query, params, cursor, limit,
+            lambda row: _function_info_from_row(
+                row, int(row['file_id']), os.path.join(row['relative_folder'], row['file_name'])
+            ),
+            lambda path: [
+                func for func in overlay.analysis(path).functions
+                if func.class_name == class_name and func.is_method
+                and (file_path is None or path == file_path)
+            ]
+        )
+        return _paginate(methods, total, cursor, max_chars)
     
     @tool
-    def get_file_structure( file_path: str) -> Dict[str, Any]:
+    def get_file_structure(file_path: str, limit: int = DEFAULT_PAGE_SIZE, cursor: int = 0,
+                           max_chars: int = DEFAULT_MAX_CHARS) -> Dict[str, Any]:
         """
         Get the complete structure of a Python file including functions, classes, and variables.
+        Prefer get_file_outline for an overview; use this tool when full details such as whole docstrings are needed.
         
         Args:
             file_path: The relative path to the file, including folder and filename.
+            limit: Maximum number of entities of each kind to return.
+            cursor: Number of entities of each kind to skip, pass the largest
+                `next_cursor` of a previous call to continue.
+            max_chars: Character budget for each kind of entity.
             
         Returns:
             A dictionary with keys 'classes', 'functions', and 'variables', each containing
-            a list of corresponding objects in order of appearance in the file.
+            a Page of corresponding objects in order of appearance in the file.
         """
-        file_info = get_file_by_path(file_path)
+        file_info = _find_file(file_path)
         if file_info is None:
-            return {"classes": [], "functions": [], "variables": []}
+            return {
+                "classes": _paginate([], 0, cursor, max_chars),
+                "functions": _paginate([], 0, cursor, max_chars),
+                "variables": _paginate([], 0, cursor, max_chars)
+            }
+        analysis = overlay.analysis(file_info.full_path) if overlay is not None else None
+        if analysis is not None:
+            end = None if limit is None else cursor + limit
+            return {
+                kind: _paginate(entities[cursor:end], len(entities), cursor, max_chars)
+                for kind, entities in (
+                    ("classes", analysis.classes),
+                    ("functions", analysis.functions),
+                    ("variables", analysis.variables)
+                )
+            }
+        params = {"file_id": file_info.id}
         
         # Get classes
         query = """
@@ -505,22 +897,11 @@ def repository_querier(db_path: str = "repository.db"):
         WHERE file_id = :file_id
         ORDER BY start_line
         """
-        with engine.connect() as conn:
-            classes_df = pd.read_sql(text(query), conn, params={"file_id": file_info.id})
-        
-        classes = []
-        for _, row in classes_df.iterrows():
-            classes.append(ClassInfo(
-                id=row['id'],
-                name=row['name'],
-                start_line=row['start_line'],
-                end_line=row['end_line'],
-                base_classes=row['base_classes'],
-                decorators=row['decorators'],
-                docstring=row['docstring'],
-                file_id=file_info.id,
-                file_path=file_info.full_path
-            ))
+        classes_df, classes_total = _fetch_page(query, params, cursor, limit)
+        classes = [
+            _class_info_from_row(row, file_info.id, file_info.full_path)
+            for _, row in classes_df.iterrows()
+        ]
         
         # Get functions
         query = """
@@ -529,25 +910,11 @@ def repository_querier(db_path: str = "repository.db"):
         WHERE file_id = :file_id
         ORDER BY start_line
         """
-        with engine.connect() as conn:
-            functions_df = pd.read_sql(text(query), conn, params={"file_id": file_info.id})
-        
-        functions = []
-        for _, row in functions_df.iterrows():
-            functions.append(FunctionInfo(
-                id=row['id'],
-                name=row['name'],
-                start_line=row['start_line'],
-                end_line=row['end_line'],
-                args=row['args'],
-                is_method=bool(row['is_method']),
-                class_name=row['class_name'],
-                is_async=bool(row['is_async']),
-                decorators=row['decorators'],
-                docstring=row['docstring'],
-                file_id=file_info.id,
-                file_path=file_info.full_path
-            ))
+        functions_df, functions_total = _fetch_page(query, params, cursor, limit)
+        functions = [
+            _function_info_from_row(row, file_info.id, file_info.full_path)
+            for _, row in functions_df.iterrows()
+        ]
         
         # Get variables
         query = """
@@ -556,30 +923,53 @@ def repository_querier(db_path: str = "repository.db"):
         WHERE file_id = :file_id
         ORDER BY line
         """
-        with engine.connect() as conn:
-            variables_df = pd.read_sql(text(query), conn, params={"file_id": file_info.id})
-        
-        variables = []
-        for _, row in variables_df.iterrows():
-            variables.append(VariableInfo(
-                id=row['id'],
-                name=row['name'],
-                line=row['line'],
-                value_repr=row['value_repr'],
-                is_module_level=bool(row['is_module_level']),
-                class_name=row['class_name'],
-                file_id=file_info.id,
-                file_path=file_info.full_path
-            ))
+        variables_df, variables_total = _fetch_page(query, params, cursor, limit)
+        variables = [
+            _variable_info_from_row(row, file_info.id, file_info.full_path)
+            for _, row in variables_df.iterrows()
+        ]
         
         return {
-            "classes": classes,
-            "functions": functions,
-            "variables": variables
+            "classes": _paginate(classes, classes_total, cursor, max_chars),
+            "functions": _paginate(functions, functions_total, cursor, max_chars),
+            "variables": _paginate(variables, variables_total, cursor, max_chars)
         }
     
     @tool
-    def get_code_segment( file_path: str, start_line: int, end_line: int) -> str:
+    def get_file_outline(file_path: str, cursor: int = 0, max_chars: int = DEFAULT_MAX_CHARS) -> Optional[str]:
+        """
+        Get a compact outline of a Python file: its classes, functions and variables, one per line,
+        indented by nesting, with signatures, line ranges and the first line of each docstring.
+        
+        Args:
+            file_path: The relative path to the file, including folder and filename.
+            cursor: Number of outline lines to skip, to continue a truncated outline.
+            max_chars: Character budget for the returned outline.
+            
+        Returns:
+            The outline as a string, or None if the file is not an analyzed Python file.
+        """
+        analysis = overlay.analysis(file_path) if overlay is not None else None
+        if analysis is not None:
+            return _window_text(analysis.outline, cursor, max_chars=max_chars) if analysis.outline else None
+        
+        folder, filename = _split_path(file_path)
+        query = """
+        SELECT o.outline
+        FROM pythonfileoutline o
+        JOIN repofile r ON o.file_id = r.id
+        WHERE r.relative_folder = :folder AND r.file_name = :filename
+        """
+        with engine.connect() as conn:
+            outline = conn.execute(text(query), {"folder": folder, "filename": filename}).scalar()
+        
+        if outline is None:
+            return None
+        return _window_text(outline, cursor, max_chars=max_chars)
+    
+    @tool
+    def get_code_segment(file_path: str, start_line: int, end_line: int,
+                         max_chars: Optional[int] = None) -> str:
         """
         Get a segment of code from a file between the specified line numbers.
         
@@ -587,24 +977,80 @@ def repository_querier(db_path: str = "repository.db"):
             file_path: The relative path to the file, including folder and filename.
             start_line: The starting line number (1-based).
             end_line: The ending line number (1-based, inclusive).
+            max_chars: Optional character budget for the returned segment.
             
         Returns:
             The requested segment of code as a string.
         """
-        content = get_file_content(file_path=file_path)
-        if content is None:
+        file_info = _find_file(file_path)
+        if file_info is None:
             return ""
         
-        lines = content.splitlines()
+        lines = file_info.content.splitlines()
         if start_line > len(lines) or start_line < 1:
             return ""
         
         end_line = min(end_line, len(lines))
-        return "\n".join(lines[start_line-1:end_line])
+        segment_lines = lines[start_line-1:end_line]
+        kept = _take_within_budget(segment_lines, max_chars, size=lambda line: len(line) + 1)
+        segment = "\n".join(kept)
+        if len(kept) < len(segment_lines):
+            next_line = start_line + len(kept)
+            segment += (
+                f"\n... [truncated: {end_line - next_line + 1} more lines, "
+                f"call again with start_line={next_line}]"
+            )
+        return segment
+    
+    @tool
+    def rank_candidates(query: str, k: int = 10) -> Dict[str, List[RankedCandidate]]:
+        """
+        Rank the files, functions and classes of the repository by lexical relevance to a query.
+        Use it with the issue description to find where to start looking.
+        
+        Args:
+            query: Free text to match, such as the issue description, an error message or identifiers.
+            k: Number of files and of functions/classes to return.
+            
+        Returns:
+            A dictionary with keys 'files' and 'entities', each a list of RankedCandidate
+            objects (entity_type, name, file_path, score, start_line, end_line, parent_name)
+            sorted by decreasing BM25 score. Scores and lines are those of the indexed
+            files, before any edit made with the patch tools.
+        """
+        if "index" not in retriever:
+            with index_lock:
+                if "index" not in retriever:
+                    retriever["index"] = RepositoryRetriever(engine)
+        return retriever["index"].rank(query, k)
+    
+    @tool
+    def resolve_traceback(issue_text: str, k: int = 10) -> List[ResolvedFrame]:
+        """
+        Find the repository files, functions and classes implicated by the tracebacks in an issue.
+        Frame paths are matched to indexed files on their longest common suffix, so absolute,
+        site-packages or CI paths work; frames outside the repository are dropped.
+        
+        Args:
+            issue_text: Text containing one or more Python or pytest tracebacks, such as the issue description.
+            k: Maximum number of frames to return.
+            
+        Returns:
+            A list of ResolvedFrame objects (file_path, line, function, entity_type, entity_name,
+            parent_name, start_line, end_line, source_line, score) sorted by decreasing score,
+            the innermost frames of the traceback first. Entities and source lines are those
+            of the indexed files, before any edit made with the patch tools.
+        """
+        if "index" not in resolver:
+            with index_lock:
+                if "index" not in resolver:
+                    resolver["index"] = TracebackResolver(engine)
+        return resolver["index"].resolve(issue_text, k)
     
 
     return {
         "get_folders": get_folders,
+        "get_tree": get_tree,
         "get_files_in_folder": get_files_in_folder,
         "get_files_by_extension": get_files_by_extension,
         "get_file_by_path": get_file_by_path,
@@ -614,6 +1060,8 @@ def repository_querier(db_path: str = "repository.db"):
         "get_class_by_name": get_class_by_name,
         "get_class_methods": get_class_methods,
         "get_file_structure": get_file_structure,
-        "get_code_segment": get_code_segment
+        "get_file_outline": get_file_outline,
+        "get_code_segment": get_code_segment,
+        "rank_candidates": rank_candidates,
+        "resolve_traceback": resolve_traceback
     }
-    
\ No newline at end of file
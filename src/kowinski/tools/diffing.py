@@ -0,0 +1,223 @@
+"""
+Unified diffs computed with the patience diff algorithm.
+
+Patience diff anchors the comparison on lines that appear exactly once in both
+versions, then recurses between anchors. After trimming the common prefix and
+suffix, a typical edit of a large file only compares the few lines around the
+change, so it stays fast on files with tens of thousands of lines where
+`difflib`'s matcher slows down, and it aligns hunks on unique lines such as
+function signatures rather than on blank lines or closing brackets.
+"""
+
+import difflib
+from bisect import bisect_left
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from kowinski.tools.patch_engine import split_lines
+
+# Regions without unique common lines are smaller than this in practice;
+# above it they are reported as a single replacement instead of being matched
+MAX_FALLBACK_LINES = 2000
+
+def _unique_common_anchors(a: List[str], b: List[str], alo: int, ahi: int,
+                           blo: int, bhi: int) -> List[Tuple[int, int]]:
+    """
+    Find the longest increasing sequence of lines unique in both ranges.
+
+    Returns:
+        A list of (index in a, index in b) pairs, increasing in both.
+    """
+    a_range, b_range = a[alo:ahi], b[blo:bhi]
+    a_counts, b_counts = Counter(a_range), Counter(b_range)
+    b_positions = {line: j for j, line in enumerate(b_range, blo)}
+
+    # Pairs of lines occurring exactly once on each side, in the order of a
+    pairs = [
+        (i, b_positions[line]) for i, line in enumerate(a_range, alo)
+        if a_counts[line] == 1 and b_counts[line] == 1
+    ]
+    if not pairs:
+        return []
+
+    # Patience sorting to find the longest increasing subsequence of b indices
+    tops = []  # Index in pairs of the last pair of each pile
+    top_values = []  # b index of the last pair of each pile
+    previous = [None] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        # Most unique lines keep their order, so they usually start a new pile
+        pile = len(top_values) if not top_values or top_values[-1] < j else bisect_left(top_values, j)
+        previous[k] = tops[pile - 1] if pile > 0 else None
+        if pile == len(tops):
+            tops.append(k)
+            top_values.append(j)
+        else:
+            tops[pile] = k
+            top_values[pile] = j
+
+    anchors = []
+    k = tops[-1]
+    while k is not None:
+        anchors.append(pairs[k])
+        k = previous[k]
+    anchors.reverse()
+    return anchors
+
+def _match_ranges(a: List[str], b: List[str], alo: int, ahi: int, blo: int, bhi: int,
+                  blocks: List[Tuple[int, int, int]]):
+    """Append the matching blocks of a[alo:ahi] and b[blo:bhi] to blocks, in order."""
+    # Common prefix
+    i, j = alo, blo
+    while i < ahi and j < bhi and a[i] == b[j]:
+        i += 1
+        j += 1
+    if i > alo:
+        blocks.append((alo, blo, i - alo))
+
+    # Common suffix
+    suffix_a, suffix_b = ahi, bhi
+    while suffix_a > i and suffix_b > j and a[suffix_a - 1] == b[suffix_b - 1]:
+        suffix_a -= 1
+        suffix_b -= 1
+
+    if i < suffix_a and j < suffix_b:
+        anchors = _unique_common_anchors(a, b, i, suffix_a, j, suffix_b)
+        if anchors:
+            previous_a, previous_b = i, j
+            for anchor_a, anchor_b in anchors:
+                if anchor_a < previous_a:
+                    continue  # Already part of the block matched from an earlier anchor
+                if anchor_a > previous_a or anchor_b > previous_b:
+                    _match_ranges(a, b, previous_a, anchor_a, previous_b, anchor_b, blocks)
+                # Extend the match forward over the lines that follow the anchor
+                end_a, end_b = anchor_a + 1, anchor_b + 1
+                while end_a < suffix_a and end_b < suffix_b and a[end_a] == b[end_b]:
+                    end_a += 1
+                    end_b += 1
+                blocks.append((anchor_a, anchor_b, end_a - anchor_a))
+                previous_a, previous_b = end_a, end_b
+            _match_ranges(a, b, previous_a, suffix_a, previous_b, suffix_b, blocks)
+        elif (suffix_a - i) + (suffix_b - j) <= MAX_FALLBACK_LINES:
+            matcher = difflib.SequenceMatcher(None, a[i:suffix_a], b[j:suffix_b], autojunk=False)
+            for x, y, size in matcher.get_matching_blocks():
+                if size:
+                    blocks.append((i + x, j + y, size))
+
+    if suffix_a < ahi:
+        blocks.append((suffix_a, suffix_b, ahi - suffix_a))
+
+def patience_opcodes(a: List[str], b: List[str]) -> List[Tuple[str, int, int, int, int]]:
+    """
+    Compute the edit operations turning a into b with the patience algorithm.
+
+    Args:
+        a: Original lines.
+        b: Modified lines.
+
+    Returns:
+        Opcodes in the format of `difflib.SequenceMatcher.get_opcodes`:
+        (tag, i1, i2, j1, j2) with tag one of 'equal', 'replace', 'delete', 'insert'.
+    """
+    blocks = []
+    _match_ranges(a, b, 0, len(a), 0, len(b), blocks)
+
+    # Merge adjacent blocks
+    merged = []
+    for i, j, size in blocks:
+        if merged and merged[-1][0] + merged[-1][2] == i and merged[-1][1] + merged[-1][2] == j:
+            merged[-1] = (merged[-1][0], merged[-1][1], merged[-1][2] + size)
+        else:
+            merged.append((i, j, size))
+    merged.append((len(a), len(b), 0))
+
+    opcodes = []
+    i = j = 0
+    for block_a, block_b, size in merged:
+        if i < block_a and j < block_b:
+            opcodes.append(("replace", i, block_a, j, block_b))
+        elif i < block_a:
+            opcodes.append(("delete", i, block_a, j, block_b))
+        elif j < block_b:
+            opcodes.append(("insert", i, block_a, j, block_b))
+        if size:
+            opcodes.append(("equal", block_a, block_a + size, block_b, block_b + size))
+        i, j = block_a + size, block_b + size
+    return opcodes
+
+def _group_opcodes(opcodes, context: int):
+    """Split opcodes into hunks with at most `context` equal lines around each change."""
+    if not opcodes:
+        return
+    # Trim the leading and trailing equal runs to the context
+    if opcodes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = opcodes[0]
+        opcodes[0] = (tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2)
+    if opcodes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = opcodes[-1]
+        opcodes[-1] = (tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context))
+
+    group = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        # Split on equal runs longer than twice the context
+        if tag == "equal" and i2 - i1 > 2 * context:
+            group.append((tag, i1, i1 + context, j1, j1 + context))
+            yield group
+            group = []
+            i1, j1 = i2 - context, j2 - context
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+def _format_range(start: int, stop: int) -> str:
+    """Format a hunk range the way `diff -u` does."""
+    length = stop - start
+    beginning = start + 1
+    if length == 1:
+        return f"{beginning}"
+    if length == 0:
+        beginning -= 1
+    return f"{beginning},{length}"
+
+def unified_diff(original: str, modified: str, file_path: str, context: int = 3,
+                 opcodes: Optional[List[Tuple[str, int, int, int, int]]] = None) -> str:
+    """
+    Generate a unified diff between two versions of a file.
+
+    Args:
+        original: Original file content.
+        modified: Modified file content.
+        file_path: Path to the file, used in the a/ and b/ headers.
+        context: Number of unchanged lines shown around each change.
+        opcodes: Precomputed opcodes between the lines of original and modified.
+
+    Returns:
+        The unified diff, empty if the contents are equal. A missing newline at
+        the end of either version is marked as git does.
+    """
+    # Split on line feeds only, as git and the patch engine do
+    a = split_lines(original)
+    b = split_lines(modified)
+    if opcodes is None:
+        opcodes = patience_opcodes(a, b)
+
+    def emit(prefix, line):
+        if line.endswith("\n"):
+            return prefix + line
+        return prefix + line + "\n\\ No newline at end of file\n"
+
+    output = []
+    for group in _group_opcodes(opcodes, context):
+        if not output:
+            output.append(f"--- a/{file_path}\n")
+            output.append(f"+++ b/{file_path}\n")
+        first, last = group[0], group[-1]
+        output.append(
+            f"@@ -{_format_range(first[1], last[2])} +{_format_range(first[3], last[4])} @@\n"
+        )
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                output.extend(emit(" ", line) for line in a[i1:i2])
+                continue
+            output.extend(emit("-", line) for line in a[i1:i2])
+            output.extend(emit("+", line) for line in b[j1:j2])
+    return "".join(output)
@@ -0,0 +1,254 @@
+"""
+Deterministic localization of issues, without a model.
+
+Many issues quote a traceback or name the function at fault, and for those an
+agent loop mostly spends model calls rediscovering what the text says. The
+FastLocalizer scores the functions and classes of the index on three kinds of
+evidence:
+
+- traceback frames resolved to repository code (TracebackResolver),
+- definitions of the identifiers the issue mentions (functions, classes and
+  Class.method references, weighed down when a name is defined many times),
+- BM25 relevance of the entity to the issue text (RepositoryRetriever).
+
+Each kind of evidence contributes up to its weight, so the score of a
+candidate is in [0, 1]. When the best candidate scores over a threshold and
+leads the best candidate of any other file by a margin, the localization is
+confident enough to answer without the agent; otherwise its ranking is given
+to the agent as a head start.
+"""
+
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, text
+
+from kowinski.tools.retrieval import STOPWORDS, RepositoryRetriever
+from kowinski.tools.traceback_resolver import TracebackResolver
+
+TRACEBACK_WEIGHT = 0.4
+SYMBOL_WEIGHT = 0.4
+LEXICAL_WEIGHT = 0.2
+DEFAULT_THRESHOLD = 0.5
+DEFAULT_MARGIN = 0.15
+
+# Identifiers quoted as code: `name`, name(...), Class.method, snake_case and CamelCase words
+_CODE_SPAN_RE = re.compile(r"`([^`\n]+)`")
+_CALL_RE = re.compile(r"\b([A-Za-z_][A-Za-z0-9_]*)\s*\(")
+_DOTTED_RE = re.compile(r"\b([A-Za-z_][A-Za-z0-9_]*)\.([A-Za-z_][A-Za-z0-9_]*)\b")
+_CODE_WORD_RE = re.compile(r"\b([A-Za-z]+_[A-Za-z0-9_]*|_[A-Za-z0-9_]+|[A-Z][a-z0-9]+[A-Z][A-Za-z0-9]*)\b")
+_IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+@dataclass
+class LocalizedCandidate:
+    """A function or class scored as the location of an issue."""
+    file_path: str
+    entity_type: Optional[str]  # "function" or "class", None for a whole file
+    entity_name: Optional[str]
+    parent_name: Optional[str] = None  # Class of a method
+    start_line: Optional[int] = None
+    end_line: Optional[int] = None
+    score: float = 0.0
+    evidence: Dict[str, float] = field(default_factory=dict)  # Score contributed by traceback, symbol and lexical
+
+    @property
+    def qualified_name(self) -> Optional[str]:
+        if self.entity_name is None:
+            return None
+        return f"{self.parent_name}.{self.entity_name}" if self.parent_name else self.entity_name
+
+@dataclass
+class FastLocalization:
+    """The ranked candidates of an issue and whether the best one is trusted without an agent."""
+    candidates: List[LocalizedCandidate]
+    confidence: float  # Score of the best candidate
+    margin: float  # Lead of the best candidate over the best one of another file
+    confident: bool
+    duration: float
+
+    def answer(self) -> str:
+        """Describe the best candidates as the answer of a run."""
+        best = self.candidates[0]
+        location = f"{best.file_path}" + (f", {best.entity_type} {best.qualified_name}" if best.entity_name else "")
+        lines = [f"The issue is most likely in {location} (lines {best.start_line}-{best.end_line}), "
+                 f"found without a model: {self._describe_evidence(best)}."]
+        others = self.candidates[1:5]
+        if others:
+            lines.append("Other candidates:")
+            lines.extend(f"- {self._describe(candidate)}" for candidate in others)
+        return "\n".join(lines)
+
+    def head_start(self, k: int = 5) -> str:
+        """Describe the best candidates for an agent to start from, empty if there are none."""
+        if not self.candidates:
+            return ""
+        lines = ["A search of the index without a model ranked these candidates, best first; "
+                 "verify them before relying on them:"]
+        lines.extend(f"- {self._describe(candidate)}" for candidate in self.candidates[:k])
+        return "\n".join(lines)
+
+    @staticmethod
+    def _describe_evidence(candidate: LocalizedCandidate) -> str:
+        return ", ".join(f"{source} {score:.2f}" for source, score in candidate.evidence.items())
+
+    def _describe(self, candidate: LocalizedCandidate) -> str:
+        location = candidate.file_path
+        if candidate.entity_name:
+            location += f" {candidate.entity_type} {candidate.qualified_name} (lines {candidate.start_line}-{candidate.end_line})"
+        return f"{location}: score {candidate.score:.2f} ({self._describe_evidence(candidate)})"
+
+def mentioned_symbols(issue_text: str) -> Tuple[Set[str], Set[Tuple[str, str]]]:
+    """
+    Find the identifiers an issue refers to as code.
+
+    Args:
+        issue_text: Text of the issue.
+
+    Returns:
+        A tuple (names, qualified names) where qualified names are (qualifier, name)
+        pairs from references such as `Class.method` or `module.function`.
+    """
+    names = set()
+    qualified = set()
+    for span in _CODE_SPAN_RE.findall(issue_text):
+        names.update(_IDENTIFIER_RE.findall(span))
+    names.update(_CALL_RE.findall(issue_text))
+    names.update(_CODE_WORD_RE.findall(issue_text))
+    for qualifier, name in _DOTTED_RE.findall(issue_text):
+        qualified.add((qualifier, name))
+        names.update((qualifier, name))
+    names = {name for name in names if len(name) > 2 and name.lower() not in STOPWORDS}
+    return names, {(qualifier, name) for qualifier, name in qualified if name in names}
+
+class FastLocalizer:
+    """
+    Ranks the functions and classes of an indexed repository for an issue, without a model.
+
+    The traceback and lexical indexes are built on first use and reused for later issues.
+    """
+
+    def __init__(self, engine, threshold: float = DEFAULT_THRESHOLD, margin: float = DEFAULT_MARGIN):
+        """
+        Args:
+            engine: SQLAlchemy engine of the repository database.
+            threshold: Score the best candidate needs to be trusted without an agent.
+            margin: Lead the best candidate needs over the best candidate of another file.
+        """
+        self.engine = engine
+        self.threshold = threshold
+        self.margin = margin
+        self._resolver: Optional[TracebackResolver] = None
+        self._retriever: Optional[RepositoryRetriever] = None
+
+    @property
+    def resolver(self) -> TracebackResolver:
+        if self._resolver is None:
+            self._resolver = TracebackResolver(self.engine)
+        return self._resolver
+
+    @property
+    def retriever(self) -> RepositoryRetriever:
+        if self._retriever is None:
+            self._retriever = RepositoryRetriever(self.engine)
+        return self._retriever
+
+    def _add(self, candidates: Dict[Tuple, LocalizedCandidate], source: str, score: float, weight: float, **entity):
+        """Add evidence to a candidate, each source contributing at most its weight."""
+        key = (entity["file_path"], entity.get("parent_name"), entity.get("entity_name"))
+        candidate = candidates.get(key)
+        if candidate is None:
+            candidate = candidates[key] = LocalizedCandidate(**entity)
+        candidate.evidence[source] = round(min(weight, candidate.evidence.get(source, 0.0) + score), 4)
+
+    def _traceback_evidence(self, issue_text: str, candidates: Dict[Tuple, LocalizedCandidate]):
+        frames = [frame for frame in self.resolver.resolve(issue_text) if frame.entity_name is not None]
+        if not frames:
+            return
+        top_score = max(frame.score for frame in frames) or 1.0
+        for frame in frames:
+            self._add(
+                candidates, "traceback", TRACEBACK_WEIGHT * frame.score / top_score, TRACEBACK_WEIGHT,
+                file_path=frame.file_path, entity_type=frame.entity_type, entity_name=frame.entity_name,
+                parent_name=frame.parent_name, start_line=frame.start_line, end_line=frame.end_line,
+            )
+
+    def _symbol_evidence(self, issue_text: str, candidates: Dict[Tuple, LocalizedCandidate]):
+        names, qualified = mentioned_symbols(issue_text)
+        if not names:
+            return
+        query = text("""
+        SELECT 'function' AS entity_type, f.name, f.class_name, f.start_line, f.end_line, r.relative_folder, r.file_name
+        FROM pythonfunction f JOIN repofile r ON f.file_id = r.id WHERE f.name IN :names
+        UNION ALL
+        SELECT 'class' AS entity_type, c.name, NULL AS class_name, c.start_line, c.end_line, r.relative_folder, r.file_name
+        FROM pythonclass c JOIN repofile r ON c.file_id = r.id WHERE c.name IN :names
+        """).bindparams(bindparam("names", expanding=True))
+        with self.engine.connect() as conn:
+            rows = conn.execute(query, {"names": sorted(names)}).all()
+
+        definitions: Dict[str, List] = {}
+        for row in rows:
+            definitions.setdefault(row.name, []).append(row)
+        for name, rows in definitions.items():
+            qualifiers = {qualifier for qualifier, qualified_name in qualified if qualified_name == name}
+            # A Class.method or module.function reference narrows the definitions down
+            narrowed = [
+                row for row in rows
+                if row.class_name in qualifiers or row.file_name.removesuffix(".py") in qualifiers
+            ] or rows
+            for row in narrowed:
+                self._add(
+                    candidates, "symbol", SYMBOL_WEIGHT / len(narrowed), SYMBOL_WEIGHT,
+                    file_path=os.path.join(row.relative_folder, row.file_name),
+                    entity_type=row.entity_type, entity_name=row.name, parent_name=row.class_name,
+                    start_line=row.start_line, end_line=row.end_line,
+                )
+
+    def _lexical_evidence(self, issue_text: str, candidates: Dict[Tuple, LocalizedCandidate], k: int):
+        entities = self.retriever.rank(issue_text, k)["entities"]
+        if not entities:
+            return
+        top_score = entities[0].score or 1.0
+        for entity in entities:
+            self._add(
+                candidates, "lexical", LEXICAL_WEIGHT * entity.score / top_score, LEXICAL_WEIGHT,
+                file_path=entity.file_path, entity_type=entity.entity_type, entity_name=entity.name,
+                parent_name=entity.parent_name, start_line=entity.start_line, end_line=entity.end_line,
+            )
+
+    def localize(self, issue_text: str, k: int = 10) -> FastLocalization:
+        """
+        Rank the candidates of an issue.
+
+        Args:
+            issue_text: Text of the issue.
+            k: Number of candidates to keep, and of lexical matches to score.
+
+        Returns:
+            A FastLocalization, confident when the best candidate clears the threshold and margin.
+        """
+        start = time.perf_counter()
+        candidates: Dict[Tuple, LocalizedCandidate] = {}
+        self._traceback_evidence(issue_text, candidates)
+        self._symbol_evidence(issue_text, candidates)
+        self._lexical_evidence(issue_text, candidates, k)
+
+        ranked = list(candidates.values())
+        for candidate in ranked:
+            candidate.score = round(sum(candidate.evidence.values()), 4)
+        ranked.sort(key=lambda candidate: (-candidate.score, candidate.file_path, candidate.start_line or 0))
+        ranked = ranked[:k]
+
+        confidence = ranked[0].score if ranked else 0.0
+        runner_up = next((candidate.score for candidate in ranked if candidate.file_path != ranked[0].file_path), 0.0)
+        margin = round(confidence - runner_up, 4)
+        return FastLocalization(
+            candidates=ranked,
+            confidence=confidence,
+            margin=margin,
+            confident=bool(ranked) and confidence >= self.threshold and margin >= self.margin,
+            duration=round(time.perf_counter() - start, 4),
+        )
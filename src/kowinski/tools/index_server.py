@@ -0,0 +1,416 @@
+"""
+A long-lived local server keeping repository indexes warm for many agent processes.
+
+The server answers the `repository_querier` tool API over HTTP on localhost for any
+number of repository databases. Each database is copied into a shared in-memory
+SQLite database on first use and kept, along with its querier and lazily built
+lexical index, until it is evicted by the least recently used policy. Loads run
+outside the server lock, one per database, so a cold load only delays the calls
+on that database, and an evicted or reloaded index is closed once the calls
+still using it return.
+`remote_repository_querier` returns smolagents tools with the same names and
+signatures that forward their calls to the server.
+"""
+
+import dataclasses
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+from smolagents import Tool
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+from kowinski.tools.code_analysis import (
+    DEFAULT_POOL_SIZE, repository_querier, create_read_only_engine, FileInfo, FunctionInfo, ClassInfo, VariableInfo, CodeEntity, Page
+)
+from kowinski.tools.retrieval import RankedCandidate
+from kowinski.tools.traceback_resolver import ResolvedFrame
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Dataclasses that can appear in tool results, rebuilt by name on the client side
+RESULT_TYPES = {
+    cls.__name__: cls
+    for cls in (FileInfo, FunctionInfo, ClassInfo, VariableInfo, CodeEntity, Page, RankedCandidate, ResolvedFrame)
+}
+
+def to_json(value: Any) -> Any:
+    """
+    Convert a tool result to JSON-compatible data, tagging dataclasses with their type.
+
+    Args:
+        value: A tool result.
+
+    Returns:
+        The same data made of dicts, lists and scalars.
+    """
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        data = {field.name: to_json(getattr(value, field.name)) for field in dataclasses.fields(value)}
+        data["__type__"] = type(value).__name__
+        return data
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def from_json(value: Any) -> Any:
+    """
+    Rebuild a tool result converted by `to_json`, including its dataclasses.
+
+    Args:
+        value: JSON-compatible data.
+
+    Returns:
+        The tool result.
+    """
+    if isinstance(value, dict):
+        data = {key: from_json(item) for key, item in value.items() if key != "__type__"}
+        result_type = RESULT_TYPES.get(value.get("__type__"))
+        return result_type(**data) if result_type is not None else data
+    if isinstance(value, list):
+        return [from_json(item) for item in value]
+    return value
+
+@dataclasses.dataclass
+class WarmIndex:
+    """A repository database loaded in memory with its querier tools."""
+    db_path: str
+    mtime: float  # Modification time of the database file when it was loaded
+    engine: Any
+    anchor: Optional[sqlite3.Connection]  # Keeps the shared in-memory database alive
+    tools: Dict[str, Tool]
+    users: int = 0  # Calls running on the index
+    retired: bool = False  # Evicted or replaced, to close once no call uses it
+
+    def close(self):
+        self.engine.dispose()
+        if self.anchor is not None:
+            self.anchor.close()
+
+# Distinct names for in-memory databases, so a reloaded database never sees an old copy
+_memory_db_ids = itertools.count()
+
+def load_in_memory_engine(db_path: str, pool_size: int = DEFAULT_POOL_SIZE):
+    """
+    Copy a SQLite database into a shared-cache in-memory database.
+
+    Like `create_read_only_engine`, the engine pools a bounded number of connections
+    that may be handed to any thread, as the server handles each request on its own.
+
+    Args:
+        db_path: Path to the SQLite database file.
+        pool_size: Maximum number of open connections to the copy.
+
+    Returns:
+        A tuple (engine, anchor) where engine opens connections to the in-memory copy
+        and anchor is a connection that must stay open for the copy to exist.
+    """
+    uri = f"file:kowinski_index_{next(_memory_db_ids)}?mode=memory&cache=shared"
+    anchor = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    source = sqlite3.connect(db_path)
+    try:
+        source.backup(anchor)
+    finally:
+        source.close()
+
+    engine = create_engine(
+        "sqlite://",
+        creator=lambda: sqlite3.connect(uri, uri=True, check_same_thread=False),
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=0
+    )
+    return engine, anchor
+
+class _IndexHTTPServer(ThreadingHTTPServer):
+    # Many agents connect at once; the default backlog of 5 resets their connections
+    request_queue_size = 128
+    daemon_threads = True
+
+class IndexServer:
+    """
+    Serves the repository querier tools of many databases from warm in-memory indexes.
+    """
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                 max_repos: int = 8, in_memory: bool = True):
+        """
+        Args:
+            host: Address to listen on. Keep it on localhost, the API has no authentication.
+            port: Port to listen on, 0 to pick a free one.
+            max_repos: Number of databases kept loaded before evicting the least recently used.
+            in_memory: Whether to copy each database into memory, or query the file directly.
+        """
+        self.max_repos = max_repos
+        self.in_memory = in_memory
+        self.indexes: "OrderedDict[str, WarmIndex]" = OrderedDict()
+        self.loading: Dict[str, Future] = {}  # Loads in progress, by database path
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "loads": 0, "evictions": 0, "calls": 0, "errors": 0}
+
+        # Tool descriptions are the same for every database; the engine is never connected
+        self.tool_specs = [
+            {
+                "name": tool.name,
+                "description": tool.description,
+                "inputs": tool.inputs,
+                "output_type": tool.output_type,
+            }
+            for tool in repository_querier(db_path=":memory:").values()
+        ]
+
+        self.httpd = _IndexHTTPServer((host, port), _IndexRequestHandler)
+        self.httpd.index_server = self
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _load(self, db_path: str, mtime: float) -> WarmIndex:
+        if self.in_memory:
+            engine, anchor = load_in_memory_engine(db_path)
+        else:
+            engine, anchor = create_read_only_engine(db_path), None
+        return WarmIndex(
+            db_path=db_path,
+            mtime=mtime,
+            engine=engine,
+            anchor=anchor,
+            tools=repository_querier(db_path, engine=engine)
+        )
+
+    def _retire(self, index: WarmIndex, to_close: List[WarmIndex]):
+        """Mark an index removed from the cache, to close now if unused. Call with the lock held."""
+        index.retired = True
+        if index.users == 0:
+            to_close.append(index)
+
+    def acquire_index(self, db_path: str) -> WarmIndex:
+        """
+        Get the warm index of a database for a call, loading it and evicting others if needed.
+
+        A database whose file changed since it was loaded is reloaded. Concurrent calls
+        on a database being loaded wait for that load. Release the index with
+        `release_index` once the call is done.
+
+        Args:
+            db_path: Path to the SQLite database.
+
+        Returns:
+            The WarmIndex of the database.
+        """
+        db_path = os.path.abspath(db_path)
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"Database not found: {db_path}")
+        mtime = os.path.getmtime(db_path)
+
+        while True:
+            with self.lock:
+                index = self.indexes.get(db_path)
+                if index is not None and index.mtime == mtime:
+                    self.indexes.move_to_end(db_path)
+                    self.stats["hits"] += 1
+                    index.users += 1
+                    return index
+                loading = self.loading.get(db_path)
+                if loading is None:
+                    loading = self.loading[db_path] = Future()
+                    break
+            # Another call is loading the database; check its result once it is done
+            loading.result()
+
+        try:
+            index = self._load(db_path, mtime)
+        except BaseException as e:
+            with self.lock:
+                del self.loading[db_path]
+            loading.set_exception(e)
+            raise
+
+        to_close: List[WarmIndex] = []
+        with self.lock:
+            replaced = self.indexes.pop(db_path, None)
+            if replaced is not None:
+                self._retire(replaced, to_close)
+            self.indexes[db_path] = index
+            index.users += 1
+            self.stats["loads"] += 1
+            while len(self.indexes) > self.max_repos:
+                _, evicted = self.indexes.popitem(last=False)
+                self._retire(evicted, to_close)
+                self.stats["evictions"] += 1
+            del self.loading[db_path]
+        loading.set_result(index)
+        for retired in to_close:
+            retired.close()
+        return index
+
+    def release_index(self, index: WarmIndex):
+        """Mark a call on an index as done, closing the index if it was retired meanwhile."""
+        with self.lock:
+            index.users -= 1
+            close = index.retired and index.users == 0
+        if close:
+            index.close()
+
+    @contextmanager
+    def using_index(self, db_path: str) -> Iterator[WarmIndex]:
+        """Hold the warm index of a database for the duration of a call."""
+        index = self.acquire_index(db_path)
+        try:
+            yield index
+        finally:
+            self.release_index(index)
+
+    def call(self, db_path: str, tool_name: str, arguments: Dict[str, Any]) -> Any:
+        """
+        Call a querier tool on a database.
+
+        Args:
+            db_path: Path to the SQLite database.
+            tool_name: Name of the repository_querier tool.
+            arguments: Keyword arguments of the tool.
+
+        Returns:
+            The tool result.
+        """
+        with self.using_index(db_path) as index:
+            if tool_name not in index.tools:
+                raise KeyError(f"Unknown tool: {tool_name}")
+            with self.lock:
+                self.stats["calls"] += 1
+            return index.tools[tool_name](**arguments)
+
+    def describe(self) -> Dict[str, Any]:
+        """Get the loaded databases and the server counters."""
+        with self.lock:
+            return {"loaded": list(self.indexes.keys()), **self.stats}
+
+    def serve_forever(self):
+        print(f"Index server listening on {self.url}")
+        self.httpd.serve_forever()
+
+    def start(self) -> threading.Thread:
+        """Serve from a background thread, e.g. to share indexes between agents of one process."""
+        thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        with self.lock:
+            for index in self.indexes.values():
+                index.close()
+            self.indexes.clear()
+
+class _IndexRequestHandler(BaseHTTPRequestHandler):
+    """HTTP handler: GET /tools, GET /stats and POST /call."""
+
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status: int, payload: Any):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server.index_server
+        if self.path == "/tools":
+            self._send_json(200, server.tool_specs)
+        elif self.path == "/stats":
+            self._send_json(200, server.describe())
+        else:
+            self._send_json(404, {"error": f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        server = self.server.index_server
+        if self.path != "/call":
+            self._send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            result = server.call(request["db_path"], request["tool"], request.get("arguments", {}))
+            self._send_json(200, {"result": to_json(result)})
+        except Exception as e:
+            with server.lock:
+                server.stats["errors"] += 1
+            self._send_json(400, {"error": f"{type(e).__name__}: {e}"})
+
+    def log_message(self, format, *args):
+        # Tool calls are too frequent to log each request
+        pass
+
+class RemoteTool(Tool):
+    """A repository querier tool whose calls are answered by an IndexServer."""
+
+    skip_forward_signature_validation = True
+
+    def __init__(self, spec: Dict[str, Any], db_path: str, url: str, timeout: float = 60.0):
+        self.name = spec["name"]
+        self.description = spec["description"]
+        self.inputs = spec["inputs"]
+        self.output_type = spec["output_type"]
+        self.db_path = db_path
+        self.url = url
+        self.timeout = timeout
+        super().__init__()
+
+    def forward(self, *args, **kwargs):
+        # Map positional arguments to input names, in signature order
+        arguments = dict(zip(self.inputs.keys(), args))
+        arguments.update(kwargs)
+
+        payload = json.dumps({"db_path": self.db_path, "tool": self.name, "arguments": arguments})
+        request = urllib.request.Request(
+            f"{self.url}/call",
+            data=payload.encode("utf-8"),
+            headers={"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return from_json(json.loads(response.read())["result"])
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(json.loads(e.read()).get("error", str(e))) from None
+
+def remote_repository_querier(db_path: str = "repository.db",
+                              url: str = f"http://{DEFAULT_HOST}:{DEFAULT_PORT}") -> Dict[str, Tool]:
+    """
+    Get the repository querier tools of a database, served by a running IndexServer.
+
+    The tools have the same names, inputs and results as those of `repository_querier`,
+    and can be given to agents in their place.
+
+    Args:
+        db_path: Path to the SQLite database, resolved on this machine.
+        url: Base URL of the index server.
+
+    Returns:
+        Dictionary mapping tool names to tools.
+    """
+    with urllib.request.urlopen(f"{url}/tools", timeout=10) as response:
+        specs = json.loads(response.read())
+
+    db_path = os.path.abspath(db_path)
+    return {spec["name"]: RemoteTool(spec, db_path, url) for spec in specs}
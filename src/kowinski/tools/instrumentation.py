@@ -0,0 +1,434 @@
+"""
+Performance instrumentation of agent runs.
+
+Instrumentation.instrument_agent wraps the tools, model and step callbacks of
+an agent and its managed agents. It records per tool the latency, call and
+error counts, result sizes and the time spent in SQL queries, and per agent
+step the duration, model latency and token counts. The SQL time is measured
+through SQLAlchemy engine events and attributed to the tool running in the
+current context, so concurrent agents do not mix their numbers. Tool calls are
+credited in the same way to the agent whose step is running, as agents may
+share tool instances.
+
+The measurements are kept in memory for a JSON summary of the run and, when
+OpenTelemetry is set up with setup_opentelemetry, also exported as spans and
+metrics to an OTLP collector or to local JSON lines files.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from smolagents.memory import ActionStep
+from smolagents.models import ChatMessage, Model
+from smolagents.tools import Tool
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+@dataclass
+class ToolStats:
+    """Aggregated measurements of one tool."""
+    calls: int = 0
+    errors: int = 0
+    latencies: List[float] = field(default_factory=list)  # Seconds
+    result_chars: int = 0
+    db_time: float = 0.0  # Seconds spent in SQL queries
+    db_queries: int = 0
+
+@dataclass
+class ModelStats:
+    """Aggregated measurements of the model calls of one agent."""
+    calls: int = 0
+    errors: int = 0
+    latencies: List[float] = field(default_factory=list)
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+# Statistics of the tool running in the current context, to attribute SQL time to
+_active_tool: ContextVar[Optional[ToolStats]] = ContextVar("kowinski_active_tool", default=None)
+# Name of the agent whose step runs in the current context, to credit tool calls to
+_active_agent: ContextVar[Optional[str]] = ContextVar("kowinski_active_agent", default=None)
+_listeners_lock = threading.Lock()
+_listeners_installed = False
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("kowinski_query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("kowinski_query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    stats = _active_tool.get()
+    if stats is not None:
+        # Only the thread running the tool updates its statistics' SQL counters
+        stats.db_time += elapsed
+        stats.db_queries += 1
+
+def _install_sql_listeners():
+    """Time the SQL queries of every SQLAlchemy engine, once per process."""
+    global _listeners_installed
+    with _listeners_lock:
+        if not _listeners_installed:
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            _listeners_installed = True
+
+def _distribution(latencies: List[float]) -> Dict[str, float]:
+    """Total, mean, median, 95th percentile and maximum of latencies, in milliseconds but the total."""
+    if not latencies:
+        return {"total_s": 0.0}
+    ordered = sorted(latencies)
+    return {
+        "total_s": round(sum(ordered), 4),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 2),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+@dataclass
+class Telemetry:
+    """OpenTelemetry tracer and meter, with the providers to flush on shutdown."""
+    tracer: Any
+    meter: Any
+    tracer_provider: Any
+    meter_provider: Any
+
+    def shutdown(self):
+        """Flush and stop the exporters."""
+        self.tracer_provider.shutdown()
+        self.meter_provider.shutdown()
+
+def setup_opentelemetry(
+    service_name: str = "kowinski",
+    otlp_endpoint: Optional[str] = None,
+    trace_file: Optional[str] = None,
+    metrics_file: Optional[str] = None,
+    instrument_smolagents: bool = True,
+) -> Telemetry:
+    """
+    Set up OpenTelemetry tracing and metrics for kowinski runs.
+
+    Spans and metrics go to an OTLP/HTTP collector when otlp_endpoint is given, or
+    when the standard OTEL_EXPORTER_OTLP_ENDPOINT variable is set, and to JSON
+    lines files when trace_file or metrics_file are given.
+
+    Args:
+        service_name: Service name of the resource.
+        otlp_endpoint: Base URL of the collector, e.g. http://localhost:4318.
+        trace_file: Path of a file the spans are appended to, one JSON object per line.
+        metrics_file: Path of a file the metrics are appended to, one JSON object per export.
+        instrument_smolagents: Whether to also trace the agents with the openinference instrumentor.
+
+    Returns:
+        The Telemetry, to pass to Instrumentation and shut down at the end of the run.
+    """
+    from opentelemetry.sdk.metrics import MeterProvider
+    from opentelemetry.sdk.metrics.export import ConsoleMetricExporter, PeriodicExportingMetricReader
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+    resource = Resource.create({"service.name": service_name})
+    tracer_provider = TracerProvider(resource=resource)
+    metric_readers = []
+
+    if otlp_endpoint or os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        base = otlp_endpoint.rstrip("/") if otlp_endpoint else None
+        tracer_provider.add_span_processor(BatchSpanProcessor(
+            OTLPSpanExporter(endpoint=f"{base}/v1/traces" if base else None)
+        ))
+        metric_readers.append(PeriodicExportingMetricReader(
+            OTLPMetricExporter(endpoint=f"{base}/v1/metrics" if base else None)
+        ))
+    if trace_file:
+        tracer_provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter(
+            out=open(trace_file, "a"), formatter=lambda span: span.to_json(indent=None) + "\n"
+        )))
+    if metrics_file:
+        metric_readers.append(PeriodicExportingMetricReader(ConsoleMetricExporter(
+            out=open(metrics_file, "a"), formatter=lambda data: data.to_json(indent=None) + "\n"
+        )))
+    meter_provider = MeterProvider(resource=resource, metric_readers=metric_readers)
+
+    if instrument_smolagents:
+        from openinference.instrumentation.smolagents import SmolagentsInstrumentor
+        SmolagentsInstrumentor().instrument(tracer_provider=tracer_provider)
+
+    return Telemetry(
+        tracer=tracer_provider.get_tracer("kowinski"),
+        meter=meter_provider.get_meter("kowinski"),
+        tracer_provider=tracer_provider,
+        meter_provider=meter_provider,
+    )
+
+class InstrumentedModel(Model):
+    """A model recording the latency and token counts of its calls for one agent."""
+
+    def __init__(self, model: Model, instrumentation: "Instrumentation", agent_name: str):
+        super().__init__()
+        self.model = model
+        self.model_id = getattr(model, "model_id", type(model).__name__)
+        self.instrumentation = instrumentation
+        self.agent_name = agent_name
+        self.last_latency: Optional[float] = None
+
+    def __call__(self, messages: List[Dict[str, str]], **kwargs) -> ChatMessage:
+        with self.instrumentation.model_call(self.agent_name, self.model_id) as record:
+            message = self.model(messages, **kwargs)
+            self.last_input_token_count = self.model.last_input_token_count
+            self.last_output_token_count = self.model.last_output_token_count
+            record["input_tokens"] = self.last_input_token_count or 0
+            record["output_tokens"] = self.last_output_token_count or 0
+        self.last_latency = record["latency"]
+        return message
+
+class Instrumentation:
+    """
+    Measurements of one run: its tools, model calls and agent steps.
+
+    Safe to use from several threads.
+    """
+
+    def __init__(self, telemetry: Optional[Telemetry] = None):
+        """
+        Args:
+            telemetry: OpenTelemetry tracer and meter to also export to, None to only keep a summary.
+        """
+        self.telemetry = telemetry
+        self.lock = threading.Lock()
+        self.tools: Dict[str, ToolStats] = {}
+        self.models: Dict[str, ModelStats] = {}
+        self.steps: List[Dict] = []
+        self.step_tool_calls: Dict[str, List[str]] = {}  # Tools called by each agent since its last step
+        self.started = time.time()
+        _install_sql_listeners()
+
+        if telemetry is not None:
+            meter = telemetry.meter
+            self.tool_duration = meter.create_histogram(
+                "kowinski.tool.duration", unit="s", description="Latency of tool calls")
+            self.tool_db_duration = meter.create_histogram(
+                "kowinski.tool.db_duration", unit="s", description="SQL time of tool calls")
+            self.tool_result_size = meter.create_histogram(
+                "kowinski.tool.result_size", unit="By", description="Size of tool results in characters")
+            self.model_duration = meter.create_histogram(
+                "kowinski.llm.duration", unit="s", description="Latency of model calls")
+            self.model_tokens = meter.create_counter(
+                "kowinski.llm.tokens", unit="{token}", description="Tokens of model calls")
+
+    @contextmanager
+    def _span(self, name: str, attributes: Dict):
+        if self.telemetry is None:
+            yield None
+            return
+        with self.telemetry.tracer.start_as_current_span(name, attributes=attributes) as span:
+            yield span
+
+    def wrap_tool(self, tool: Tool, agent_name: str) -> Tool:
+        """
+        Instrument the calls of a tool, in place.
+
+        Calls are credited to the instrumented agent whose step is running, so a tool shared
+        by several agents is instrumented once.
+
+        Args:
+            tool: The tool.
+            agent_name: Name of the agent to credit calls made outside of an instrumented step to.
+
+        Returns:
+            The tool.
+        """
+        if getattr(tool, "_kowinski_instrumentation", None) is self:
+            return tool
+        forward = tool.forward
+        name = tool.name
+        with self.lock:
+            stats = self.tools.setdefault(name, ToolStats())
+
+        def instrumented_forward(*args, **kwargs):
+            # Calls of a tool from concurrent agents have their own SQL counters until merged
+            call_stats = ToolStats()
+            caller = _active_agent.get() or agent_name
+            token = _active_tool.set(call_stats)
+            start = time.perf_counter()
+            error = None
+            try:
+                with self._span(f"tool {name}", {"kowinski.tool": name, "kowinski.agent": caller}) as span:
+                    result = forward(*args, **kwargs)
+                    result_chars = len(str(result))
+                    if span is not None:
+                        span.set_attribute("kowinski.result_chars", result_chars)
+                        span.set_attribute("kowinski.db_time", call_stats.db_time)
+                        span.set_attribute("kowinski.db_queries", call_stats.db_queries)
+                return result
+            except Exception as e:
+                error = e
+                result_chars = 0
+                raise
+            finally:
+                latency = time.perf_counter() - start
+                _active_tool.reset(token)
+                with self.lock:
+                    self.step_tool_calls.setdefault(caller, []).append(name)
+                    stats.calls += 1
+                    stats.errors += error is not None
+                    stats.latencies.append(latency)
+                    stats.result_chars += result_chars
+                    stats.db_time += call_stats.db_time
+                    stats.db_queries += call_stats.db_queries
+                if self.telemetry is not None:
+                    attributes = {"tool": name, "agent": caller, "error": error is not None}
+                    self.tool_duration.record(latency, attributes)
+                    self.tool_db_duration.record(call_stats.db_time, attributes)
+                    self.tool_result_size.record(result_chars, attributes)
+
+        tool.forward = instrumented_forward
+        tool._kowinski_instrumentation = self
+        return tool
+
+    @contextmanager
+    def model_call(self, agent_name: str, model_id: str):
+        """
+        Measure one model call.
+
+        Yields:
+            A dictionary the caller fills in with 'input_tokens' and 'output_tokens';
+            'latency' is set on exit.
+        """
+        record = {"input_tokens": 0, "output_tokens": 0, "latency": None}
+        start = time.perf_counter()
+        error = None
+        try:
+            with self._span("llm call", {"kowinski.agent": agent_name, "kowinski.model": model_id}) as span:
+                yield record
+                if span is not None:
+                    span.set_attribute("llm.token_count.prompt", record["input_tokens"])
+                    span.set_attribute("llm.token_count.completion", record["output_tokens"])
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            record["latency"] = time.perf_counter() - start
+            with self.lock:
+                stats = self.models.setdefault(agent_name, ModelStats())
+                stats.calls += 1
+                stats.errors += error is not None
+                stats.latencies.append(record["latency"])
+                stats.input_tokens += record["input_tokens"]
+                stats.output_tokens += record["output_tokens"]
+            if self.telemetry is not None:
+                attributes = {"agent": agent_name, "model": model_id, "error": error is not None}
+                self.model_duration.record(record["latency"], attributes)
+                self.model_tokens.add(record["input_tokens"], {**attributes, "kind": "input"})
+                self.model_tokens.add(record["output_tokens"], {**attributes, "kind": "output"})
+
+    def step_callback(self, agent_name: str) -> Callable:
+        """Get a step callback recording the steps of an agent."""
+
+        def record_step(memory_step, agent=None):
+            if not isinstance(memory_step, ActionStep):
+                return
+            model = getattr(agent, "model", None)
+            step = {
+                "agent": agent_name,
+                "step": memory_step.step_number,
+                "duration": round(memory_step.duration or 0.0, 4),
+                "llm_latency": round(getattr(model, "last_latency", None) or 0.0, 4),
+                "input_tokens": getattr(model, "last_input_token_count", None),
+                "output_tokens": getattr(model, "last_output_token_count", None),
+                "error": str(memory_step.error) if memory_step.error else None,
+            }
+            with self.lock:
+                step["tool_calls"] = self.step_tool_calls.pop(agent_name, [])
+                self.steps.append(step)
+
+        return record_step
+
+    def instrument_agent(self, agent) -> Any:
+        """
+        Instrument an agent and, recursively, its managed agents, in place.
+
+        Args:
+            agent: A smolagents MultiStepAgent.
+
+        Returns:
+            The agent.
+        """
+        agent_name = getattr(agent, "name", None) or type(agent).__name__
+        for tool in agent.tools.values():
+            self.wrap_tool(tool, agent_name)
+        if not isinstance(agent.model, InstrumentedModel):
+            agent.model = InstrumentedModel(agent.model, self, agent_name)
+        agent.step_callbacks.append(self.step_callback(agent_name))
+        step = agent.step
+
+        def instrumented_step(memory_step):
+            token = _active_agent.set(agent_name)
+            try:
+                return step(memory_step)
+            finally:
+                _active_agent.reset(token)
+
+        agent.step = instrumented_step
+        for managed_agent in agent.managed_agents.values():
+            if hasattr(managed_agent, "agent_hooks"):
+                # Team members creating their agents per call, such as a FanOutLocalizer
+                managed_agent.agent_hooks.append(self.instrument_agent)
+            else:
+                self.instrument_agent(managed_agent)
+        return agent
+
+    def summary(self) -> Dict:
+        """Get the measurements of the run as a JSON serializable dictionary."""
+        with self.lock:
+            tools = {
+                name: {
+                    "calls": stats.calls,
+                    "errors": stats.errors,
+                    **_distribution(stats.latencies),
+                    "result_chars": stats.result_chars,
+                    "db_time_s": round(stats.db_time, 4),
+                    "db_queries": stats.db_queries,
+                }
+                for name, stats in sorted(self.tools.items()) if stats.calls
+            }
+            models = {
+                name: {
+                    "calls": stats.calls,
+                    "errors": stats.errors,
+                    **_distribution(stats.latencies),
+                    "input_tokens": stats.input_tokens,
+                    "output_tokens": stats.output_tokens,
+                }
+                for name, stats in sorted(self.models.items())
+            }
+            steps = list(self.steps)
+        tool_time = sum(tool["total_s"] for tool in tools.values())
+        model_time = sum(model["total_s"] for model in models.values())
+        return {
+            "started": self.started,
+            "duration_s": round(time.time() - self.started, 3),
+            "tool_time_s": round(tool_time, 4),
+            "db_time_s": round(sum(tool["db_time_s"] for tool in tools.values()), 4),
+            "llm_time_s": round(model_time, 4),
+            "tools": tools,
+            "llm": models,
+            "steps": steps,
+        }
+
+    def write_summary(self, path: str) -> Dict:
+        """Write the summary of the run to a JSON file and return it."""
+        summary = self.summary()
+        with open(path, "w") as f:
+            json.dump(summary, f, indent=2, default=str)
+        return summary
@@ -0,0 +1,173 @@
+"""
+Copy-on-write overlay of patched files over the indexed repository.
+
+The patch tools write the working copy of every file they modify to a
+RepositoryOverlay, and the repository querier consults the overlay before the
+database. A patched Python file is re-analyzed with PythonCodeVisitor on the
+first query after each change, for that file only, so the file structure,
+entity line ranges and outline follow the patched content without rebuilding
+the database.
+"""
+
+import ast
+import itertools
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from kowinski.parser.file_parser import PythonCodeVisitor, render_outline
+from kowinski.tools.code_analysis import ClassInfo, FunctionInfo, VariableInfo
+
+@dataclass
+class OverlayAnalysis:
+    """Entities of a patched Python file, as found by PythonCodeVisitor."""
+    functions: List[FunctionInfo] = field(default_factory=list)
+    classes: List[ClassInfo] = field(default_factory=list)
+    variables: List[VariableInfo] = field(default_factory=list)
+    outline: Optional[str] = None
+    decorated_start_lines: Dict[int, int] = field(default_factory=dict)  # First line with decorators, by entity id
+    parse_error: Optional[str] = None  # Set when the patched content is not valid Python
+
+@dataclass
+class OverlayFile:
+    """The patched state of a file."""
+    file_path: str
+    file_id: int  # Id of the file in the repofile table
+    original_content: str
+    content: str
+    analysis: Optional[OverlayAnalysis] = None  # None until the first query after a change
+
+    @property
+    def line_count(self) -> int:
+        # Counted as repo_parser does, so an unedited file reports the indexed line count
+        return self.content.count('\n') + 1
+
+def analyze_content(content: str, file_id: int, file_path: str) -> OverlayAnalysis:
+    """
+    Extract the functions, classes and variables of Python source.
+
+    Entities get negative ids, as they are not stored in the database.
+
+    Args:
+        content: Python source code.
+        file_id: Id of the file in the repofile table.
+        file_path: Relative path of the file.
+
+    Returns:
+        The OverlayAnalysis of the content.
+    """
+    try:
+        tree = ast.parse(content)
+    except SyntaxError as e:
+        return OverlayAnalysis(
+            outline=f"# SyntaxError in the patched file: {e}",
+            parse_error=str(e)
+        )
+
+    visitor = PythonCodeVisitor()
+    visitor.visit(tree)
+    ids = itertools.count(-1, -1)
+
+    def without(data, *keys):
+        return {key: value for key, value in data.items() if key not in keys}
+
+    functions = [
+        FunctionInfo(id=next(ids), file_id=file_id, file_path=file_path, **without(func, "decorated_start_line"))
+        for func in visitor.functions
+    ]
+    classes = [
+        ClassInfo(id=next(ids), file_id=file_id, file_path=file_path, **without(cls, "decorated_start_line"))
+        for cls in visitor.classes
+    ]
+    decorated_start_lines = {
+        entity.id: data["decorated_start_line"]
+        for entity, data in zip([*functions, *classes], [*visitor.functions, *visitor.classes])
+        if data.get("decorated_start_line") is not None
+    }
+    return OverlayAnalysis(
+        functions=functions,
+        classes=classes,
+        variables=[
+            VariableInfo(id=next(ids), file_id=file_id, file_path=file_path, **var)
+            for var in visitor.variables
+        ],
+        outline=render_outline(visitor.functions, visitor.classes, visitor.variables),
+        decorated_start_lines=decorated_start_lines
+    )
+
+class RepositoryOverlay:
+    """
+    Patched files of a repository, keyed by relative path.
+
+    The overlay is shared by the patch tools, which write to it, and the repository
+    querier, which reads from it. It is safe to use from several threads.
+    """
+
+    def __init__(self):
+        self.files: Dict[str, OverlayFile] = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, file_path: str) -> bool:
+        return file_path in self.files
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def paths(self) -> List[str]:
+        """Get the paths of the patched files, sorted."""
+        with self.lock:
+            return sorted(self.files)
+
+    def get(self, file_path: str) -> Optional[OverlayFile]:
+        """Get the patched state of a file, or None if it is not patched."""
+        return self.files.get(file_path)
+
+    def update(self, file_path: str, file_id: int, original_content: str, content: str) -> OverlayFile:
+        """
+        Record the new content of a file. Its analysis is redone on the next query.
+
+        Args:
+            file_path: Relative path of the file.
+            file_id: Id of the file in the repofile table.
+            original_content: Indexed content of the file.
+            content: Patched content of the file.
+
+        Returns:
+            The OverlayFile of the file.
+        """
+        with self.lock:
+            overlay_file = OverlayFile(
+                file_path=file_path,
+                file_id=file_id,
+                original_content=original_content,
+                content=content
+            )
+            self.files[file_path] = overlay_file
+            return overlay_file
+
+    def discard(self, file_path: str):
+        """Forget the changes to a file, so queries answer from the index again."""
+        with self.lock:
+            self.files.pop(file_path, None)
+
+    def analysis(self, file_path: str) -> Optional[OverlayAnalysis]:
+        """
+        Get the entities of a patched file, analyzing it if it changed since the last call.
+
+        Args:
+            file_path: Relative path of the file.
+
+        Returns:
+            The OverlayAnalysis of the file, empty for non-Python files, or None if the file is not patched.
+        """
+        overlay_file = self.files.get(file_path)
+        if overlay_file is None:
+            return None
+        if overlay_file.analysis is None:
+            if file_path.endswith(".py"):
+                analysis = analyze_content(overlay_file.content, overlay_file.file_id, file_path)
+            else:
+                analysis = OverlayAnalysis()
+            # A concurrent update replaces the OverlayFile, so this never overwrites a newer state
+            overlay_file.analysis = analysis
+        return overlay_file.analysis
@@ -0,0 +1,343 @@
+"""
+Application of line edit operations and unified diffs to file contents.
+
+Edits are validated against each other before anything is applied, then the
+result is assembled in a single forward pass as a list of pieces: runs of
+untouched original lines and the new lines of each edit. Applying N edits to a
+file of L lines is O(L + N log N) instead of one O(L) list splice per edit, and
+the original line endings, including a missing newline at the end of the file,
+are kept.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+# How far from its stated position a unified diff hunk is searched for, in lines
+MAX_HUNK_OFFSET = 100
+
+_HUNK_HEADER_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+class PatchError(ValueError):
+    """Raised when edits are invalid, overlap, or do not match the content."""
+
+@dataclass
+class LineEdit:
+    """Replacement of original lines [start, end) (0-based) with new lines."""
+    start: int
+    end: int
+    lines: List[str]
+    order: int = 0  # Position among the given edits, to keep inserts at one line in order
+
+@dataclass
+class Hunk:
+    """A hunk of a unified diff."""
+    old_start: int
+    old_count: int
+    new_start: int
+    new_count: int
+    lines: List[str] = field(default_factory=list)  # Lines with their ' ', '-' or '+' prefix
+
+    def old_lines(self) -> List[str]:
+        return [line[1:] for line in self.lines if line[:1] in (" ", "-")]
+
+    def new_lines(self) -> List[str]:
+        return [line[1:] for line in self.lines if line[:1] in (" ", "+")]
+
+@dataclass
+class FilePatch:
+    """The hunks of a unified diff for one file."""
+    old_path: Optional[str]
+    new_path: Optional[str]
+    hunks: List[Hunk] = field(default_factory=list)
+
+    @property
+    def path(self) -> Optional[str]:
+        """Path of the patched file, without the a/ or b/ prefix."""
+        path = self.new_path if self.new_path is not None else self.old_path
+        if path is not None and path[:2] in ("a/", "b/"):
+            return path[2:]
+        return path
+
+def split_lines(content: str) -> List[str]:
+    """
+    Split content into lines keeping their line endings.
+
+    Only line feeds end a line, as for ast and the line numbers of the index. Form
+    feeds and the other separators str.splitlines splits on stay inside their line,
+    and a carriage return before a line feed stays at the end of its line.
+    """
+    lines = [line + "\n" for line in content.split("\n")]
+    lines[-1] = lines[-1][:-1]
+    return lines if lines[-1] else lines[:-1]
+
+def detect_line_ending(lines: List[str]) -> str:
+    """Get the line ending of a file, from its first line that has one."""
+    for line in lines:
+        if line.endswith("\r\n"):
+            return "\r\n"
+        if line.endswith(("\n", "\r")):
+            return line[-1]
+    return "\n"
+
+def _strip_line_ending(line: str) -> str:
+    return line.rstrip("\r\n")
+
+def operations_to_edits(lines: List[str], patch_operations: List[Dict[str, Any]]) -> List[LineEdit]:
+    """
+    Convert replace, insert and delete operations to validated edits.
+
+    Args:
+        lines: Lines of the file the operations refer to.
+        patch_operations: Operations with operation, start_line, end_line and content keys,
+            line numbers being 1-indexed and inclusive.
+
+    Returns:
+        The edits, with new lines ending like the lines of the file.
+
+    Raises:
+        PatchError: If an operation is unknown, malformed or out of the file.
+    """
+    ending = detect_line_ending(lines)
+    edits = []
+    for order, op in enumerate(patch_operations):
+        operation = op.get("operation")
+        if operation not in ("replace", "insert", "delete"):
+            raise PatchError(f"Operation {order}: unknown operation {operation!r}")
+        try:
+            start_line = int(op["start_line"])
+            end_line = int(op["end_line"]) if operation != "insert" else start_line - 1
+        except (KeyError, TypeError, ValueError):
+            raise PatchError(f"Operation {order}: {operation} needs integer start_line"
+                             + (" and end_line" if operation != "insert" else "")) from None
+
+        max_start = len(lines) + 1 if operation == "insert" else len(lines)
+        if not 1 <= start_line <= max(max_start, 1):
+            raise PatchError(f"Operation {order}: start_line {start_line} is outside the file (1-{max_start})")
+        if operation != "insert" and not start_line <= end_line <= len(lines):
+            raise PatchError(f"Operation {order}: end_line {end_line} must be between {start_line} and {len(lines)}")
+
+        new_lines = []
+        if operation != "delete":
+            content = op.get("content")
+            if not isinstance(content, str):
+                raise PatchError(f"Operation {order}: {operation} needs a string content")
+            new_lines = [_strip_line_ending(line) + ending for line in split_lines(content)]
+        edits.append(LineEdit(start=start_line - 1, end=end_line, lines=new_lines, order=order))
+    return edits
+
+def apply_edits(lines: List[str], edits: List[LineEdit]) -> List[str]:
+    """
+    Apply edits that all refer to the original lines.
+
+    Inserts at the start of a replaced or deleted range go before it; several inserts
+    at the same line keep their order. When the file ended without a newline, edits
+    replacing its last line keep it that way, and lines added after it give it one.
+
+    Args:
+        lines: Original lines, with their line endings.
+        edits: Edits to apply.
+
+    Returns:
+        The new lines.
+
+    Raises:
+        PatchError: If two edits overlap.
+    """
+    # Inserts (empty ranges) sort before the range starting at the same line
+    edits = sorted(edits, key=lambda edit: (edit.start, edit.end > edit.start, edit.order))
+    for previous, edit in zip(edits, edits[1:]):
+        if edit.start < previous.end:
+            raise PatchError(
+                f"Overlapping edits of lines {previous.start + 1}-{previous.end} and "
+                f"{edit.start + 1}-{max(edit.end, edit.start + 1)}"
+            )
+
+    missing_final_newline = bool(lines) and lines[-1] == _strip_line_ending(lines[-1])
+    result = _assemble(lines, edits)
+
+    if missing_final_newline:
+        appended = sum(len(edit.lines) for edit in edits if edit.start == edit.end == len(lines))
+        if appended and len(result) > appended:
+            # Lines added after the last line: it needs a line ending
+            position = len(result) - appended - 1
+            if result[position] == _strip_line_ending(result[position]):
+                result[position] += detect_line_ending(lines)
+        elif not appended and edits and edits[-1].end == len(lines) and edits[-1].lines:
+            # The last line was replaced: keep the file without a final newline
+            result[-1] = _strip_line_ending(result[-1])
+    return result
+
+def _assemble(lines: List[str], edits: List[LineEdit]) -> List[str]:
+    """Build the new lines from runs of original lines and the lines of sorted, non-overlapping edits."""
+    result: List[str] = []
+    cursor = 0
+    for edit in edits:
+        result.extend(lines[cursor:edit.start])
+        result.extend(edit.lines)
+        cursor = edit.end
+    result.extend(lines[cursor:])
+    return result
+
+def apply_operations(content: str, patch_operations: List[Dict[str, Any]]) -> str:
+    """
+    Apply replace, insert and delete operations to file content.
+
+    Args:
+        content: Original file content.
+        patch_operations: Operations with operation, start_line, end_line and content keys,
+            all referring to the original line numbers (1-indexed, inclusive).
+
+    Returns:
+        The modified content.
+
+    Raises:
+        PatchError: If an operation is invalid or overlaps another.
+    """
+    lines = split_lines(content)
+    return "".join(apply_edits(lines, operations_to_edits(lines, patch_operations)))
+
+def parse_unified_diff(diff: str) -> List[FilePatch]:
+    """
+    Parse a unified diff, as produced by diff -u or git diff.
+
+    Args:
+        diff: The unified diff, for one or more files.
+
+    Returns:
+        The patches of each file, in order.
+
+    Raises:
+        PatchError: If a hunk is malformed.
+    """
+    patches: List[FilePatch] = []
+    hunk: Optional[Hunk] = None
+    remaining_old = remaining_new = 0
+    for line_number, line in enumerate(split_lines(diff), start=1):
+        text = line.rstrip("\n")
+        if text.startswith("\\"):
+            # "\ No newline at end of file" applies to the previous line of the hunk
+            if hunk is not None and hunk.lines and hunk.lines[-1].endswith("\n"):
+                hunk.lines[-1] = hunk.lines[-1][:-1]
+            continue
+        if hunk is not None and (remaining_old > 0 or remaining_new > 0):
+            prefix = text[:1] if text else " "
+            if prefix not in (" ", "-", "+"):
+                raise PatchError(f"Line {line_number}: unexpected line in hunk: {text!r}")
+            hunk.lines.append(prefix + text[1:] + "\n")
+            remaining_old -= prefix in (" ", "-")
+            remaining_new -= prefix in (" ", "+")
+            continue
+
+        if text.startswith("--- "):
+            path = text[4:].split("\t")[0].strip()
+            patches.append(FilePatch(old_path=None if path == "/dev/null" else path, new_path=None))
+            hunk = None
+        elif text.startswith("+++ ") and patches and patches[-1].new_path is None and not patches[-1].hunks:
+            path = text[4:].split("\t")[0].strip()
+            patches[-1].new_path = None if path == "/dev/null" else path
+        elif text.startswith("@@"):
+            match = _HUNK_HEADER_RE.match(text)
+            if match is None:
+                raise PatchError(f"Line {line_number}: malformed hunk header: {text!r}")
+            if not patches:
+                patches.append(FilePatch(old_path=None, new_path=None))
+            old_start, old_count, new_start, new_count = match.groups()
+            hunk = Hunk(
+                old_start=int(old_start),
+                old_count=int(old_count) if old_count is not None else 1,
+                new_start=int(new_start),
+                new_count=int(new_count) if new_count is not None else 1,
+            )
+            patches[-1].hunks.append(hunk)
+            remaining_old, remaining_new = hunk.old_count, hunk.new_count
+
+    if hunk is not None and (remaining_old > 0 or remaining_new > 0):
+        raise PatchError("Diff ends in the middle of a hunk")
+    return patches
+
+def _locate_hunk(lines: List[str], old_lines: List[str], expected: int, lower_bound: int) -> int:
+    """Find where the old lines of a hunk are, searching outwards from the expected position."""
+    old_keys = [_strip_line_ending(line) for line in old_lines]
+
+    def matches(position):
+        return all(
+            _strip_line_ending(lines[position + k]) == key for k, key in enumerate(old_keys)
+        )
+
+    last_start = len(lines) - len(old_keys)
+    for offset in range(MAX_HUNK_OFFSET + 1):
+        for position in ((expected + offset, expected - offset) if offset else (expected,)):
+            if lower_bound <= position <= last_start and matches(position):
+                return position
+    raise PatchError(f"Hunk expected at line {expected + 1} does not match the content")
+
+def hunks_to_edits(lines: List[str], hunks: List[Hunk]) -> List[LineEdit]:
+    """
+    Convert the hunks of a unified diff to edits of the lines they apply to.
+
+    Hunks are matched on their context and removed lines, at their stated position or
+    up to MAX_HUNK_OFFSET lines away from it, and never before the previous hunk.
+
+    Args:
+        lines: Lines of the file the diff applies to.
+        hunks: Hunks of the diff for this file.
+
+    Returns:
+        The edits, with new lines ending like the lines of the file.
+
+    Raises:
+        PatchError: If a hunk does not match the content.
+    """
+    ending = detect_line_ending(lines)
+    edits = []
+    lower_bound = 0
+    for order, hunk in enumerate(hunks):
+        old_lines = hunk.old_lines()
+        # A hunk without old lines inserts after line old_start
+        expected = hunk.old_start - 1 if old_lines else hunk.old_start
+        start = _locate_hunk(lines, old_lines, max(expected, 0), lower_bound)
+        new_lines = [
+            _strip_line_ending(line) + (ending if line.endswith(("\n", "\r")) else "")
+            for line in hunk.new_lines()
+        ]
+        edits.append(LineEdit(start=start, end=start + len(old_lines), lines=new_lines, order=order))
+        lower_bound = start + len(old_lines)
+    return edits
+
+def apply_hunks(lines: List[str], hunks: List[Hunk]) -> List[str]:
+    """
+    Apply the hunks of a unified diff for one file to its lines.
+
+    Args:
+        lines: Lines of the file, with their line endings.
+        hunks: Hunks of the diff for this file.
+
+    Returns:
+        The new lines. A hunk whose last line is marked "No newline at end of file" leaves
+        the file without a final newline.
+
+    Raises:
+        PatchError: If a hunk does not match the content.
+    """
+    return _assemble(lines, hunks_to_edits(lines, hunks))
+
+def apply_unified_diff(content: str, diff: str) -> str:
+    """
+    Apply a unified diff for a single file to its content.
+
+    Args:
+        content: Original file content.
+        diff: Unified diff with the hunks of this file.
+
+    Returns:
+        The modified content.
+
+    Raises:
+        PatchError: If the diff is malformed, covers several files, or does not match the content.
+    """
+    patches = parse_unified_diff(diff)
+    if len(patches) != 1:
+        raise PatchError(f"Expected a diff of one file, got {len(patches)}")
+    lines = split_lines(content)
+    return "".join(apply_hunks(lines, patches[0].hunks))
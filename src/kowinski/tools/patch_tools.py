@@ -1,15 +1,176 @@
-from typing import Dict, List, Any, Optional, Union
-import difflib
+from typing import Dict, List, Any, Optional, Tuple, Union
+import keyword
+import os
 import re
+from sqlalchemy import text
 from smolagents import tool
+from kowinski.parser.repo_parser import load_line_offsets
+from kowinski.tools.code_analysis import create_read_only_engine
+from kowinski.tools.diffing import unified_diff
+from kowinski.tools.patch_engine import (
+    PatchError, apply_edits, apply_hunks, apply_operations, operations_to_edits, parse_unified_diff, split_lines
+)
+from kowinski.tools.overlay import RepositoryOverlay
 
-def patch_tools():
+# Default number of calls or usages reported per name by identify_issue_patterns
+DEFAULT_MAX_RESULTS_PER_NAME = 20
+
+_TRACEBACK_RE = re.compile(r"Traceback[^\n]*\n((?:[ ]*File \"[^\"]*\", line \d+[^\n]*\n)+)", re.MULTILINE)
+_TRACEBACK_LOCATION_RE = re.compile(r"File \"([^\"]*)\", line (\d+)")
+_CALLED_NAME_RE = re.compile(r'\b([a-zA-Z_][a-zA-Z0-9_]*)\s*\(')
+_IDENTIFIER_RE = re.compile(r'[a-zA-Z_][a-zA-Z0-9_]*')
+_DEF_BEFORE_RE = re.compile(r'\bdef\s+$')
+
+def find_issue_patterns(file_content: str, issue_description: str,
+                        max_results_per_name: Optional[int] = DEFAULT_MAX_RESULTS_PER_NAME) -> List[Dict[str, Any]]:
+    """
+    Find the lines of a file that define, call, assign or use names mentioned in an issue.
+    
+    Names followed by a parenthesis in the issue are looked up as functions (definitions
+    and calls), other identifiers of more than two characters as variables (assignments
+    and usages). All names are matched in a single pass over the file: every identifier
+    of each line is looked up in a dictionary of mentioned names, so the cost does not
+    grow with the number of names. Each name is reported at most once per line.
+    
+    Args:
+        file_content: Content of the file
+        issue_description: Description of the GitHub issue
+        max_results_per_name: Maximum number of calls or usages reported per name,
+            None for no limit; definitions and assignments are always reported
+    
+    Returns:
+        List of dictionaries with information about each potential issue location,
+        grouped by name in order of mention, followed by the lines of the file
+        referenced by tracebacks in the issue
+    """
+    lines = file_content.splitlines()
+    
+    # Extract traceback locations from the issue description
+    traceback_locations = []
+    for traceback in _TRACEBACK_RE.findall(issue_description):
+        for filepath, line_num in _TRACEBACK_LOCATION_RE.findall(traceback):
+            traceback_locations.append((int(line_num), traceback))
+    
+    # Names mentioned in the issue, in order of first mention
+    mentioned_items = {}
+    for match in _CALLED_NAME_RE.finditer(issue_description):
+        func_name = match.group(1)
+        if func_name not in mentioned_items and len(func_name) > 2:  # Avoid common words
+            mentioned_items[func_name] = "function"
+    for var_name in _IDENTIFIER_RE.findall(issue_description):
+        if var_name not in mentioned_items and len(var_name) > 2:
+            mentioned_items[var_name] = "variable"
+    for name in [name for name in mentioned_items if keyword.iskeyword(name)]:
+        del mentioned_items[name]
+    
+    # Scan the file once, keeping the strongest match of each name on each line
+    matches_by_name = {name: [] for name in mentioned_items}
+    capped_counts = {name: 0 for name in mentioned_items}
+    for i, line in enumerate(lines):
+        line_matches = {}
+        for match in _IDENTIFIER_RE.finditer(line):
+            name = match.group(0)
+            item_type = mentioned_items.get(name)
+            if item_type is None:
+                continue
+            
+            rest = line[match.end():].lstrip()
+            if item_type == "function":
+                if not rest.startswith("("):
+                    continue
+                if _DEF_BEFORE_RE.search(line, 0, match.start()):
+                    match_type = "function_definition"
+                else:
+                    match_type = "function_call"
+            elif rest.startswith("=") and not rest.startswith("=="):
+                match_type = "variable_assignment"
+            else:
+                match_type = "variable_usage"
+            
+            # Definitions and assignments take precedence over calls and usages
+            if line_matches.get(name) in (None, "function_call", "variable_usage"):
+                line_matches[name] = match_type
+        
+        for name, match_type in line_matches.items():
+            if match_type in ("function_call", "variable_usage"):
+                if max_results_per_name is not None and capped_counts[name] >= max_results_per_name:
+                    continue
+                capped_counts[name] += 1
+            matches_by_name[name].append({
+                "type": match_type,
+                "name": name,
+                "line": i + 1,
+                "content": line
+            })
+    
+    results = [result for name in mentioned_items for result in matches_by_name[name]]
+    
+    # Match line numbers from tracebacks to the file
+    for line_number, traceback in traceback_locations:
+        line_num = line_number - 1  # Convert to 0-indexed
+        if 0 <= line_num < len(lines):
+            results.append({
+                "type": "traceback_line",
+                "line": line_number,
+                "content": lines[line_num],
+                "context": traceback
+            })
+    
+    return results
+
+def patch_tools(db_path: str = "repository.db", engine=None,
+                overlay: Optional[RepositoryOverlay] = None):
     """
     A set of tools for analyzing and patching files to fix GitHub issues.
     
     These tools help an agent understand a file's context, generate patches,
     and understand relevant code patterns to fix the identified issues.
+    
+    Args:
+        db_path: Path to the SQLite database of the indexed repository.
+        engine: Optional SQLAlchemy engine to query instead of opening db_path.
+        overlay: Optional RepositoryOverlay holding the working copies of the edited files.
+            Pass the same overlay to repository_querier for its tools to see the edits.
     """
+    if engine is None:
+        engine = create_read_only_engine(db_path)
+    if overlay is None:
+        overlay = RepositoryOverlay()
+    
+    def _get_working_copy(file_path: str) -> Tuple[int, str, List[str]]:
+        """Get the file id, indexed content and current lines of a file."""
+        overlay_file = overlay.get(file_path)
+        if overlay_file is not None:
+            return overlay_file.file_id, overlay_file.original_content, split_lines(overlay_file.content)
+        
+        folder, filename = os.path.split(file_path)
+        with engine.connect() as conn:
+            row = conn.execute(
+                text("SELECT id, content FROM repofile WHERE relative_folder = :folder AND file_name = :filename"),
+                {"folder": folder, "filename": filename}
+            ).first()
+        if row is None:
+            raise ValueError(f"File not found: {file_path}")
+        return row[0], row[1], split_lines(row[1])
+    
+    def _working_diff(file_path: str) -> str:
+        overlay_file = overlay.get(file_path)
+        if overlay_file is None:
+            return ""
+        return unified_diff(overlay_file.original_content, overlay_file.content, file_path)
+    
+    def _read_lines(file_id: int, offsets: List[int], first_line: int, last_line: int) -> str:
+        """Read lines first_line to last_line (1-based, inclusive) of a stored file with one substring query."""
+        start = offsets[first_line - 1]
+        end = offsets[last_line] - 1 if last_line < len(offsets) else None
+        with engine.connect() as conn:
+            if end is None:
+                query = "SELECT substr(content, :start) FROM repofile WHERE id = :file_id"
+                params = {"start": start + 1, "file_id": file_id}
+            else:
+                query = "SELECT substr(content, :start, :length) FROM repofile WHERE id = :file_id"
+                params = {"start": start + 1, "length": end - start, "file_id": file_id}
+            return conn.execute(text(query), params).scalar()
     
     @tool
     def generate_diff(original_content: str, modified_content: str, file_path: str) -> str:
@@ -24,23 +185,110 @@ def patch_tools():
         Returns:
             Unified diff as a string
         """
-        original_lines = original_content.splitlines(keepends=True)
-        modified_lines = modified_content.splitlines(keepends=True)
+        return unified_diff(original_content, modified_content, file_path)
+    
+    @tool
+    def edit_file(file_path: str, patch_operations: List[Dict[str, Any]]) -> str:
+        """
+        Edit a file of the repository in place, without passing its content.
+        The edits are kept in a working copy of the file, so later edits apply on top of earlier ones.
+        Operations of one call must not overlap, and their line numbers all refer to the working copy before the call.
+        
+        Args:
+            file_path: The relative path to the file, including folder and filename
+            patch_operations: List of operations to apply, each being a dict with:
+                - operation: "replace", "insert", or "delete"
+                - start_line: Starting line number in the current working copy (1-indexed)
+                - end_line: Ending line number for replace/delete (1-indexed, inclusive)
+                - content: New content for replace/insert operations
+                
+        Returns:
+            Unified diff of all the edits made to the file so far
+        """
+        file_id, original_content, lines = _get_working_copy(file_path)
+        lines = apply_edits(lines, operations_to_edits(lines, patch_operations))
+        overlay.update(file_path, file_id, original_content, "".join(lines))
+        return _working_diff(file_path)
+    
+    @tool
+    def apply_diff(diff: str) -> str:
+        """
+        Apply a unified diff to the working copies of the files it changes, as edit_file does.
+        Hunks are matched on their context lines, so small shifts in line numbers are tolerated.
+        Nothing is changed if any hunk does not apply.
+        
+        Args:
+            diff: Unified diff with a/ and b/ paths relative to the repository root
+            
+        Returns:
+            Unified diff of all the edits made to the changed files so far
+        """
+        patches = parse_unified_diff(diff)
+        if not patches:
+            raise PatchError("No file patches found in the diff")
         
-        diff = difflib.unified_diff(
-            original_lines,
-            modified_lines,
-            fromfile=f"a/{file_path}",
-            tofile=f"b/{file_path}",
-            n=3  # Context lines
-        )
+        # Apply every patch before updating any working copy
+        updated = {}
+        for file_patch in patches:
+            if file_patch.path is None:
+                raise PatchError("Creating or deleting files is not supported")
+            if file_patch.path not in updated:
+                updated[file_patch.path] = _get_working_copy(file_patch.path)
+            file_id, original_content, lines = updated[file_patch.path]
+            updated[file_patch.path] = (file_id, original_content, apply_hunks(lines, file_patch.hunks))
+        for path, (file_id, original_content, lines) in updated.items():
+            overlay.update(path, file_id, original_content, "".join(lines))
+        return "".join(_working_diff(path) for path in updated)
+    
+    @tool
+    def view_working_copy(file_path: str, start_line: int = 1, end_line: Optional[int] = None) -> str:
+        """
+        View lines of the working copy of a file, including the edits made with edit_file.
         
-        return ''.join(diff)
+        Args:
+            file_path: The relative path to the file, including folder and filename
+            start_line: First line to return (1-indexed)
+            end_line: Last line to return (1-indexed, inclusive), None for the end of the file
+            
+        Returns:
+            The requested lines of the working copy
+        """
+        _, _, lines = _get_working_copy(file_path)
+        return "".join(lines[max(start_line, 1) - 1:end_line])
+    
+    @tool
+    def get_working_diff(file_path: Optional[str] = None) -> str:
+        """
+        Get the unified diff of the edits made with edit_file, ready to be submitted as a patch.
+        
+        Args:
+            file_path: The relative path to the file, None for all the edited files
+            
+        Returns:
+            Unified diff as a string, empty if nothing was changed
+        """
+        file_paths = [file_path] if file_path is not None else overlay.paths()
+        return "".join(_working_diff(path) for path in file_paths)
+    
+    @tool
+    def reset_working_copy(file_path: str) -> str:
+        """
+        Discard the edits made with edit_file to a file.
+        
+        Args:
+            file_path: The relative path to the file, including folder and filename
+            
+        Returns:
+            A confirmation message
+        """
+        overlay.discard(file_path)
+        return f"Working copy of {file_path} reset to the indexed content"
     
     @tool
     def extract_method_context(file_content: str, method_name: str) -> Dict[str, Any]:
         """
         Extract a method and its surrounding context from a file.
+        For files of the repository, prefer extract_definition_context, which does not need the file content.
         
         Args:
             file_content: Content of the file
@@ -97,131 +345,127 @@ def patch_tools():
         }
     
     @tool
-    def identify_issue_patterns(file_content: str, issue_description: str) -> List[Dict[str, Any]]:
+    def extract_definition_context(file_path: str, name: str, class_name: Optional[str] = None,
+                                   context_lines: int = 10) -> Dict[str, Any]:
         """
-        Identify patterns in the file that may be causing the issue.
+        Extract a function, method or class definition and its surrounding context from an indexed file,
+        without passing the file content. Decorators and multi-line signatures are included. Edited files
+        are read from their working copy, so line numbers match the edits made so far.
         
         Args:
-            file_content: Content of the file
-            issue_description: Description of the GitHub issue
+            file_path: The relative path to the file, including folder and filename
+            name: Name of the function, method or class to find
+            class_name: Optional name of the class the method belongs to, to pick among methods with the same name
+            context_lines: Number of lines of context to return before and after the definition
             
         Returns:
-            List of dictionaries with information about each potential issue location
+            Dictionary with found, entity_type, start_line, end_line, content, context_before,
+            context_after and other_matches (other definitions with the same name in the file)
         """
-        lines = file_content.splitlines()
-        results = []
-        
-        # Extract error messages from the issue description
-        error_patterns = []
-        traceback_pattern = r"Traceback[^\n]*\n((?:[ ]*File \"[^\"]*\", line \d+[^\n]*\n)+)"
-        tracebacks = re.findall(traceback_pattern, issue_description, re.MULTILINE)
-        
-        for traceback in tracebacks:
-            # Extract file paths and line numbers
-            file_line_pattern = r"File \"([^\"]*)\", line (\d+)"
-            locations = re.findall(file_line_pattern, traceback)
-            
-            for filepath, line_num in locations:
-                filename = filepath.split("/")[-1]
-                error_patterns.append({
-                    "type": "traceback",
-                    "file": filename,
-                    "line": int(line_num),
-                    "context": traceback
-                })
-        
-        # Look for specific error types mentioned in the issue
-        error_types = [
-            "TypeError", "ValueError", "AttributeError", "ImportError",
-            "KeyError", "IndexError", "SyntaxError", "NameError"
-        ]
-        
-        for error_type in error_types:
-            if error_type in issue_description:
-                error_msg_pattern = fr"{error_type}:\s*([^\n]+)"
-                error_msgs = re.findall(error_msg_pattern, issue_description)
-                
-                for error_msg in error_msgs:
-                    error_patterns.append({
-                        "type": error_type,
-                        "message": error_msg
-                    })
-        
-        # Look for mentioned variables or functions
-        mentioned_items = {}
+        overlay_file = overlay.get(file_path)
+        if overlay_file is not None:
+            # The file was edited: answer from the working copy and its re-analyzed entities
+            analysis = overlay.analysis(file_path)
+            matches = sorted([
+                {"entity_type": entity_type, "start_line": entity.start_line, "end_line": entity.end_line,
+                 "decorated_start_line": analysis.decorated_start_lines.get(entity.id),
+                 "class_name": getattr(entity, "class_name", None)}
+                for entity_type, entities in (("function", analysis.functions), ("class", analysis.classes))
+                for entity in entities if entity.name == name
+            ], key=lambda match: match["start_line"])
+        else:
+            folder, filename = os.path.split(file_path)
+            query = """
+            SELECT 'function' AS entity_type, f.start_line, f.end_line, f.decorated_start_line, f.class_name,
+                   r.id AS file_id, r.line_offsets
+            FROM pythonfunction f JOIN repofile r ON f.file_id = r.id
+            WHERE r.relative_folder = :folder AND r.file_name = :filename AND f.name = :name
+            UNION ALL
+            SELECT 'class' AS entity_type, c.start_line, c.end_line, c.decorated_start_line, NULL AS class_name,
+                   r.id AS file_id, r.line_offsets
+            FROM pythonclass c JOIN repofile r ON c.file_id = r.id
+            WHERE r.relative_folder = :folder AND r.file_name = :filename AND c.name = :name
+            ORDER BY start_line
+            """
+            with engine.connect() as conn:
+                matches = conn.execute(text(query), {
+                    "folder": folder,
+                    "filename": filename,
+                    "name": name
+                }).mappings().all()
         
-        # Match potential function or method names in issue description
-        func_pattern = r'\b([a-zA-Z_][a-zA-Z0-9_]*)\s*\('
-        for match in re.finditer(func_pattern, issue_description):
-            func_name = match.group(1)
-            if func_name not in mentioned_items and len(func_name) > 2:  # Avoid common words
-                mentioned_items[func_name] = "function"
+        if class_name is not None:
+            matches = [match for match in matches if match["class_name"] == class_name]
+        if not matches:
+            message = f"Definition of '{name}' not found in {file_path}"
+            if overlay_file is not None and analysis.parse_error is not None:
+                message += f" (the edited file does not parse: {analysis.parse_error})"
+            return {
+                "found": False,
+                "message": message
+            }
         
-        # Match potential variable names
-        var_pattern = r'\b([a-zA-Z_][a-zA-Z0-9_]*)\b'
-        for match in re.finditer(var_pattern, issue_description):
-            var_name = match.group(1)
-            if var_name not in mentioned_items and len(var_name) > 2:
-                mentioned_items[var_name] = "variable"
+        match = matches[0]
+        if overlay_file is not None:
+            # Line feeds end lines, as for the line numbers of the analysis; a final one starts no new line
+            lines = [line.removesuffix("\n") for line in split_lines(overlay_file.content)]
+            line_count = len(lines)
+        else:
+            offsets = load_line_offsets(match["line_offsets"])
+            line_count = len(offsets)
+        first_line = match["decorated_start_line"] or match["start_line"]
+        last_line = min(match["end_line"], line_count)
+        context_start = max(1, first_line - context_lines)
+        context_end = min(line_count, last_line + context_lines)
         
-        # Now search for the identified patterns in the file
-        for item_name, item_type in mentioned_items.items():
-            if item_type == "function":
-                # Look for function definitions or calls
-                def_pattern = fr"def\s+{re.escape(item_name)}\s*\("
-                call_pattern = fr"[^a-zA-Z0-9_]{re.escape(item_name)}\s*\("
-                
-                for i, line in enumerate(lines):
-                    if re.search(def_pattern, line):
-                        results.append({
-                            "type": "function_definition",
-                            "name": item_name,
-                            "line": i + 1,
-                            "content": line
-                        })
-                    elif re.search(call_pattern, line):
-                        results.append({
-                            "type": "function_call",
-                            "name": item_name,
-                            "line": i + 1,
-                            "content": line
-                        })
-            else:
-                # Look for variable assignments or usages
-                for i, line in enumerate(lines):
-                    if re.search(fr"[^a-zA-Z0-9_]{re.escape(item_name)}\s*=", line):
-                        results.append({
-                            "type": "variable_assignment",
-                            "name": item_name,
-                            "line": i + 1,
-                            "content": line
-                        })
-                    elif re.search(fr"[^a-zA-Z0-9_]{re.escape(item_name)}[^a-zA-Z0-9_]", line):
-                        results.append({
-                            "type": "variable_usage",
-                            "name": item_name,
-                            "line": i + 1,
-                            "content": line
-                        })
+        # Read the definition and its context in one slice, then split it on line boundaries
+        if overlay_file is not None:
+            span = lines[context_start - 1:context_end]
+        else:
+            span = _read_lines(match["file_id"], offsets, context_start, context_end).split("\n")
+            if context_end == line_count and len(span) > 1 and span[-1] == "":
+                # The offsets count the empty line after a final line feed, which is not part of the file
+                span.pop()
+        before_count = first_line - context_start
+        definition_count = last_line - first_line + 1
         
-        # Match line numbers from tracebacks to the file
-        for pattern in error_patterns:
-            if pattern["type"] == "traceback" and "line" in pattern:
-                line_num = pattern["line"] - 1  # Convert to 0-indexed
-                if 0 <= line_num < len(lines):
-                    results.append({
-                        "type": "traceback_line",
-                        "line": pattern["line"],
-                        "content": lines[line_num],
-                        "context": pattern["context"]
-                    })
+        return {
+            "found": True,
+            "entity_type": match["entity_type"],
+            "class_name": match["class_name"],
+            "start_line": first_line,
+            "end_line": last_line,
+            "content": "\n".join(span[before_count:before_count + definition_count]),
+            "context_before": "\n".join(span[:before_count]),
+            "context_after": "\n".join(span[before_count + definition_count:]),
+            "other_matches": [
+                {"entity_type": other["entity_type"], "class_name": other["class_name"], "start_line": other["start_line"]}
+                for other in matches[1:]
+            ]
+        }
+    
+    @tool
+    def identify_issue_patterns(file_content: str, issue_description: str,
+                                max_results_per_name: int = DEFAULT_MAX_RESULTS_PER_NAME) -> List[Dict[str, Any]]:
+        """
+        Identify patterns in the file that may be causing the issue.
         
-        return results
+        Args:
+            file_content: Content of the file
+            issue_description: Description of the GitHub issue
+            max_results_per_name: Maximum number of calls or usages reported per name;
+                definitions and assignments are always reported
+            
+        Returns:
+            List of dictionaries with information about each potential issue location
+        """
+        return find_issue_patterns(file_content, issue_description, max_results_per_name)
     
     @tool
     def apply_patch_to_content(original_content: str, patch_operations: List[Dict[str, Any]]) -> str:
         """
         Apply a series of patch operations to the file content.
+        Line numbers of all operations refer to the original content, and operations must not overlap.
         
         Args:
             original_content: Original file content
@@ -234,35 +478,17 @@ def patch_tools():
         Returns:
             The modified file content
         """
-        lines = original_content.splitlines()
-        
-        # Sort operations in reverse order by line number
-        # to prevent line number shifts affecting later operations
-        sorted_ops = sorted(patch_operations, key=lambda op: op["start_line"], reverse=True)
-        
-        for op in sorted_ops:
-            operation = op["operation"]
-            # Convert to 0-indexed for internal operations
-            start_idx = op["start_line"] - 1
-            
-            if operation == "replace":
-                end_idx = op["end_line"] - 1
-                new_content = op["content"].splitlines()
-                lines[start_idx:end_idx+1] = new_content
-            
-            elif operation == "insert":
-                new_content = op["content"].splitlines()
-                lines[start_idx:start_idx] = new_content
-            
-            elif operation == "delete":
-                end_idx = op["end_line"] - 1
-                lines[start_idx:end_idx+1] = []
-        
-        return "\n".join(lines)
+        return apply_operations(original_content, patch_operations)
     
     return {
         "generate_diff": generate_diff,
+        "edit_file": edit_file,
+        "apply_diff": apply_diff,
+        "view_working_copy": view_working_copy,
+        "get_working_diff": get_working_diff,
+        "reset_working_copy": reset_working_copy,
         "extract_method_context": extract_method_context,
+        "extract_definition_context": extract_definition_context,
         "identify_issue_patterns": identify_issue_patterns,
         "apply_patch_to_content": apply_patch_to_content
     }
\ No newline at end of file
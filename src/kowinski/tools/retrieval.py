@@ -0,0 +1,270 @@
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+# Identifiers and words in code, docstrings and issue text
+_IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+# Sub-words of a camelCase / PascalCase identifier, keeping acronyms together (HTTPServer -> HTTP, Server)
+_CAMEL_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+
+# Very common English and Python words that carry no signal for localization
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have if in into is it its not of on or that the
+this to was were will with when which while what where who why how can could should would
+do does did so than then there these those they we you your i me my our he she his her them
+self cls def class return none true false import pass
+""".split())
+
+def split_identifier(identifier: str) -> List[str]:
+    """
+    Split an identifier on underscores and case changes.
+
+    Args:
+        identifier: An identifier such as `get_file_by_path` or `HTTPServerError`.
+
+    Returns:
+        The lowercase sub-words of the identifier, e.g. ['http', 'server', 'error'].
+    """
+    return [
+        part.lower()
+        for chunk in identifier.split("_")
+        for part in _CAMEL_RE.findall(chunk)
+    ]
+
+def tokenize(content: str) -> List[str]:
+    """
+    Tokenize code or natural language for lexical retrieval.
+
+    Every identifier is kept whole (lowercased) and, when it is compound, also
+    split into its sub-words, so that `parse_repository` in an issue matches
+    both the exact name and code mentioning "repository".
+
+    Args:
+        content: The text to tokenize.
+
+    Returns:
+        The list of tokens, with stopwords and single characters removed.
+    """
+    tokens = []
+    for identifier in _IDENTIFIER_RE.findall(content):
+        whole = identifier.lower()
+        parts = split_identifier(identifier)
+        if len(parts) > 1 or (parts and parts[0] != whole):
+            tokens.extend(parts)
+        tokens.append(whole)
+    return [token for token in tokens if len(token) > 1 and token not in STOPWORDS]
+
+class BM25Index:
+    """
+    A BM25 index stored as a term-major (CSC style) sparse matrix in NumPy arrays.
+
+    The BM25 weight of every (term, document) pair is computed once at build time,
+    so scoring a query is a gather of the postings of its terms followed by a
+    single `np.bincount` over document ids.
+    """
+
+    def __init__(self, documents: List[List[str]], k1: float = 1.5, b: float = 0.75):
+        """
+        Build the index.
+
+        Args:
+            documents: The tokenized documents.
+            k1: BM25 term frequency saturation.
+            b: BM25 document length normalization.
+        """
+        self.vocabulary: Dict[str, int] = {}
+        self.num_documents = len(documents)
+
+        doc_ids = []
+        term_ids = []
+        term_counts = []
+        doc_lengths = np.zeros(self.num_documents, dtype=np.float64)
+        for doc_id, tokens in enumerate(documents):
+            doc_lengths[doc_id] = len(tokens)
+            for token, count in Counter(tokens).items():
+                term_id = self.vocabulary.setdefault(token, len(self.vocabulary))
+                doc_ids.append(doc_id)
+                term_ids.append(term_id)
+                term_counts.append(count)
+
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        tf = np.asarray(term_counts, dtype=np.float64)
+
+        # Sort the postings by term to get the CSC layout
+        order = np.argsort(term_ids, kind="stable")
+        doc_ids, term_ids, tf = doc_ids[order], term_ids[order], tf[order]
+        document_frequency = np.bincount(term_ids, minlength=len(self.vocabulary))
+        self.indptr = np.concatenate(([0], np.cumsum(document_frequency)))
+        self.indices = doc_ids
+
+        # Precompute the BM25 weight of every posting
+        avg_length = doc_lengths.mean() if self.num_documents else 0.0
+        idf = np.log1p((self.num_documents - document_frequency + 0.5) / (document_frequency + 0.5))
+        length_norm = k1 * (1 - b + b * doc_lengths[doc_ids] / max(avg_length, 1e-9))
+        self.data = idf[term_ids] * tf * (k1 + 1) / (tf + length_norm)
+
+    def score(self, query_tokens: List[str]) -> np.ndarray:
+        """
+        Score every document against a query.
+
+        Args:
+            query_tokens: The tokenized query. Repeated tokens weigh more.
+
+        Returns:
+            An array with the BM25 score of each document.
+        """
+        slices = []
+        weights = []
+        for token, count in Counter(query_tokens).items():
+            term_id = self.vocabulary.get(token)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            slices.append(self.indices[start:end])
+            weights.append(self.data[start:end] * count)
+
+        if not slices:
+            return np.zeros(self.num_documents)
+        return np.bincount(
+            np.concatenate(slices),
+            weights=np.concatenate(weights),
+            minlength=self.num_documents
+        )
+
+    def top_k(self, query_tokens: List[str], k: int) -> List[Tuple[int, float]]:
+        """
+        Get the best scoring documents for a query.
+
+        Args:
+            query_tokens: The tokenized query.
+            k: Number of documents to return.
+
+        Returns:
+            A list of (document id, score) pairs sorted by decreasing score,
+            excluding documents that share no term with the query.
+        """
+        scores = self.score(query_tokens)
+        k = min(k, self.num_documents)
+        if k <= 0:
+            return []
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in top if scores[doc_id] > 0]
+
+@dataclass
+class RankedCandidate:
+    """A file or code entity ranked by relevance to a query."""
+    entity_type: str  # "file", "function", or "class"
+    name: str
+    file_path: str
+    score: float
+    start_line: Optional[int] = None
+    end_line: Optional[int] = None
+    parent_name: Optional[str] = None  # Class name for methods
+
+class RepositoryRetriever:
+    """
+    Lexical retrieval over the files, functions and classes of an indexed repository.
+
+    Files are indexed on their path and content; functions and classes on their
+    name, enclosing class, arguments, decorators, docstring and source lines.
+    Names and paths are repeated so that they weigh more than body text.
+    """
+
+    def __init__(self, engine, k1: float = 1.5, b: float = 0.75):
+        """
+        Build the file and entity indexes from the repository database.
+
+        Args:
+            engine: SQLAlchemy engine of the repository database.
+            k1: BM25 term frequency saturation.
+            b: BM25 document length normalization.
+        """
+        with engine.connect() as conn:
+            files = pd.read_sql(text("""
+                SELECT id, relative_folder, file_name, content
+                FROM repofile
+                WHERE content != '[BINARY FILE]'
+                ORDER BY id
+            """), conn)
+            functions = pd.read_sql(text("""
+                SELECT file_id, name, start_line, end_line, args, class_name, decorators, docstring
+                FROM pythonfunction
+            """), conn)
+            classes = pd.read_sql(text("""
+                SELECT file_id, name, start_line, end_line, base_classes, decorators, docstring
+                FROM pythonclass
+            """), conn)
+
+        file_lines = {}
+        file_paths = {}
+        file_documents = []
+        self.files: List[Dict[str, Any]] = []
+        for row in files.itertuples(index=False):
+            path = os.path.join(row.relative_folder, row.file_name)
+            file_paths[row.id] = path
+            file_lines[row.id] = row.content.splitlines()
+            self.files.append({"file_path": path})
+            file_documents.append(tokenize(path) * 3 + tokenize(row.content))
+
+        entity_documents = []
+        self.entities: List[Dict[str, Any]] = []
+        for entity_type, entities in (("function", functions), ("class", classes)):
+            for row in entities.itertuples(index=False):
+                if row.file_id not in file_paths:
+                    continue
+                parent_name = getattr(row, "class_name", None)
+                signature = " ".join(
+                    str(value) for value in (
+                        getattr(row, "args", None),
+                        getattr(row, "base_classes", None),
+                        row.decorators,
+                        row.docstring,
+                    ) if isinstance(value, str)
+                )
+                body = "\n".join(file_lines[row.file_id][row.start_line - 1:row.end_line])
+                names = f"{row.name} {parent_name if isinstance(parent_name, str) else ''}"
+                self.entities.append({
+                    "entity_type": entity_type,
+                    "name": row.name,
+                    "file_path": file_paths[row.file_id],
+                    "start_line": int(row.start_line),
+                    "end_line": int(row.end_line),
+                    "parent_name": parent_name if isinstance(parent_name, str) else None,
+                })
+                entity_documents.append(tokenize(names) * 3 + tokenize(signature) + tokenize(body))
+
+        self.file_index = BM25Index(file_documents, k1=k1, b=b)
+        self.entity_index = BM25Index(entity_documents, k1=k1, b=b)
+
+    def rank(self, query: str, k: int = 10) -> Dict[str, List[RankedCandidate]]:
+        """
+        Rank files and entities against a query.
+
+        Args:
+            query: Free text, typically an issue's problem statement.
+            k: Number of files and of entities to return.
+
+        Returns:
+            A dictionary with keys 'files' and 'entities', each a list of
+            RankedCandidate objects sorted by decreasing score.
+        """
+        query_tokens = tokenize(query)
+        files = [
+            RankedCandidate(entity_type="file", name=os.path.basename(self.files[doc_id]["file_path"]),
+                            file_path=self.files[doc_id]["file_path"], score=round(score, 4))
+            for doc_id, score in self.file_index.top_k(query_tokens, k)
+        ]
+        entities = [
+            RankedCandidate(score=round(score, 4), **self.entities[doc_id])
+            for doc_id, score in self.entity_index.top_k(query_tokens, k)
+        ]
+        return {"files": files, "entities": entities}
@@ -0,0 +1,260 @@
+"""
+Resolution of traceback frames in issue texts to files and entities of the index.
+
+Tracebacks quote the paths of the machine they ran on (site-packages, CI
+checkouts, virtualenvs), which never equal the relative paths of the index.
+Frames are matched on the longest common path suffix, through a trie of the
+indexed paths keyed by their reversed components, and each frame line is
+mapped to the innermost function or class containing it. A file name alone is
+not enough for an absolute path, since every environment has an __init__.py
+or a utils.py, and frames under site-packages, dist-packages or lib/pythonX.Y
+are only credited to the repository when the match covers the whole path
+below that folder, i.e. for the repository's own package installed there.
+"""
+
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from kowinski.parser.repo_parser import load_line_offsets
+
+# File "path", line 12, in name   (standard tracebacks, with either quote)
+_PYTHON_FRAME_RE = re.compile(r"""File ["']([^"'\n]+)["'], line (\d+)(?:, in ([^\s]+))?""")
+# path/to/file.py:12: in name   (pytest tracebacks)
+_PYTEST_FRAME_RE = re.compile(r"^\s*([^\s:]+\.py):(\d+):(?: in (\S+))?", re.MULTILINE)
+# Path components of installed packages and of the standard library
+_INSTALLED_COMPONENTS = {"site-packages", "dist-packages"}
+_PYTHON_LIB_RE = re.compile(r"python\d+(\.\d+)?", re.IGNORECASE)
+_ABSOLUTE_PATH_RE = re.compile(r"^([\\/]|[A-Za-z]:[\\/])")
+
+@dataclass
+class TracebackFrame:
+    """A frame quoted in a traceback."""
+    path: str
+    line: int
+    function: Optional[str]
+    position: int  # Order of the frame in the text, 0 for the first
+
+@dataclass
+class ResolvedFrame:
+    """A traceback frame matched to an indexed file and the entity containing its line."""
+    file_path: str
+    line: int
+    function: Optional[str]  # Name quoted in the traceback
+    traceback_path: str
+    match_depth: int  # Number of trailing path components shared with the indexed path
+    score: float
+    entity_type: Optional[str] = None  # "function" or "class"
+    entity_name: Optional[str] = None
+    parent_name: Optional[str] = None  # Class of a method
+    start_line: Optional[int] = None
+    end_line: Optional[int] = None
+    source_line: Optional[str] = None  # The indexed line, to check that it matches the traceback
+
+def parse_traceback_frames(issue_text: str) -> List[TracebackFrame]:
+    """
+    Extract the frames of all tracebacks in a text, standard or pytest formatted.
+
+    Args:
+        issue_text: Text of the issue.
+
+    Returns:
+        The frames in order of appearance, without repeats of the same path and line.
+    """
+    matches = []
+    for pattern in (_PYTHON_FRAME_RE, _PYTEST_FRAME_RE):
+        for match in pattern.finditer(issue_text):
+            matches.append((match.start(), match.group(1), int(match.group(2)), match.group(3)))
+    matches.sort()
+
+    frames = []
+    seen = set()
+    for _, path, line, function in matches:
+        if path.startswith("<") or (path, line) in seen:
+            continue  # <stdin>, <string>, <frozen ...> are not files
+        seen.add((path, line))
+        frames.append(TracebackFrame(path=path, line=line, function=function, position=len(frames)))
+    return frames
+
+def _path_components(path: str) -> List[str]:
+    return [part for part in re.split(r"[\\/]+", path) if part and part != "."]
+
+def _is_foreign_install(prefix: List[str]) -> bool:
+    """
+    Whether the unmatched components of a frame path lead into another installed package.
+
+    Under site-packages, dist-packages or lib/pythonX.Y, a frame is the repository's own
+    package only if the match covers the whole path below that folder, as for
+    site-packages/django/db/models/query.py in a django checkout.
+    """
+    last_install = None
+    for index, component in enumerate(prefix):
+        if component.lower() in _INSTALLED_COMPONENTS or (
+            index and prefix[index - 1].lower() in ("lib", "lib64") and _PYTHON_LIB_RE.fullmatch(component)
+        ):
+            last_install = index
+    return last_install is not None and last_install != len(prefix) - 1
+
+class PathSuffixIndex:
+    """
+    A trie of file paths keyed by their components in reverse order.
+
+    Looking up a path walks its components from the file name up, so the node
+    reached holds every indexed path sharing the longest suffix with it.
+    """
+
+    def __init__(self, paths: Dict[int, str]):
+        """
+        Args:
+            paths: Relative paths of the indexed files, by file id.
+        """
+        self.root: Dict = {}
+        for file_id, path in paths.items():
+            node = self.root
+            for component in reversed(_path_components(path)):
+                node = node.setdefault(component, {})
+                node.setdefault(None, []).append(file_id)
+
+    def lookup(self, path: str) -> Tuple[List[int], int]:
+        """
+        Find the indexed files sharing the longest path suffix with a path.
+
+        Args:
+            path: Any path, absolute or relative, with / or \\ separators.
+
+        Returns:
+            A tuple (file ids, depth) where depth is the number of shared trailing
+            components; no file ids when even the file name is not indexed.
+        """
+        node, depth = self.root, 0
+        for component in reversed(_path_components(path)):
+            if component not in node:
+                break
+            node, depth = node[component], depth + 1
+        return (node.get(None, []) if depth else []), depth
+
+class TracebackResolver:
+    """
+    Maps traceback frames to the files and entities of an indexed repository.
+    """
+
+    def __init__(self, engine):
+        """
+        Build the path suffix index from the repository database.
+
+        Args:
+            engine: SQLAlchemy engine of the repository database.
+        """
+        self.engine = engine
+        with engine.connect() as conn:
+            rows = conn.execute(text("SELECT id, relative_folder, file_name FROM repofile")).all()
+        self.paths = {int(file_id): os.path.join(folder, name) for file_id, folder, name in rows}
+        self.index = PathSuffixIndex(self.paths)
+
+    def _enclosing_entities(self, file_id: int, lines: List[int]) -> Dict[int, Tuple]:
+        """Find the innermost function or class containing each line of a file."""
+        query = """
+        SELECT 'function' AS entity_type, name, class_name, start_line, end_line, decorated_start_line
+        FROM pythonfunction WHERE file_id = :file_id
+        UNION ALL
+        SELECT 'class' AS entity_type, name, NULL AS class_name, start_line, end_line, decorated_start_line
+        FROM pythonclass WHERE file_id = :file_id
+        """
+        with self.engine.connect() as conn:
+            entities = conn.execute(text(query), {"file_id": file_id}).all()
+
+        enclosing = {}
+        for line in lines:
+            containing = [
+                entity for entity in entities
+                if (entity.decorated_start_line or entity.start_line) <= line <= entity.end_line
+            ]
+            if containing:
+                enclosing[line] = min(containing, key=lambda entity: entity.end_line - entity.start_line)
+        return enclosing
+
+    def _source_lines(self, file_id: int, lines: List[int]) -> Dict[int, str]:
+        """Read single lines of an indexed file."""
+        with self.engine.connect() as conn:
+            content, packed = conn.execute(
+                text("SELECT content, line_offsets FROM repofile WHERE id = :file_id"), {"file_id": file_id}
+            ).first()
+        offsets = load_line_offsets(packed) if packed else None
+        if offsets is None:
+            all_lines = content.splitlines()
+            return {line: all_lines[line - 1] for line in lines if 1 <= line <= len(all_lines)}
+
+        source = {}
+        for line in lines:
+            if 1 <= line <= len(offsets):
+                end = offsets[line] - 1 if line < len(offsets) else len(content)
+                source[line] = content[offsets[line - 1]:end].rstrip("\r")
+        return source
+
+    def resolve(self, issue_text: str, k: Optional[int] = None) -> List[ResolvedFrame]:
+        """
+        Resolve the traceback frames of an issue to indexed files and entities.
+
+        Frames outside the repository (the standard library, third-party packages)
+        are dropped: those under site-packages, dist-packages or lib/pythonX.Y whose
+        path below that folder does not match an indexed path entirely, and absolute
+        paths matching an indexed file on its name alone. The others are scored by their depth in the traceback, the
+        innermost frame scoring highest, by how much of their path matched, and by
+        whether the name quoted in the frame is the enclosing entity's.
+
+        Args:
+            issue_text: Text of the issue.
+            k: Maximum number of frames to return, None for all.
+
+        Returns:
+            The resolved frames sorted by decreasing score.
+        """
+        frames = parse_traceback_frames(issue_text)
+        matched: List[Tuple[TracebackFrame, int, int]] = []
+        for frame in frames:
+            file_ids, depth = self.index.lookup(frame.path)
+            if not file_ids:
+                continue
+            components = _path_components(frame.path)
+            if _is_foreign_install(components[:len(components) - depth]):
+                continue
+            # Among files sharing the same suffix, prefer the shortest path
+            file_id = min(file_ids, key=lambda file_id: (len(self.paths[file_id]), self.paths[file_id]))
+            if _ABSOLUTE_PATH_RE.match(frame.path) and depth < min(2, len(_path_components(self.paths[file_id]))):
+                continue  # Only the file name matched, as it would for any package's __init__.py
+            matched.append((frame, file_id, depth))
+
+        lines_by_file: Dict[int, List[int]] = {}
+        for frame, file_id, _ in matched:
+            lines_by_file.setdefault(file_id, []).append(frame.line)
+        entities = {file_id: self._enclosing_entities(file_id, lines) for file_id, lines in lines_by_file.items()}
+        sources = {file_id: self._source_lines(file_id, lines) for file_id, lines in lines_by_file.items()}
+
+        resolved = []
+        for frame, file_id, depth in matched:
+            path_components = len(_path_components(frame.path))
+            indexed_components = len(_path_components(self.paths[file_id]))
+            path_match = depth / max(min(path_components, indexed_components), 1)
+            recency = (frame.position + 1) / len(frames)
+            entity = entities[file_id].get(frame.line)
+            name_match = 1.0 if entity is not None and frame.function == entity.name else 0.5
+            resolved.append(ResolvedFrame(
+                file_path=self.paths[file_id],
+                line=frame.line,
+                function=frame.function,
+                traceback_path=frame.path,
+                match_depth=depth,
+                score=round(recency * path_match * name_match, 4),
+                entity_type=entity.entity_type if entity is not None else None,
+                entity_name=entity.name if entity is not None else None,
+                parent_name=entity.class_name if entity is not None else None,
+                start_line=entity.start_line if entity is not None else None,
+                end_line=entity.end_line if entity is not None else None,
+                source_line=sources[file_id].get(frame.line)
+            ))
+
+        resolved.sort(key=lambda frame: -frame.score)
+        return resolved if k is None else resolved[:k]
@@ -0,0 +1,394 @@
+"""
+Verification of candidate patches by running the tests they touch.
+
+Each candidate is materialized as a hardlinked copy of the repository, in which
+only the patched files are new files, so preparing a tree costs one link per
+file instead of a full copy. The tests importing the patched modules are
+selected from the index and run with pytest in a subprocess with a timeout and
+resource limits. Candidates are verified concurrently, each in its own tree.
+"""
+
+import ast
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+from smolagents import tool
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from kowinski.tools.code_analysis import create_read_only_engine
+from kowinski.tools.overlay import RepositoryOverlay
+from kowinski.tools.patch_engine import PatchError, apply_hunks, parse_unified_diff, split_lines
+
+DEFAULT_TIMEOUT = 300  # Seconds per candidate
+DEFAULT_MEMORY_LIMIT_MB = 4096  # Address space limit of the test process
+DEFAULT_MAX_WORKERS = 4
+# Characters of pytest output kept in a result
+MAX_OUTPUT_CHARS = 4000
+
+@dataclass
+class VerificationResult:
+    """Outcome of running the selected tests on a candidate patch."""
+    candidate_id: str
+    status: str  # "passed", "failed", "timeout", "no_tests" or "error"
+    passed: bool
+    selected_tests: List[str] = field(default_factory=list)
+    duration: float = 0.0  # Seconds, including materializing the tree
+    returncode: Optional[int] = None
+    output: str = ""  # End of the pytest output, or the error message
+
+def _is_test_file(file_path: str) -> bool:
+    name = os.path.basename(file_path)
+    return name.endswith(".py") and (name.startswith("test_") or name.endswith("_test.py")
+                                     or name in ("tests.py", "conftest.py"))
+
+def module_names(file_path: str) -> Set[str]:
+    """
+    Get the module names a Python file may be imported as.
+
+    The path is tried as is and without a leading source folder such as src/ or lib/.
+
+    Args:
+        file_path: Relative path of the file.
+
+    Returns:
+        Dotted module names, for example {"src.pkg.mod", "pkg.mod"} for src/pkg/mod.py.
+    """
+    parts = os.path.splitext(file_path)[0].split(os.sep)
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+    names = {".".join(parts)} if parts else set()
+    if len(parts) > 1 and parts[0] in ("src", "lib", "python"):
+        names.add(".".join(parts[1:]))
+    return names
+
+def imported_modules(source: str) -> Set[str]:
+    """
+    Get the modules imported by Python source, including `from package import module` targets.
+
+    Args:
+        source: Python source code.
+
+    Returns:
+        Dotted module names. Relative imports are left out.
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return set()
+    modules = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.add(node.module)
+            modules.update(f"{node.module}.{alias.name}" for alias in node.names)
+    return modules
+
+def select_tests(engine, touched_files: List[str]) -> List[str]:
+    """
+    Select the test files of the indexed repository that exercise the touched files.
+
+    A test file is selected when it is touched itself, when it imports one of the
+    touched modules or a module inside a touched package, or when it is named after
+    a touched module (test_<module>.py). Django style tests.py modules are test files too.
+
+    Args:
+        engine: SQLAlchemy engine of the repository database.
+        touched_files: Relative paths of the patched files.
+
+    Returns:
+        Relative paths of the selected test files, sorted.
+    """
+    touched_modules = set()
+    for file_path in touched_files:
+        if file_path.endswith(".py"):
+            touched_modules.update(module_names(file_path))
+    touched_stems = {os.path.splitext(os.path.basename(path))[0] for path in touched_files}
+
+    query = """
+    SELECT relative_folder, file_name, content FROM repofile
+    WHERE file_extension = 'py' AND (file_name LIKE 'test%' OR file_name LIKE '%_test.py')
+    """
+    with engine.connect() as conn:
+        rows = conn.execute(text(query)).all()
+
+    selected = set(path for path in touched_files if _is_test_file(path))
+    for folder, file_name, content in rows:
+        file_path = os.path.join(folder, file_name)
+        if not _is_test_file(file_path) or file_name == "conftest.py":
+            continue
+        stem = os.path.splitext(file_name)[0]
+        if stem.removeprefix("test_").removesuffix("_test") in touched_stems:
+            selected.add(file_path)
+            continue
+        for module in imported_modules(content):
+            # Importing a touched module itself, or a module of a touched package
+            if any(module == touched or module.startswith(touched + ".") for touched in touched_modules):
+                selected.add(file_path)
+                break
+    return sorted(selected)
+
+def _link_or_copy(source: str, destination: str):
+    """Hardlink a file, copying it when the destination is on another device."""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+def materialize_tree(repo_path: str, patched_files: Dict[str, str], destination: str) -> str:
+    """
+    Create a copy of a repository with some files replaced, hardlinking the others.
+
+    Patched files are written as new files, so the hardlinked originals are never modified.
+    Files the tests write to in place would be shared with the original repository, so
+    tests are run with bytecode writing disabled.
+
+    Args:
+        repo_path: Path to the repository.
+        patched_files: New content of the patched files, by relative path.
+        destination: Directory to create the copy in; must not exist.
+
+    Returns:
+        The destination directory.
+    """
+    shutil.copytree(
+        repo_path, destination,
+        copy_function=_link_or_copy,
+        ignore=shutil.ignore_patterns(".git", "__pycache__", "*.pyc"),
+        symlinks=True
+    )
+    for file_path, content in patched_files.items():
+        target = os.path.join(destination, file_path)
+        if os.path.exists(target):
+            os.unlink(target)  # Break the hardlink before writing
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "w", encoding="utf-8", newline="") as f:
+            f.write(content)
+    return destination
+
+# Sets the limits given as arguments, then replaces itself with the rest of the command line.
+# Unlike a preexec_fn, it runs nothing in the forked child of our multithreaded process.
+_LIMITS_WRAPPER = """
+import os, resource, sys
+memory_bytes, cpu_seconds = sys.argv[1:3]
+if memory_bytes:
+    resource.setrlimit(resource.RLIMIT_AS, (int(memory_bytes), int(memory_bytes)))
+if cpu_seconds:
+    resource.setrlimit(resource.RLIMIT_CPU, (int(cpu_seconds), int(cpu_seconds)))
+os.execv(sys.executable, [sys.executable, *sys.argv[3:]])
+"""
+
+def _with_limits(command: List[str], memory_limit_mb: Optional[int], cpu_seconds: Optional[int]) -> List[str]:
+    """Prefix a Python command so that it runs under resource limits, on POSIX systems."""
+    if os.name != "posix":
+        return command
+    memory_bytes = str(memory_limit_mb * 1024 * 1024) if memory_limit_mb is not None else ""
+    return [command[0], "-c", _LIMITS_WRAPPER, memory_bytes, str(cpu_seconds or ""), *command[1:]]
+
+def run_tests(tree_path: str, tests: List[str], timeout: float = DEFAULT_TIMEOUT,
+              memory_limit_mb: Optional[int] = DEFAULT_MEMORY_LIMIT_MB,
+              python_executable: str = sys.executable) -> subprocess.CompletedProcess:
+    """
+    Run test files with pytest in a subprocess, killing its process group on timeout.
+
+    Args:
+        tree_path: Root of the materialized repository.
+        tests: Relative paths of the test files.
+        timeout: Wall time limit in seconds.
+        memory_limit_mb: Address space limit of the test process, None for no limit.
+        python_executable: Python interpreter of the repository's environment.
+
+    Returns:
+        The completed process, with stdout holding the combined output.
+
+    Raises:
+        subprocess.TimeoutExpired: If the tests run longer than timeout.
+    """
+    command = [python_executable, "-m", "pytest", "-q", "-x", "-p", "no:cacheprovider", *tests]
+    python_path = os.pathsep.join(path for path in (tree_path, os.environ.get("PYTHONPATH")) if path)
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1", "PYTHONPATH": python_path}
+    process = subprocess.Popen(
+        _with_limits(command, memory_limit_mb, int(timeout) + 1),
+        cwd=tree_path,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        start_new_session=True  # Own process group, so the whole test run can be killed
+    )
+    try:
+        stdout, _ = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.communicate()
+        raise
+    return subprocess.CompletedProcess(command, process.returncode, stdout, None)
+
+def verify_candidate(repo_path: str, engine, candidate_id: str, patched_files: Dict[str, str],
+                     timeout: float = DEFAULT_TIMEOUT,
+                     memory_limit_mb: Optional[int] = DEFAULT_MEMORY_LIMIT_MB,
+                     python_executable: str = sys.executable) -> VerificationResult:
+    """
+    Run the tests selected for a candidate patch on a materialized copy of the repository.
+
+    Args:
+        repo_path: Path to the repository.
+        engine: SQLAlchemy engine of the repository database, used for test selection.
+        candidate_id: Name of the candidate in the result.
+        patched_files: New content of the patched files, by relative path.
+        timeout: Wall time limit of the test run in seconds.
+        memory_limit_mb: Address space limit of the test process, None for no limit.
+        python_executable: Python interpreter of the repository's environment.
+
+    Returns:
+        The VerificationResult of the candidate.
+    """
+    start = time.perf_counter()
+    try:
+        tests = select_tests(engine, list(patched_files))
+    except SQLAlchemyError as e:
+        return VerificationResult(
+            candidate_id=candidate_id, status="error", passed=False,
+            duration=time.perf_counter() - start, output=f"Test selection failed: {type(e).__name__}: {e}"
+        )
+    result = VerificationResult(candidate_id=candidate_id, status="no_tests", passed=False, selected_tests=tests)
+    if not tests:
+        result.duration = time.perf_counter() - start
+        return result
+
+    with tempfile.TemporaryDirectory(prefix="kowinski-verify-") as workdir:
+        try:
+            tree_path = materialize_tree(repo_path, patched_files, os.path.join(workdir, "repo"))
+            completed = run_tests(tree_path, tests, timeout, memory_limit_mb, python_executable)
+            result.returncode = completed.returncode
+            result.passed = completed.returncode == 0
+            result.status = "passed" if result.passed else "failed"
+            result.output = completed.stdout[-MAX_OUTPUT_CHARS:]
+        except subprocess.TimeoutExpired:
+            result.status = "timeout"
+            result.output = f"Tests did not finish within {timeout} seconds"
+        except OSError as e:
+            result.status = "error"
+            result.output = f"{type(e).__name__}: {e}"
+    result.duration = time.perf_counter() - start
+    return result
+
+def patched_files_from_diff(repo_path: str, diff: str) -> Dict[str, str]:
+    """
+    Apply a unified diff to the files of a repository on disk.
+
+    Args:
+        repo_path: Path to the repository.
+        diff: Unified diff with paths relative to the repository root.
+
+    Returns:
+        New content of the patched files, by relative path.
+
+    Raises:
+        PatchError: If the diff does not apply or patches no file.
+    """
+    file_patches = parse_unified_diff(diff)
+    if not file_patches:
+        raise PatchError("No file patch found in the diff")
+    patched_files = {}
+    for file_patch in file_patches:
+        if file_patch.path is None:
+            raise PatchError("Creating or deleting files is not supported")
+        if file_patch.path not in patched_files:
+            with open(os.path.join(repo_path, file_patch.path), encoding="utf-8", newline="") as f:
+                patched_files[file_patch.path] = f.read()
+        lines = split_lines(patched_files[file_patch.path])
+        patched_files[file_patch.path] = "".join(apply_hunks(lines, file_patch.hunks))
+    return patched_files
+
+def verify_patches(repo_path: str, candidates: Dict[str, str], db_path: str = "repository.db",
+                   engine=None, max_workers: int = DEFAULT_MAX_WORKERS, timeout: float = DEFAULT_TIMEOUT,
+                   memory_limit_mb: Optional[int] = DEFAULT_MEMORY_LIMIT_MB,
+                   python_executable: str = sys.executable) -> Dict[str, VerificationResult]:
+    """
+    Verify candidate patches concurrently, each on its own copy of the repository.
+
+    Args:
+        repo_path: Path to the repository.
+        candidates: Unified diffs of the candidates, by candidate id.
+        db_path: Path to the SQLite database of the indexed repository.
+        engine: Optional SQLAlchemy engine to query instead of opening db_path.
+        max_workers: Number of candidates tested at the same time.
+        timeout: Wall time limit of each test run in seconds.
+        memory_limit_mb: Address space limit of each test process, None for no limit.
+        python_executable: Python interpreter of the repository's environment.
+
+    Returns:
+        The VerificationResult of each candidate, by candidate id.
+    """
+    if engine is None:
+        engine = create_read_only_engine(db_path)
+
+    def verify(candidate_id: str, diff: str) -> VerificationResult:
+        start = time.perf_counter()
+        try:
+            patched_files = patched_files_from_diff(repo_path, diff)
+        except (PatchError, OSError) as e:
+            return VerificationResult(
+                candidate_id=candidate_id, status="error", passed=False,
+                duration=time.perf_counter() - start, output=f"Patch does not apply: {e}"
+            )
+        return verify_candidate(repo_path, engine, candidate_id, patched_files,
+                                timeout, memory_limit_mb, python_executable)
+
+    # Each worker thread waits on its own pytest subprocess, which does the actual work
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kowinski-verify") as executor:
+        futures = {candidate_id: executor.submit(verify, candidate_id, diff)
+                   for candidate_id, diff in candidates.items()}
+        return {candidate_id: future.result() for candidate_id, future in futures.items()}
+
+def verification_tools(repo_path: str, overlay: RepositoryOverlay, db_path: str = "repository.db",
+                       engine=None, timeout: float = DEFAULT_TIMEOUT,
+                       memory_limit_mb: Optional[int] = DEFAULT_MEMORY_LIMIT_MB,
+                       python_executable: str = sys.executable):
+    """
+    Tools running the tests of the repository against the files edited with the patch tools.
+
+    Args:
+        repo_path: Path to the repository on disk.
+        overlay: RepositoryOverlay shared with the patch tools.
+        db_path: Path to the SQLite database of the indexed repository.
+        engine: Optional SQLAlchemy engine to query instead of opening db_path.
+        timeout: Wall time limit of a test run in seconds.
+        memory_limit_mb: Address space limit of the test process, None for no limit.
+        python_executable: Python interpreter of the repository's environment.
+    """
+    if engine is None:
+        engine = create_read_only_engine(db_path)
+
+    @tool
+    def verify_working_copy() -> Dict[str, Any]:
+        """
+        Run the tests that import the edited files against the current working copies.
+
+        Returns:
+            Dictionary with status ("passed", "failed", "timeout", "no_tests" or "error"),
+            selected_tests, duration in seconds and the end of the test output
+        """
+        patched_files = {path: overlay.get(path).content for path in overlay.paths()}
+        if not patched_files:
+            return {"status": "error", "output": "No file has been edited"}
+        result = verify_candidate(repo_path, engine, "working_copy", patched_files,
+                                  timeout, memory_limit_mb, python_executable)
+        return {
+            "status": result.status,
+            "selected_tests": result.selected_tests,
+            "duration": round(result.duration, 2),
+            "output": result.output
+        }
+
+    return {"verify_working_copy": verify_working_copy}